@@ -1,23 +1,146 @@
+import argparse
+import asyncio
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 
+from app.admin.routers import admin_router
 from app.auth.routers import auth_router
+from app.auth.services import cleanup_sessions_periodically
 from app.author.routers import user_router
 from app.category.routers import category_router
+from app.commands import archive_posts
+from app.commands import export_posts
+from app.commands import import_posts
 from app.config import settings
 from app.db.auto_migrate import migrate
+from app.db.listener import pg_listener
+from app.db.partitions import maintain_partitions_periodically
+from app.deletion.routers import deletion_router
+from app.deletion.services import deletion_worker
+from app.health.routers import health_router
+from app.health.services import readiness
+from app.health.services import warm_up
+from app.logs import configure_logging
+from app.middleware.access_log import AccessLogMiddleware
+from app.middleware.admission import AdmissionMiddleware
+from app.middleware.compression import CompressionMiddleware
+from app.middleware.profiling import ProfilingMiddleware
+from app.middleware.request_scope import RequestScopeMiddleware
+from app.post.related import maintain_related_posts_periodically
 from app.post.routers import post_router
+from app.post.search import refresh_search_index_periodically
+from app.post.views import flush_views_periodically
+from app.static import CachedStaticFiles
+from app.static import precompress_directory
+from app.storage.routers import storage_router
+from app.tag.routers import tag_router
+from app.tag.services import refresh_tag_index_periodically
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start the background tasks of the app, the warmup among them, and stop
+    them on shutdown. The worker reports not ready while it shuts down.
+
+    Args:
+        app: The FastAPI app
+    """
+    tasks = [
+        asyncio.create_task(warm_up()),
+        asyncio.create_task(cleanup_sessions_periodically()),
+        asyncio.create_task(pg_listener.run()),
+        asyncio.create_task(refresh_tag_index_periodically()),
+        asyncio.create_task(refresh_search_index_periodically()),
+        asyncio.create_task(flush_views_periodically()),
+        asyncio.create_task(maintain_related_posts_periodically()),
+        asyncio.create_task(maintain_partitions_periodically()),
+        asyncio.create_task(deletion_worker.run()),
+    ]
+    yield
+    readiness.ready = False
+    for task in tasks:
+        task.cancel()
+    # let the tasks finish their cleanup, like the last flush of the post views
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+app = FastAPI(title="waifu", lifespan=lifespan)
 
-app = FastAPI(title="waifu")
+app.add_middleware(CompressionMiddleware, exclude_paths=("/static",))
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(RequestScopeMiddleware)
+# so shed requests cost nothing else
+app.add_middleware(AdmissionMiddleware)
+# outermost, so shed requests are logged too
+app.add_middleware(AccessLogMiddleware)
 
-app.mount("/static", StaticFiles(directory=settings.STATIC_PATH), name="static")
+app.mount("/static", CachedStaticFiles(directory=settings.STATIC_PATH), name="static")
 app.include_router(auth_router)
 app.include_router(user_router)
 
 app.include_router(post_router)
 app.include_router(category_router)
+app.include_router(tag_router)
+app.include_router(admin_router)
+app.include_router(deletion_router)
+app.include_router(storage_router)
+app.include_router(health_router)
 
-if __name__ == "__main__":
+
+def main() -> None:
+    """
+    Serve the app, or run one of the management commands.
+    """
+    parser = argparse.ArgumentParser(prog="python -m app")
+    commands = parser.add_subparsers(dest="command")
+    import_parser = commands.add_parser(
+        "import", help="import posts from a CSV or JSONL file"
+    )
+    import_parser.add_argument("path")
+    import_parser.add_argument("--batch-size", type=int)
+    import_parser.add_argument(
+        "--restart", action="store_true", help="ignore the checkpoint of the file"
+    )
+    export_parser = commands.add_parser(
+        "export", help="export posts to a Parquet or Arrow IPC file"
+    )
+    export_parser.add_argument(
+        "--format",
+        dest="export_format",
+        choices=("parquet", "arrow"),
+        default="parquet",
+    )
+    export_parser.add_argument("--output")
+    export_parser.add_argument(
+        "--since", help="the watermark of the previous export, for incremental exports"
+    )
+    archive_parser = commands.add_parser(
+        "archive", help="detach the partitions of old posts into the archive schema"
+    )
+    archive_parser.add_argument(
+        "--before", required=True, help="archive the months ending before this date"
+    )
+    args = parser.parse_args()
+
+    configure_logging()
     migrate()
-    uvicorn.run(app, host=settings.HOST, port=8000)
+    if args.command == "import":
+        import_posts.run(args.path, args.batch_size, args.restart)
+        return
+    if args.command == "export":
+        export_posts.run(args.export_format, args.output, args.since)
+        return
+    if args.command == "archive":
+        archive_posts.run(args.before)
+        return
+    precompress_directory(settings.STATIC_PATH)
+    # the access log is written by AccessLogMiddleware, the other uvicorn logs
+    # go through app.logs
+    uvicorn.run(app, host=settings.HOST, port=8000, access_log=False, log_config=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+from datetime import datetime
+from pathlib import Path
+
+from fastapi import Depends
+from fastapi import HTTPException
+from fastapi import Query
+from fastapi import Response
+from fastapi import status
+from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRouter
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.admin.schemas import AdmissionStats
+from app.admin.schemas import LogStats
+from app.admin.schemas import ProfileInfo
+from app.admin.schemas import ProfileRequest
+from app.admin.schemas import ProfileTargetRetrieve
+from app.admin.schemas import QueryFingerprint
+from app.auth.manager import verified_admin
+from app.config import settings
+from app.db.conection import get_async_session
+from app.db.models.author import Author
+from app.db.query_log import query_log
+from app.deletion.schemas import DeletionJobRetrieve
+from app.deletion.services import request_deletion
+from app.deletion.services import set_job_location
+from app.logs import log_sink
+from app.middleware.admission import admission_limiters
+from app.post.export import ChunkSink
+from app.post.export import EXPORT_FORMAT_PATTERN
+from app.post.export import EXPORT_FORMATS
+from app.post.export import pa
+from app.post.export import PostExport
+from app.profiling import list_profiles
+from app.profiling import ProfileTarget
+from app.profiling import request_profiler
+
+admin_router = APIRouter(prefix="/api/admin", tags=["admin"])
+
+PROFILE_FORMATS = {
+    "speedscope": (".speedscope.json", "application/json"),
+    "folded": (".folded", "text/plain"),
+}
+
+
+def target_retrieve(target: ProfileTarget) -> ProfileTargetRetrieve:
+    return ProfileTargetRetrieve(
+        remaining=target.remaining,
+        path=target.path,
+        header=target.header,
+        header_value=target.header_value,
+        interval_ms=target.interval * 1000,
+    )
+
+
+@admin_router.post("/profiling", response_model=ProfileTargetRetrieve)
+async def arm_profiler(
+    body: ProfileRequest, current_author: Author = Depends(verified_admin)
+):
+    """
+    Profile the next requests whose path starts with `path` and/or which have
+    the `header`, replacing the previous target
+
+    Args:
+        body: The requests to be profiled
+        current_author: The authenticated admin
+
+    Returns:
+        The armed target
+    """
+    target = ProfileTarget(
+        remaining=body.count,
+        path=body.path,
+        header=body.header,
+        header_value=body.header_value,
+        interval=body.interval_ms / 1000,
+    )
+    request_profiler.arm(target)
+    return target_retrieve(target)
+
+
+@admin_router.get("/profiling", response_model=ProfileTargetRetrieve | None)
+async def get_profiler_target(current_author: Author = Depends(verified_admin)):
+    """
+    get the armed profile target
+
+    Args:
+        current_author: The authenticated admin
+
+    Returns:
+        The armed target or null if the profiler is off
+    """
+    target = request_profiler.target
+    return target_retrieve(target) if target is not None else None
+
+
+@admin_router.delete("/profiling", status_code=status.HTTP_204_NO_CONTENT)
+async def disarm_profiler(current_author: Author = Depends(verified_admin)):
+    """
+    Turn the profiler off
+
+    Args:
+        current_author: The authenticated admin
+    """
+    request_profiler.disarm()
+
+
+@admin_router.get("/profiling/profiles", response_model=list[ProfileInfo])
+async def get_profiles(current_author: Author = Depends(verified_admin)):
+    """
+    get the written profiles, newest first, with the time spent in SQL,
+    serialization, password hashing, JWT and app code
+
+    Args:
+        current_author: The authenticated admin
+
+    Returns:
+        A list of profiles
+    """
+    return list_profiles()
+
+
+@admin_router.get("/profiling/profiles/{name}")
+async def download_profile(
+    name: str,
+    output_format: str = Query(
+        "speedscope", alias="format", pattern="^(speedscope|folded)$"
+    ),
+    current_author: Author = Depends(verified_admin),
+):
+    """
+    Download a profile as speedscope json or as folded stacks for flamegraph.pl
+
+    Args:
+        name: The name of the profile
+        output_format: "speedscope" or "folded"
+        current_author: The authenticated admin
+
+    Returns:
+        The profile file
+    """
+    suffix, media_type = PROFILE_FORMATS[output_format]
+    path = Path(settings.PROFILES_PATH) / f"{name}{suffix}"
+    if Path(name).name != name or not path.is_file():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found"
+        )
+    return FileResponse(path, media_type=media_type, filename=path.name)
+
+
+@admin_router.get("/queries", response_model=list[QueryFingerprint])
+async def get_query_stats(
+    order: str = Query("total_ms", pattern="^(total_ms|count|max_ms)$"),
+    limit: int = Query(50, ge=1, le=1000),
+    current_author: Author = Depends(verified_admin),
+):
+    """
+    get the statements run by this worker aggregated by fingerprint, with the
+    routes which ran them and the last sampled plan of the slow ones
+
+    Args:
+        order: Sort by "total_ms", "count" or "max_ms"
+        limit: The maximum number of fingerprints
+        current_author: The authenticated admin
+
+    Returns:
+        A list of fingerprints with their count, total, mean and max time
+    """
+    return query_log.top(order, limit)
+
+
+@admin_router.delete("/queries", status_code=status.HTTP_204_NO_CONTENT)
+async def reset_query_stats(current_author: Author = Depends(verified_admin)):
+    """
+    Reset the statement stats of this worker
+
+    Args:
+        current_author: The authenticated admin
+    """
+    query_log.reset()
+
+
+@admin_router.get("/admission", response_model=list[AdmissionStats])
+async def get_admission_stats(current_author: Author = Depends(verified_admin)):
+    """
+    Get the concurrency limits, active and queued requests and rejections of
+    every route class of this worker
+
+    Args:
+        current_author: The authenticated admin
+
+    Returns:
+        The stats of every route class
+    """
+    return [limiter.stats() for limiter in admission_limiters.values()]
+
+
+@admin_router.get("/logging", response_model=LogStats)
+async def get_log_stats(current_author: Author = Depends(verified_admin)):
+    """
+    Get the buffered, written, dropped and sampled out log records of this
+    worker
+
+    Args:
+        current_author: The authenticated admin
+
+    Returns:
+        The stats of the log buffer
+    """
+    return log_sink.stats()
+
+
+@admin_router.get("/export/posts")
+async def export_posts(
+    export_format: str = Query(
+        "parquet", alias="format", pattern=EXPORT_FORMAT_PATTERN
+    ),
+    since: datetime
+    | None = Query(
+        None, description="Only posts updated after the watermark of the last export"
+    ),
+    current_author: Author = Depends(verified_admin),
+):
+    """
+    Stream the posts with their author, category and tag names as Parquet or as
+    an Arrow IPC stream, one row group at a time. The watermark for the next
+    incremental export is stored in the schema metadata.
+
+    Args:
+        export_format: "parquet" or "arrow"
+        since: The watermark of the previous export
+        current_author: The authenticated admin
+
+    Returns:
+        The streamed file
+    """
+    if pa is None:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="The export needs pyarrow",
+        )
+    suffix, media_type = EXPORT_FORMATS[export_format]
+    export = PostExport(export_format, since, stream=True)
+
+    async def chunks():
+        sink = ChunkSink()
+        async for _ in export.write(pa.PythonFile(sink, mode="w")):
+            yield sink.take()
+        yield sink.take()
+
+    return StreamingResponse(
+        chunks(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="posts{suffix}"'},
+    )
+
+
+@admin_router.delete(
+    "/authors/{author_id}",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=DeletionJobRetrieve,
+)
+async def delete_author(
+    author_id: int,
+    response: Response,
+    session: AsyncSession = Depends(get_async_session),
+    current_author: Author = Depends(verified_admin),
+):
+    """
+    Delete an author with all their posts. The author is logged out at once,
+    the posts are deleted in the background, whose progress is at the
+    Location of the response.
+
+    Args:
+        author_id: The id of the author
+        response: The response, for the Location header
+        session: The database session
+        current_author: The authenticated admin
+
+    Returns:
+        The deletion job
+    """
+    author = await session.get(Author, author_id)
+    if author is None or author.deleted_at is not None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Author not found"
+        )
+    job = await request_deletion(session, "author", author_id, current_author.id)
+    set_job_location(response, job)
+    return job
@@ -0,0 +1,67 @@
+from pydantic import BaseModel
+from pydantic import Field
+from pydantic import model_validator
+
+from app.config import settings
+
+
+class ProfileRequest(BaseModel):
+    count: int = Field(1, ge=1, le=settings.PROFILE_MAX_REQUESTS)
+    path: str | None = None
+    header: str | None = None
+    header_value: str | None = None
+    interval_ms: float = Field(1, ge=0.1, le=100)
+
+    @model_validator(mode="after")
+    def check_target(self):
+        if self.path is None and self.header is None:
+            raise ValueError("path or header is required")
+        return self
+
+
+class ProfileTargetRetrieve(BaseModel):
+    remaining: int
+    path: str | None
+    header: str | None
+    header_value: str | None
+    interval_ms: float
+
+
+class QueryFingerprint(BaseModel):
+    fingerprint: str
+    count: int
+    total_ms: float
+    mean_ms: float
+    max_ms: float
+    slow: int
+    routes: dict[str, int]
+    last_plan: str | None
+
+
+class AdmissionStats(BaseModel):
+    route_class: str
+    limit: int
+    max_limit: int
+    active: int
+    queued: int
+    rejected: int
+    timed_out: int
+    latency_ms: float | None
+
+
+class LogStats(BaseModel):
+    capacity: int
+    queued: int
+    written: int
+    dropped: dict[str, int]
+    sampled_out: int
+
+
+class ProfileInfo(BaseModel):
+    name: str
+    method: str
+    path: str
+    status: int
+    duration_ms: float
+    samples: int
+    categories_ms: dict[str, float]
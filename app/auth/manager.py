@@ -1,19 +1,27 @@
+import secrets
 from datetime import datetime
 
 from fastapi import Depends
 from fastapi import HTTPException
+from fastapi import Request
 from fastapi import status
 from fastapi.security import HTTPBearer
 from fastapi.security import OAuth2PasswordBearer
-from jose import jwt
-from jose.exceptions import JWTError
 from passlib.context import CryptContext
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from app.auth.services import rotate_session
+from app.auth.tokens import claims_cache
+from app.auth.tokens import decode
+from app.auth.tokens import DECODE_ERRORS
+from app.auth.tokens import encode
 from app.config import settings
 from app.db.conection import get_async_session
+from app.db.invalidation import invalidation_bus
+from app.db.invalidation import InvalidationKey
 from app.db.models import Author
+from app.db.models.session import AuthSession
 
 security = HTTPBearer()
 
@@ -38,12 +46,13 @@ def create_access_jwt(data: dict[str, str]) -> str:
 
     data["exp"] = datetime.utcnow() + settings.JWT_ACCESS_EXP
     data["mode"] = "access_token"
-    return jwt.encode(data, settings.SECRET, settings.ALGORITHM)
+    return encode(data)
 
 
 def create_refresh_jwt(data: dict[str, str]) -> str:
     """
     Create a refresh token with the given data.
+    The data must contain the "jti" of the session the token belongs to.
 
     Args:
         data: The data to be encoded in the token
@@ -54,12 +63,16 @@ def create_refresh_jwt(data: dict[str, str]) -> str:
 
     data["exp"] = datetime.utcnow() + settings.JWT_REFRESH_EXP
     data["mode"] = "refresh_token"
-    return jwt.encode(data, settings.SECRET, settings.ALGORITHM)
+    # makes every rotated refresh token unique, even within the same second
+    data["nonce"] = secrets.token_urlsafe(8)
+    return encode(data)
 
 
 async def get_token_data(token: str = Depends(oauth_scheme)) -> dict[str, str]:
     """
     Get the data from the given token.
+    Verified claims are cached until the token expires, so a token reused
+    by a client is decoded and its signature checked only once per process.
 
     Args:
         token: The token to be decoded
@@ -68,16 +81,19 @@ async def get_token_data(token: str = Depends(oauth_scheme)) -> dict[str, str]:
         The decoded token data
     """
 
-    try:
-        data = jwt.decode(token, settings.SECRET, settings.ALGORITHM)
-        data["token"] = token
-    except JWTError:
-        raise ERROR
+    claims = claims_cache.get(token)
+    if claims is None:
+        try:
+            claims = decode(token)
+        except DECODE_ERRORS:
+            raise ERROR
 
-    if "user_email" not in data and "mode" not in data:
-        raise ERROR
+        if "user_email" not in claims or "mode" not in claims or "jti" not in claims:
+            raise ERROR
 
-    return data
+        claims_cache.put(token, claims)
+
+    return {**claims, "token": token}
 
 
 async def refresh_token(
@@ -98,23 +114,33 @@ async def refresh_token(
     if data["mode"] != "refresh_token":
         raise ERROR
 
-    stmt = select(Author).where(Author.email == data["user_email"])
-    result = await session.execute(stmt)
-    author = result.scalars().first()
+    payload = {"user_email": data["user_email"], "jti": data["jti"]}
+    refresh_tkn = create_refresh_jwt(dict(payload))
 
-    if not author or data["token"] != author.refresh_token:
+    # the tokens of the session cached by any worker are replaced
+    invalidation_bus.publish(session, InvalidationKey("session", data["jti"]))
+    if not await rotate_session(session, data["jti"], data["token"], refresh_tkn):
         raise ERROR
 
-    refresh_tkn = create_refresh_jwt(data)
-    author.refresh_token = refresh_tkn
-    await session.commit()
-
     # generate new access token
-    access_tkn = create_access_jwt(data)
+    access_tkn = create_access_jwt(payload)
     return {"access_token": access_tkn, "refresh_token": refresh_tkn, "type": "bearer"}
 
 
+def session_author_query(jti: str, email: str):
+    return (
+        select(Author)
+        .join(AuthSession, AuthSession.author_id == Author.id)
+        .where(
+            AuthSession.jti == jti,
+            AuthSession.expires_at > datetime.utcnow(),
+            Author.email == email,
+        )
+    )
+
+
 async def verified_author(
+    request: Request,
     data: str = Depends(get_token_data),
     session: AsyncSession = Depends(get_async_session),
     authorization: str = Depends(security),
@@ -123,6 +149,7 @@ async def verified_author(
     Verify the given token and return the user.
 
     Args:
+        request: The request, its state keeps the author id for the access log
         token: The token to be verified
         session: The database session
 
@@ -133,14 +160,30 @@ async def verified_author(
     if data["mode"] != "access_token":
         raise ERROR
 
-    stmt = select(Author).where(Author.email == data["user_email"])
-    result = await session.execute(stmt)
+    result = await session.execute(
+        session_author_query(data["jti"], data["user_email"])
+    )
     author = result.scalars().first()
 
     if not author:
         raise ERROR
 
-    if not author.refresh_token:
-        raise ERROR
+    request.state.author_id = author.id
+    return author
+
+
+async def verified_admin(author: Author = Depends(verified_author)) -> Author:
+    """
+    Verify the given token and return the user if it is an admin.
 
+    Args:
+        author: The authenticated author
+
+    Returns:
+        The admin associated with the token
+    """
+    if not author.isadmin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Admin rights required"
+        )
     return author
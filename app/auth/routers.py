@@ -1,30 +1,42 @@
+import asyncio
+
 from fastapi import Depends
+from fastapi import Header
 from fastapi import HTTPException
 from fastapi import status
 from fastapi.routing import APIRouter
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
 
 from app.auth.manager import create_access_jwt
 from app.auth.manager import create_refresh_jwt
 from app.auth.manager import get_token_data
 from app.auth.manager import refresh_token
-from app.auth.manager import verified_author
 from app.auth.schemas import UserLogin
+from app.auth.services import author_by_email_query
+from app.auth.services import create_session
+from app.auth.services import new_jti
+from app.auth.services import revoke_session
 from app.db.conection import get_async_session
-from app.db.models import Author
+from app.db.invalidation import invalidation_bus
+from app.db.invalidation import InvalidationKey
 
 auth_router = APIRouter(prefix="/api/auth", tags=["auth"])
 
 
 @auth_router.post("/login")
-async def login(body: UserLogin, session: AsyncSession = Depends(get_async_session)):
+async def login(
+    body: UserLogin,
+    session: AsyncSession = Depends(get_async_session),
+    user_agent: str | None = Header(default=None),
+):
     """
     Login the user with the given credentials.
+    Every login opens a separate session, so several devices can stay logged in.
 
     Args:
         body: The user credentials
         session: The database session
+        user_agent: The user agent of the device
 
     Returns:
         A dictionary with the user data and the access and refresh tokens
@@ -35,21 +47,22 @@ async def login(body: UserLogin, session: AsyncSession = Depends(get_async_sessi
         detail="wrong credentials",
     )
 
-    stmt = select(Author).where(Author.email == body.email)
-    result = await session.execute(stmt)
+    result = await session.execute(author_by_email_query(body.email))
     user = result.scalars().first()
 
-    if not user:
+    # authors being deleted can't log in again
+    if not user or user.deleted_at is not None:
         raise error
 
-    if not user.check_password(body.password):
+    # hashing takes tens of milliseconds of CPU, keep it off the event loop
+    if not await asyncio.to_thread(user.check_password, body.password):
         raise error
 
-    data = {"user_email": user.email}
-    access_token = create_access_jwt(data)
-    refresh_token = create_refresh_jwt(data)
+    data = {"user_email": user.email, "jti": new_jti()}
+    access_token = create_access_jwt(dict(data))
+    refresh_token = create_refresh_jwt(dict(data))
 
-    user.refresh_token = refresh_token
+    create_session(session, user.id, data["jti"], refresh_token, user_agent)
     await session.commit()
 
     return {
@@ -83,25 +96,19 @@ async def logout(
     session: AsyncSession = Depends(get_async_session),
 ):
     """
-    Logout user by invalidating the refresh token.
+    Logout user by revoking the session of the given token.
 
     Args:
-        token: The refresh token provided by the user.
+        data: The access or refresh token data of the session.
         session: The database session.
 
     Returns:
         A message indicating the user has been logged out.
     """
-    stmt = select(Author).where(Author.email == data["user_email"])
-    result = await session.execute(stmt)
-    user = result.scalars().first()
-
-    if user is None:
+    invalidation_bus.publish(session, InvalidationKey("session", data["jti"]))
+    if not await revoke_session(session, data["jti"]):
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+            status_code=status.HTTP_404_NOT_FOUND, detail="Session not found"
         )
 
-    user.refresh_token = None
-    await session.commit()
-
     return {"message": "Successfully logged out"}
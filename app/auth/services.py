@@ -0,0 +1,164 @@
+import asyncio
+import hashlib
+import uuid
+from datetime import datetime
+
+from loguru import logger
+from sqlalchemy import delete
+from sqlalchemy import select
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.db.conection import async_session_maker
+from app.db.models import Author
+from app.db.models.session import AuthSession
+
+
+def author_by_email_query(email: str):
+    return select(Author).where(Author.email == email)
+
+
+def new_jti() -> str:
+    """
+    Generate a new token id for a session.
+
+    Returns:
+        The token id
+    """
+    return uuid.uuid4().hex
+
+
+def hash_token(token: str) -> str:
+    """
+    Hash a refresh token so the raw value is never stored.
+
+    Args:
+        token: The refresh token
+
+    Returns:
+        The hex encoded sha256 digest of the token
+    """
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def create_session(
+    session: AsyncSession, author_id: int, jti: str, token: str, device: str = None
+) -> AuthSession:
+    """
+    Add a new login session for the given author to the database session.
+
+    Args:
+        session: The database session
+        author_id: The id of the author
+        jti: The token id of the session
+        token: The refresh token issued for the session
+        device: The user agent of the device
+
+    Returns:
+        The created session
+    """
+    auth_session = AuthSession(
+        jti=jti,
+        author_id=author_id,
+        token_hash=hash_token(token),
+        device=device[:255] if device else None,
+        expires_at=datetime.utcnow() + settings.JWT_REFRESH_EXP,
+    )
+    session.add(auth_session)
+    return auth_session
+
+
+async def rotate_session(
+    session: AsyncSession, jti: str, old_token: str, token: str
+) -> bool:
+    """
+    Replace the refresh token of a session if the old token is still the current one.
+
+    Args:
+        session: The database session
+        jti: The token id of the session
+        old_token: The refresh token presented by the client
+        token: The new refresh token
+
+    Returns:
+        True if the session was rotated, False if it is unknown, expired or reused
+    """
+    stmt = (
+        update(AuthSession)
+        .where(
+            AuthSession.jti == jti,
+            AuthSession.token_hash == hash_token(old_token),
+            AuthSession.expires_at > datetime.utcnow(),
+        )
+        .values(
+            token_hash=hash_token(token),
+            expires_at=datetime.utcnow() + settings.JWT_REFRESH_EXP,
+        )
+    )
+    result = await session.execute(stmt)
+    await session.commit()
+    return result.rowcount == 1
+
+
+async def revoke_session(session: AsyncSession, jti: str) -> bool:
+    """
+    Revoke a session by its token id.
+
+    Args:
+        session: The database session
+        jti: The token id of the session
+
+    Returns:
+        True if a session was revoked
+    """
+    result = await session.execute(delete(AuthSession).where(AuthSession.jti == jti))
+    await session.commit()
+    return result.rowcount == 1
+
+
+async def purge_expired_sessions(
+    session: AsyncSession, batch_size: int = settings.SESSION_CLEANUP_BATCH
+) -> int:
+    """
+    Delete expired sessions in bounded batches so no single statement holds
+    locks for long.
+
+    Args:
+        session: The database session
+        batch_size: The maximum number of rows deleted per statement
+
+    Returns:
+        The number of deleted sessions
+    """
+    total = 0
+    while True:
+        expired = (
+            select(AuthSession.jti)
+            .where(AuthSession.expires_at <= datetime.utcnow())
+            .limit(batch_size)
+        )
+        result = await session.execute(
+            delete(AuthSession)
+            .where(AuthSession.jti.in_(expired.scalar_subquery()))
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+        total += result.rowcount
+        if result.rowcount < batch_size:
+            return total
+
+
+async def cleanup_sessions_periodically() -> None:
+    """
+    Background task which purges expired sessions every SESSION_CLEANUP_INTERVAL seconds.
+    """
+    while True:
+        try:
+            async with async_session_maker() as session:
+                deleted = await purge_expired_sessions(session)
+            if deleted:
+                logger.info(f"Purged {deleted} expired sessions.")
+        except Exception as exc:
+            logger.warning(f"Session cleanup failed: {exc}")
+        await asyncio.sleep(settings.SESSION_CLEANUP_INTERVAL)
@@ -0,0 +1,206 @@
+import base64
+import calendar
+import hashlib
+import hmac
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from jose import jwt as jose_jwt
+from jose.exceptions import JWTError
+
+from app.config import settings
+from app.db.invalidation import ALL
+from app.db.invalidation import invalidation_bus
+
+HMAC_ALGORITHMS = {
+    "HS256": hashlib.sha256,
+    "HS384": hashlib.sha384,
+    "HS512": hashlib.sha512,
+}
+
+if settings.JWT_BACKEND == "hmac" and settings.ALGORITHM not in HMAC_ALGORITHMS:
+    raise RuntimeError(f"JWT_BACKEND 'hmac' does not support {settings.ALGORITHM}")
+
+
+class TokenError(Exception):
+    """
+    Raised by the hmac backend for malformed, forged or expired tokens.
+    """
+
+
+DECODE_ERRORS = (JWTError, TokenError)
+
+
+def _b64encode(raw: bytes) -> bytes:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=")
+
+
+def _b64decode(raw: bytes) -> bytes:
+    return base64.urlsafe_b64decode(raw + b"=" * (-len(raw) % 4))
+
+
+def _sign(signing_input: bytes) -> bytes:
+    digestmod = HMAC_ALGORITHMS[settings.ALGORITHM]
+    return hmac.new(settings.SECRET.encode(), signing_input, digestmod).digest()
+
+
+def _hmac_encode(data: dict) -> str:
+    claims = dict(data)
+    if isinstance(claims.get("exp"), datetime):
+        claims["exp"] = calendar.timegm(claims["exp"].utctimetuple())
+    header = _b64encode(
+        json.dumps(
+            {"alg": settings.ALGORITHM, "typ": "JWT"}, separators=(",", ":")
+        ).encode()
+    )
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    signing_input = header + b"." + payload
+    return (signing_input + b"." + _b64encode(_sign(signing_input))).decode()
+
+
+def _hmac_decode(token: str) -> dict:
+    try:
+        signing_input, signature = token.encode().rsplit(b".", 1)
+        header, payload = signing_input.split(b".")
+        if json.loads(_b64decode(header)).get("alg") != settings.ALGORITHM:
+            raise TokenError("unexpected algorithm")
+        if not hmac.compare_digest(_sign(signing_input), _b64decode(signature)):
+            raise TokenError("signature verification failed")
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, AttributeError) as exc:
+        raise TokenError("malformed token") from exc
+
+    if not isinstance(claims, dict):
+        raise TokenError("malformed token")
+    if "exp" in claims:
+        if not isinstance(claims["exp"], int) or claims["exp"] <= time.time():
+            raise TokenError("token expired")
+    return claims
+
+
+def encode(data: dict) -> str:
+    """
+    Encode and sign the given claims with the configured JWT backend.
+
+    Args:
+        data: The claims to be encoded
+
+    Returns:
+        The encoded token
+    """
+    if settings.JWT_BACKEND == "hmac":
+        return _hmac_encode(data)
+    return jose_jwt.encode(data, settings.SECRET, settings.ALGORITHM)
+
+
+def decode(token: str) -> dict:
+    """
+    Verify the signature and the claims of the given token with the configured
+    JWT backend.
+    The "hmac" backend only supports HS* algorithms and uses the C implemented
+    hmac module instead of python-jose.
+
+    Args:
+        token: The token to be decoded
+
+    Returns:
+        The decoded claims
+
+    Raises:
+        One of DECODE_ERRORS if the token is invalid or expired
+    """
+    if settings.JWT_BACKEND == "hmac":
+        return _hmac_decode(token)
+    return jose_jwt.decode(token, settings.SECRET, settings.ALGORITHM)
+
+
+class ClaimsCache:
+    """
+    Bounded per-process LRU cache of already verified token claims.
+
+    Entries are keyed by the sha256 digest of the token, so raw tokens are not
+    kept in memory, and are valid until the "exp" claim of the token.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._by_jti: dict[str, set[str]] = {}
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> dict | None:
+        """
+        Get the cached claims of the given token.
+
+        Args:
+            token: The token
+
+        Returns:
+            The claims or None if the token is not cached or has expired
+        """
+        key = self._key(token)
+        claims = self._entries.get(key)
+        if claims is None:
+            return None
+        if claims["exp"] <= time.time():
+            self._discard(key)
+            return None
+        self._entries.move_to_end(key)
+        return claims
+
+    def put(self, token: str, claims: dict) -> None:
+        """
+        Cache the verified claims of the given token.
+
+        Args:
+            token: The token
+            claims: The verified claims of the token
+        """
+        if self.maxsize <= 0 or "exp" not in claims:
+            return
+        key = self._key(token)
+        self._entries[key] = claims
+        self._entries.move_to_end(key)
+        if "jti" in claims:
+            self._by_jti.setdefault(claims["jti"], set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self._discard(next(iter(self._entries)))
+
+    def evict_session(self, jti: str) -> None:
+        """
+        Drop every cached token of the given session, e.g. on logout.
+
+        Args:
+            jti: The token id of the session
+        """
+        for key in self._by_jti.pop(jti, ()):
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._by_jti.clear()
+
+    def invalidate(self, jti: str) -> None:
+        if jti == ALL:
+            self.clear()
+        else:
+            self.evict_session(jti)
+
+    def _discard(self, key: str) -> None:
+        claims = self._entries.pop(key, None)
+        if claims is None or "jti" not in claims:
+            return
+        keys = self._by_jti.get(claims["jti"])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_jti[claims["jti"]]
+
+
+claims_cache = ClaimsCache(settings.JWT_CACHE_SIZE)
+invalidation_bus.register("session", claims_cache.invalidate)
@@ -1,46 +1,77 @@
-import os
-import shutil
-import uuid
+import asyncio
 
 from fastapi import Depends
-from fastapi import File
+from fastapi import Header
 from fastapi import HTTPException
+from fastapi import Query
+from fastapi import Response
 from fastapi import status
-from fastapi import UploadFile
 from fastapi.routing import APIRouter
+from sqlalchemy import and_
+from sqlalchemy import or_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.orm import load_only
+from sqlalchemy.orm import raiseload
+from sqlalchemy.orm import selectinload
 
 from app.auth.manager import create_access_jwt
 from app.auth.manager import create_refresh_jwt
 from app.auth.manager import verified_author
+from app.auth.services import author_by_email_query
+from app.auth.services import create_session
+from app.auth.services import new_jti
+from app.author.schemas import AuthorRetrieve
+from app.author.schemas import ImageKey
+from app.author.schemas import ImageUpload
+from app.author.schemas import ImageUploadTarget
 from app.author.schemas import PatchPassword
 from app.author.schemas import PatchProfile
 from app.author.schemas import Post
-from app.config import project_dir
 from app.config import settings
 from app.db.conection import get_async_session
 from app.db.models import Author
+from app.db.models.post import Post as PostModel
+from app.deletion.schemas import DeletionJobRetrieve
+from app.deletion.services import request_deletion
+from app.deletion.services import set_job_location
+from app.fields import parse_fields
+from app.fields import sparse_model
+from app.post.schemas import PostPage
+from app.post.services import convert_post_to_post_retrieve
+from app.post.services import convert_post_to_post_summary
+from app.post.services import decode_cursor
+from app.post.services import encode_cursor
+from app.storage.services import avatar_key
+from app.storage.services import DEFAULT_IMAGE
+from app.storage.services import delete_image
+from app.storage.services import image_url
+from app.storage.services import is_avatar_key
+from app.storage.services import object_store
 
 
 user_router = APIRouter(prefix="/api/author", tags=["author"])
 
 
 @user_router.post("/register", status_code=status.HTTP_201_CREATED)
-async def register(user_post: Post, session: AsyncSession = Depends(get_async_session)):
+async def register(
+    user_post: Post,
+    session: AsyncSession = Depends(get_async_session),
+    user_agent: str | None = Header(default=None),
+):
     """
     Register a new user.
 
     Args:
         user_post: The user data
         session: The database session
+        user_agent: The user agent of the device
 
     Returns:
         A dictionary with the user data and the access and refresh tokens
     """
 
-    stmt = select(Author).where(Author.email == user_post.email)
-    result = await session.execute(stmt)
+    result = await session.execute(author_by_email_query(user_post.email))
     existing_user = result.scalars().first()
 
     if existing_user:
@@ -48,22 +79,23 @@ async def register(user_post: Post, session: AsyncSession = Depends(get_async_se
             status_code=status.HTTP_400_BAD_REQUEST, detail="Email already taken"
         )
 
-    data = {"user_email": user_post.email}
-    access_token = create_access_jwt(data)
-    refresh_token = create_refresh_jwt(data)
+    data = {"user_email": user_post.email, "jti": new_jti()}
+    access_token = create_access_jwt(dict(data))
+    refresh_token = create_refresh_jwt(dict(data))
 
     user_obj = Author(
         username=user_post.username,
         surname=user_post.surname,
         email=user_post.email,
-        refresh_token=refresh_token,
     )
 
-    user_obj.password = user_post.password
+    # hashing takes tens of milliseconds of CPU, keep it off the event loop
+    await asyncio.to_thread(setattr, user_obj, "password", user_post.password)
 
     session.add(user_obj)
+    await session.flush()
+    create_session(session, user_obj.id, data["jti"], refresh_token, user_agent)
     await session.commit()
-    await session.refresh(user_obj)
 
     return {
         "user_id": user_obj.id,
@@ -117,66 +149,132 @@ async def change_password(
     Returns:
         A message indicating the password was updated
     """
-    if not author.check_password(author_patch.old_password):
+    if not await asyncio.to_thread(author.check_password, author_patch.old_password):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Wrong password"
         )
 
-    author.password = author_patch.new_password
+    await asyncio.to_thread(setattr, author, "password", author_patch.new_password)
     await session.commit()
     return {"message": "Password updated"}
 
 
-@user_router.get("/profile")
-async def get_profile(author: Author = Depends(verified_author)):
+@user_router.get(
+    "/profile", response_model=None, responses={200: {"model": AuthorRetrieve}}
+)
+async def get_profile(
+    fields: str = Query(None, description="Comma separated fields to return"),
+    author: Author = Depends(verified_author),
+):
     """
     get the user profile
 
     Args:
+        fields: Comma separated AuthorRetrieve fields to return, all by default
         author: The authenticated user
 
     Returns:
         The user profile
     """
-    return author.get_all
+    requested_fields = parse_fields(fields, AuthorRetrieve)
+    data = {
+        "id": author.id,
+        "username": author.username,
+        "surname": author.surname,
+        "email": author.email,
+        "image": image_url(author.image),
+        "isadmin": author.isadmin,
+        "created_at": author.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    if requested_fields is None:
+        return AuthorRetrieve(**data)
+    model = sparse_model(AuthorRetrieve, requested_fields)
+    return model(**{name: data[name] for name in requested_fields})
 
 
-@user_router.put("/profile/image")
-async def update_user_image(
-    image_file: UploadFile = File(...),
+@user_router.delete(
+    "/profile", status_code=status.HTTP_202_ACCEPTED, response_model=DeletionJobRetrieve
+)
+async def delete_profile(
+    response: Response,
     session: AsyncSession = Depends(get_async_session),
-    current_author: Author = Depends(verified_author),
+    author: Author = Depends(verified_author),
 ):
     """
-    update the user image file
+    delete the user with all their posts, the posts are deleted in the background
 
     Args:
-        image_file: The image file to be uploaded
+        response: The response, for the Location header of the deletion progress
         session: The database session
-        current_author: The authenticated user
+        author: The authenticated user
 
     Returns:
-        A message indicating the image was updated
+        The deletion job
     """
-    _, extension = os.path.splitext(image_file.filename)
+    job = await request_deletion(session, "author", author.id, author.id)
+    set_job_location(response, job)
+    return job
 
-    if extension not in [".jpg", ".jpeg", ".png", ".gif"]:
-        raise HTTPException(status_code=400, detail="Invalid file type")
 
-    filename = f"{uuid.uuid4()}{extension}"
-    file_location = settings.STATIC_PATH / filename
+@user_router.post("/profile/image/upload", response_model=ImageUploadTarget)
+async def create_image_upload(
+    image_upload: ImageUpload,
+    current_author: Author = Depends(verified_author),
+):
+    """
+    create a presigned URL to upload a new user image straight to the object
+    store, then set the image with its key
 
-    with file_location.open("wb") as buffer:
-        shutil.copyfileobj(image_file.file, buffer)
+    Args:
+        image_upload: The content type of the image
+        current_author: The authenticated user
+
+    Returns:
+        The key of the image and the request which uploads it
+    """
+    key = avatar_key(current_author.id, image_upload.content_type)
+    return ImageUploadTarget(
+        key=key,
+        url=object_store.presign_put(key, image_upload.content_type),
+        method="PUT",
+        headers={"Content-Type": image_upload.content_type},
+        expires_in=settings.STORAGE_UPLOAD_EXPIRES,
+    )
+
+
+@user_router.put("/profile/image")
+async def update_user_image(
+    image_key: ImageKey,
+    session: AsyncSession = Depends(get_async_session),
+    current_author: Author = Depends(verified_author),
+):
+    """
+    set the user image to an image uploaded with a URL of create_image_upload
 
-    await image_file.close()
+    Args:
+        image_key: The key of the uploaded image
+        session: The database session
+        current_author: The authenticated user
 
-    if current_author.image != "static/no_image.png":
-        image = project_dir.parent / current_author.image
-        image.unlink()
-    current_author.image = f"static/{filename}"
-    session.add(current_author)
+    Returns:
+        A message indicating the image was updated
+    """
+    key = image_key.key
+    if not is_avatar_key(key, current_author.id):
+        raise HTTPException(status_code=400, detail="Invalid image key")
+    size = await object_store.size(key)
+    if size is None:
+        raise HTTPException(status_code=400, detail="Image not uploaded")
+    if size > settings.AVATAR_MAX_SIZE:
+        await object_store.delete(key)
+        raise HTTPException(status_code=400, detail="Image too large")
+
+    old_image = current_author.image
+    if old_image == key:
+        return {"message": "Image updated"}
+    current_author.image = key
     await session.commit()
+    await delete_image(old_image)
 
     return {"message": "Image updated"}
 
@@ -187,7 +285,7 @@ async def delete_user_image(
     current_author: Author = Depends(verified_author),
 ):
     """
-    delete the user image file
+    delete the user image
 
     Args:
         session: The database session
@@ -196,12 +294,80 @@ async def delete_user_image(
     Returns:
         A message indicating the image was deleted
     """
-    if current_author.image == "static/no_image.png":
+    if current_author.image == DEFAULT_IMAGE:
         raise HTTPException(status_code=400, detail="No image to delete")
-    image = project_dir.parent / current_author.image
-    image.unlink()
-    current_author.image = "static/no_image.png"
-    session.add(current_author)
+    old_image = current_author.image
+    current_author.image = DEFAULT_IMAGE
     await session.commit()
+    await delete_image(old_image)
 
     return {"message": "Image deleted"}
+
+
+@user_router.get("/{author_id}/posts", response_model=PostPage)
+async def get_author_posts(
+    author_id: int,
+    cursor: str = None,
+    limit: int = Query(20, ge=1, le=100),
+    compact: bool = False,
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Get the posts of an author, most recently updated first.
+    Pages are fetched with the next_cursor of the previous page.
+
+    Args:
+        author_id: The id of the author
+        cursor: The next_cursor of the previous page
+        limit: The maximum number of posts in the page
+        compact: Return only the id, title and updated_at of the posts
+        session: The database session
+
+    Returns:
+        The page of posts and the cursor of the next page
+    """
+    if compact:
+        query = select(PostModel).options(
+            load_only(PostModel.id, PostModel.title, PostModel.updated_at),
+            raiseload("*"),
+        )
+    else:
+        query = select(PostModel).options(
+            selectinload(PostModel.categories), selectinload(PostModel.tags)
+        )
+
+    query = (
+        query.filter(PostModel.author_id == author_id)
+        .order_by(PostModel.updated_at.desc(), PostModel.id)
+        .limit(limit + 1)
+    )
+
+    if cursor:
+        try:
+            updated_at, post_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+            )
+        query = query.filter(
+            or_(
+                PostModel.updated_at < updated_at,
+                and_(PostModel.updated_at == updated_at, PostModel.id > post_id),
+            )
+        )
+
+    result = await session.execute(query)
+    posts = result.scalars().all()
+
+    if not posts and not cursor and await session.get(Author, author_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Author not found"
+        )
+
+    next_cursor = None
+    if len(posts) > limit:
+        posts = posts[:limit]
+        next_cursor = encode_cursor(posts[-1].updated_at, posts[-1].id)
+
+    convert = convert_post_to_post_summary if compact else convert_post_to_post_retrieve
+    return PostPage(items=[convert(post) for post in posts], next_cursor=next_cursor)
@@ -2,6 +2,8 @@ from pydantic import BaseModel
 from pydantic import EmailStr
 from pydantic import Field
 
+from app.storage.services import AVATAR_TYPE_PATTERN
+
 
 class Post(BaseModel):
     email: EmailStr
@@ -19,3 +21,29 @@ class PatchProfile(BaseModel):
 class PatchPassword(BaseModel):
     old_password: str
     new_password: str = Field(min_length=8, max_length=20)
+
+
+class AuthorRetrieve(BaseModel):
+    id: int
+    username: str | None
+    surname: str | None
+    email: str
+    image: str | None
+    isadmin: bool
+    created_at: str
+
+
+class ImageUpload(BaseModel):
+    content_type: str = Field(pattern=AVATAR_TYPE_PATTERN)
+
+
+class ImageUploadTarget(BaseModel):
+    key: str
+    url: str
+    method: str
+    headers: dict[str, str]
+    expires_in: int
+
+
+class ImageKey(BaseModel):
+    key: str = Field(max_length=1000)
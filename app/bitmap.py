@@ -0,0 +1,231 @@
+from collections.abc import Iterable
+from collections.abc import Iterator
+
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+CHUNK_BYTES = (1 << CHUNK_BITS) // 8
+# containers with more values than this are stored as bitsets, like in roaring
+ARRAY_MAX = 4096
+
+
+# the positions of the set bits of every byte value
+BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+
+# bitsets are built and read through a bytearray, since every operation on a
+# 65536 bit int copies it
+def bitset_from(values: Iterable[int]) -> int:
+    data = bytearray(CHUNK_BYTES)
+    for value in values:
+        data[value >> 3] |= 1 << (value & 7)
+    return int.from_bytes(data, "little")
+
+
+def bitset_values(bits: int) -> Iterator[int]:
+    for position, byte in enumerate(bits.to_bytes(CHUNK_BYTES, "little")):
+        if byte:
+            base = position << 3
+            for bit in BYTE_BITS[byte]:
+                yield base | bit
+
+
+def bitset_filter(values: set[int], bits: int, keep: bool) -> set[int]:
+    data = bits.to_bytes(CHUNK_BYTES, "little")
+    return {
+        value for value in values if bool(data[value >> 3] >> (value & 7) & 1) == keep
+    }
+
+
+def copy_container(container: set[int] | int) -> set[int] | int:
+    return set(container) if isinstance(container, set) else container
+
+
+def container_len(container: set[int] | int) -> int:
+    return container.bit_count() if isinstance(container, int) else len(container)
+
+
+def compact(container: set[int] | int) -> set[int] | int | None:
+    """
+    Store a container in its smallest form, None if it is empty.
+    """
+    if isinstance(container, int):
+        count = container.bit_count()
+        if count == 0:
+            return None
+        return set(bitset_values(container)) if count <= ARRAY_MAX // 2 else container
+    if not container:
+        return None
+    return bitset_from(container) if len(container) > ARRAY_MAX else container
+
+
+def container_and(a: set[int] | int, b: set[int] | int) -> set[int] | int:
+    if isinstance(a, int) and isinstance(b, int):
+        return a & b
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        return bitset_filter(a, b, True)
+    return a & b
+
+
+def container_or(a: set[int] | int, b: set[int] | int) -> set[int] | int:
+    if isinstance(a, int) or isinstance(b, int):
+        a = a if isinstance(a, int) else bitset_from(a)
+        b = b if isinstance(b, int) else bitset_from(b)
+        return a | b
+    return a | b
+
+
+def container_sub(a: set[int] | int, b: set[int] | int) -> set[int] | int:
+    if isinstance(a, int):
+        return a & ~(b if isinstance(b, int) else bitset_from(b))
+    if isinstance(b, int):
+        return bitset_filter(a, b, False)
+    return a - b
+
+
+class Bitmap:
+    """
+    A compressed set of non-negative integers in the style of roaring bitmaps.
+
+    Values are split by their high 16 bits into chunks. A chunk holding up to
+    ARRAY_MAX values is a set, a denser chunk is a 65536 bit int bitset, so
+    sparse and dense bitmaps both stay small and set operations only touch the
+    chunks present in both operands.
+    """
+
+    __slots__ = ("chunks",)
+
+    def __init__(self, values: Iterable[int] = ()):
+        self.chunks: dict[int, set[int] | int] = {}
+        for value in values:
+            self.add(value)
+
+    @classmethod
+    def _from_chunks(cls, chunks: dict[int, set[int] | int]) -> "Bitmap":
+        bitmap = cls()
+        for key, container in chunks.items():
+            container = compact(container)
+            if container is not None:
+                bitmap.chunks[key] = container
+        return bitmap
+
+    def add(self, value: int) -> None:
+        key, low = value >> CHUNK_BITS, value & CHUNK_MASK
+        container = self.chunks.get(key)
+        if container is None:
+            self.chunks[key] = {low}
+        elif isinstance(container, int):
+            self.chunks[key] = container | 1 << low
+        else:
+            container.add(low)
+            if len(container) > ARRAY_MAX:
+                self.chunks[key] = bitset_from(container)
+
+    def discard(self, value: int) -> None:
+        key, low = value >> CHUNK_BITS, value & CHUNK_MASK
+        container = self.chunks.get(key)
+        if container is None:
+            return
+        if isinstance(container, int):
+            container &= ~(1 << low)
+        else:
+            container.discard(low)
+        container = compact(container)
+        if container is None:
+            del self.chunks[key]
+        else:
+            self.chunks[key] = container
+
+    def __contains__(self, value: int) -> bool:
+        container = self.chunks.get(value >> CHUNK_BITS)
+        if container is None:
+            return False
+        if isinstance(container, int):
+            return bool(container >> (value & CHUNK_MASK) & 1)
+        return value & CHUNK_MASK in container
+
+    def copy(self) -> "Bitmap":
+        bitmap = Bitmap()
+        bitmap.chunks = {
+            key: copy_container(container) for key, container in self.chunks.items()
+        }
+        return bitmap
+
+    def __len__(self) -> int:
+        return sum(container_len(container) for container in self.chunks.values())
+
+    def __bool__(self) -> bool:
+        return bool(self.chunks)
+
+    def __iter__(self) -> Iterator[int]:
+        for key in sorted(self.chunks):
+            container = self.chunks[key]
+            values = (
+                bitset_values(container)
+                if isinstance(container, int)
+                else sorted(container)
+            )
+            base = key << CHUNK_BITS
+            for low in values:
+                yield base | low
+
+    def __and__(self, other: "Bitmap") -> "Bitmap":
+        small, large = sorted((self.chunks, other.chunks), key=len)
+        return Bitmap._from_chunks(
+            {
+                key: container_and(container, large[key])
+                for key, container in small.items()
+                if key in large
+            }
+        )
+
+    def __or__(self, other: "Bitmap") -> "Bitmap":
+        chunks = self.copy().chunks
+        for key, container in other.chunks.items():
+            chunks[key] = (
+                container_or(chunks[key], container)
+                if key in chunks
+                else copy_container(container)
+            )
+        return Bitmap._from_chunks(chunks)
+
+    def __sub__(self, other: "Bitmap") -> "Bitmap":
+        return Bitmap._from_chunks(
+            {
+                key: (
+                    container_sub(container, other.chunks[key])
+                    if key in other.chunks
+                    else copy_container(container)
+                )
+                for key, container in self.chunks.items()
+            }
+        )
+
+    @staticmethod
+    def union(bitmaps: Iterable["Bitmap"]) -> "Bitmap":
+        arrays: dict[int, list[set[int]]] = {}
+        bitsets: dict[int, int] = {}
+        for bitmap in bitmaps:
+            for key, container in bitmap.chunks.items():
+                if isinstance(container, int):
+                    bitsets[key] = bitsets.get(key, 0) | container
+                else:
+                    arrays.setdefault(key, []).append(container)
+        chunks: dict[int, set[int] | int] = dict(bitsets)
+        for key, containers in arrays.items():
+            values = set().union(*containers)
+            chunks[key] = container_or(chunks[key], values) if key in chunks else values
+        return Bitmap._from_chunks(chunks)
+
+    @staticmethod
+    def intersection(bitmaps: Iterable["Bitmap"]) -> "Bitmap":
+        bitmaps = sorted(bitmaps, key=len)
+        if not bitmaps:
+            return Bitmap()
+        result = bitmaps[0].copy()
+        for bitmap in bitmaps[1:]:
+            if not result:
+                break
+            result = result & bitmap
+        return result
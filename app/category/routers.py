@@ -1,15 +1,24 @@
 from fastapi import APIRouter
 from fastapi import Depends
+from fastapi import Header
 from fastapi import HTTPException
+from fastapi import Response
 from fastapi import status
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.auth.manager import verified_author
 from app.category.schemas import CategoryRetrieve
+from app.category.services import bump_categories_version
+from app.category.services import category_catalogue
 from app.db.conection import get_async_session
+from app.db.invalidation import invalidation_bus
+from app.db.invalidation import InvalidationKey
 from app.db.models.author import Author
 from app.db.models.category import Category
+from app.deletion.schemas import DeletionJobRetrieve
+from app.deletion.services import request_deletion
+from app.deletion.services import set_job_location
 
 category_router = APIRouter(prefix="/api/category", tags=["categories"])
 
@@ -43,24 +52,35 @@ async def create_category(
 
     new_category = Category(name=name)
     session.add(new_category)
+    await session.flush()
+    await bump_categories_version(session)
+    invalidation_bus.publish(session, InvalidationKey("category", new_category.id))
     await session.commit()
 
     return new_category
 
 
-@category_router.get("/categories/", response_model=list[CategoryRetrieve])
-async def get_categories(session: AsyncSession = Depends(get_async_session)):
+@category_router.get(
+    "/categories/",
+    response_model=None,
+    responses={200: {"model": list[CategoryRetrieve]}, 304: {}},
+)
+async def get_categories(if_none_match: str | None = Header(default=None)):
     """
-    get all categories
+    get all categories from the in-memory catalogue, with the version of the
+    catalogue as ETag
 
     Args:
-        session: The database session
+        if_none_match: ETags of catalogues the client has cached
 
     Returns:
-        A list of all categories
+        A list of all categories, or 304 if the client has the current one
     """
-    result = await session.execute(select(Category))
-    return result.scalars().all()
+    snapshot = await category_catalogue.get()
+    headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+    if snapshot.matches(if_none_match):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(snapshot.body, media_type="application/json", headers=headers)
 
 
 @category_router.get("/categories/{category_id}", response_model=CategoryRetrieve)
@@ -78,7 +98,7 @@ async def get_category(
         The category with the given id
     """
     category = await session.get(Category, category_id)
-    if category is None:
+    if category is None or category.deleted_at is not None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Category not found"
         )
@@ -105,43 +125,51 @@ async def update_category(
         A message indicating the category has been updated
     """
     category = await session.get(Category, category_id)
-    if category is None:
+    if category is None or category.deleted_at is not None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Category not found"
         )
 
     category.name = name
+    await bump_categories_version(session)
+    invalidation_bus.publish(session, InvalidationKey("category", category_id))
 
     await session.commit()
     return {"message": "Category updated"}
 
 
 @category_router.delete(
-    "/categories/{category_id}", status_code=status.HTTP_204_NO_CONTENT
+    "/categories/{category_id}",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=DeletionJobRetrieve,
 )
 async def delete_category(
     category_id: int,
+    response: Response,
     session: AsyncSession = Depends(get_async_session),
     current_author: Author = Depends(verified_author),
 ):
     """
     Delete a category by its id if authenticated author is the creator of the category.
+    The category disappears at once, it is removed from its posts in the
+    background, whose progress is at the Location of the response.
 
     Args:
         category_id: The id of the category to be deleted
+        response: The response, for the Location header
         session: The database session
         current_author: The authenticated author
 
     Returns:
-        A message indicating the category has been deleted
+        The deletion job
     """
     category = await session.get(Category, category_id)
-    if category is None:
+    if category is None or category.deleted_at is not None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Category not found"
         )
 
-    await session.delete(category)
-    await session.commit()
-
-    return {"message": "Category deleted"}
+    await bump_categories_version(session)
+    job = await request_deletion(session, "category", category_id, current_author.id)
+    set_job_location(response, job)
+    return job
@@ -0,0 +1,117 @@
+"""
+In-memory catalogue of the categories.
+
+The categories change rarely and are listed on almost every page, so every
+worker keeps them as an immutable snapshot together with the JSON body and
+ETag of the list, and serves the list without the database. Every write to
+the categories increases their version in catalogue_versions in its
+transaction, and publishes a "category" invalidation, after which the
+workers reload the snapshot on the next request. The snapshot and its version
+are read from one REPEATABLE READ snapshot, so equal versions always mean
+equal lists in every worker.
+"""
+import asyncio
+import json
+from dataclasses import dataclass
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.conection import engine
+from app.db.invalidation import invalidation_bus
+from app.db.models.catalogue import CatalogueVersion
+from app.db.models.category import Category
+
+CATALOGUE = "categories"
+
+
+@dataclass(frozen=True)
+class CategorySnapshot:
+    version: int
+    categories: tuple[tuple[int, str], ...]
+    body: bytes
+    etag: str
+
+    @classmethod
+    def build(cls, version: int, categories: list[tuple[int, str]]):
+        body = json.dumps(
+            [{"id": id_, "name": name} for id_, name in categories],
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode()
+        return cls(version, tuple(categories), body, f'"categories-{version}"')
+
+    def matches(self, if_none_match: str | None) -> bool:
+        """
+        Check an If-None-Match header against the ETag, weakly since the
+        compression middleware weakens it.
+        """
+        if if_none_match is None:
+            return False
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or self.etag in tags
+
+
+async def bump_categories_version(session: AsyncSession) -> None:
+    """
+    Increase the version of the categories in the transaction of a write to
+    them, which also publishes its "category" invalidation.
+    """
+    await session.execute(increase_version_statement())
+
+
+def increase_version_statement():
+    statement = insert(CatalogueVersion).values(name=CATALOGUE, version=1)
+    return statement.on_conflict_do_update(
+        index_elements=[CatalogueVersion.name],
+        set_={"version": CatalogueVersion.version + 1},
+    )
+
+
+class CategoryCatalogue:
+    """
+    The current CategorySnapshot of the worker, loaded on first use and
+    reloaded on the next use after a "category" invalidation. A snapshot is
+    never replaced by one of an older version.
+    """
+
+    def __init__(self):
+        self.snapshot: CategorySnapshot | None = None
+        self._generation = 0
+        self._loaded_generation = -1
+        self._lock = asyncio.Lock()
+
+    def invalidate(self, *args) -> None:
+        self._generation += 1
+
+    async def get(self) -> CategorySnapshot:
+        if self.snapshot is not None and self._loaded_generation == self._generation:
+            return self.snapshot
+        async with self._lock:
+            if self.snapshot is None or self._loaded_generation != self._generation:
+                generation = self._generation
+                snapshot = await self.load()
+                if self.snapshot is None or snapshot.version >= self.snapshot.version:
+                    self.snapshot = snapshot
+                self._loaded_generation = generation
+        return self.snapshot
+
+    async def load(self) -> CategorySnapshot:
+        snapshot = engine.execution_options(isolation_level="REPEATABLE READ")
+        async with snapshot.connect() as connection:
+            version = await connection.scalar(
+                select(CatalogueVersion.version).filter(
+                    CatalogueVersion.name == CATALOGUE
+                )
+            )
+            result = await connection.execute(
+                select(Category.id, Category.name)
+                .filter(Category.deleted_at.is_(None))
+                .order_by(Category.id)
+            )
+            return CategorySnapshot.build(version or 0, [tuple(row) for row in result])
+
+
+category_catalogue = CategoryCatalogue()
+invalidation_bus.register("category", category_catalogue.invalidate)
@@ -0,0 +1,25 @@
+"""
+Archive of old posts: the monthly partitions of posts, post_categories and
+post_tags of the months ending before the given date are detached and moved to
+the POST_ARCHIVE_SCHEMA schema.
+
+Usage:
+    python -m app archive --before 2024-01-01
+"""
+from datetime import datetime
+from functools import partial
+
+from loguru import logger
+
+from app.db.partitions import archive_partitions
+from app.db.partitions import run_in_transaction
+
+
+def run(before: str) -> None:
+    archived = run_in_transaction(
+        partial(archive_partitions, before=datetime.fromisoformat(before))
+    )
+    if archived:
+        logger.success(f"Archived {', '.join(archived)}")
+    else:
+        logger.info(f"No partitions end before {before}")
@@ -0,0 +1,59 @@
+"""
+Export of posts with their author, categories and tags to a Parquet or Arrow
+IPC file for analytics, which needs pyarrow.
+
+Incremental exports pass the watermark stored in the metadata of the previous
+export, and contain only the posts updated after it. The watermark lags
+EXPORT_WATERMARK_LAG seconds behind the export, so posts updated shortly
+before an export are in the next one too; keep the latest row per id.
+Deleted posts are not part of incremental exports.
+
+Usage:
+    python -m app export [--format parquet|arrow] [--output posts.parquet]
+        [--since 2024-01-01T00:00:00]
+"""
+import asyncio
+import time
+from datetime import datetime
+from pathlib import Path
+
+from loguru import logger
+
+from app.post.export import EXPORT_FORMATS
+from app.post.export import pa
+from app.post.export import PostExport
+
+
+async def export_file(path: Path, export_format: str, since: datetime | None) -> None:
+    """
+    Export the posts updated after `since` to a file.
+
+    Args:
+        path: The path of the written file
+        export_format: "parquet" or "arrow"
+        since: The watermark of the previous export, None for all posts
+    """
+    export = PostExport(export_format, since)
+    started = time.perf_counter()
+    async for _ in export.write(str(path)):
+        logger.info(
+            f"{export.total} posts exported, "
+            f"{export.total / (time.perf_counter() - started):,.0f} posts/s"
+        )
+    watermark = export.watermark.isoformat() if export.watermark else "none"
+    logger.success(f"Exported {export.total} posts to {path}, watermark {watermark}")
+
+
+def run(
+    export_format: str, output: str | None = None, since: str | None = None
+) -> None:
+    if pa is None:
+        raise SystemExit(
+            "The export needs pyarrow, install it with pip install pyarrow"
+        )
+    path = Path(output or f"posts{EXPORT_FORMATS[export_format][0]}")
+    asyncio.run(
+        export_file(
+            path, export_format, datetime.fromisoformat(since) if since else None
+        )
+    )
@@ -0,0 +1,340 @@
+"""
+Bulk import of posts from a CSV or JSONL file.
+
+Each record has a title, description, author_email, category_names and
+tag_names, and optionally created_at and updated_at in ISO format. In CSV files
+the category and tag names are separated by "|". Missing categories and tags
+are created, records of unknown authors or with invalid fields are skipped.
+The partitions of the months of created_at are created when missing.
+
+Records are loaded in batches with COPY, each batch in one transaction together
+with the checkpoint of the file, so an interrupted import continues after the
+last committed batch when it is started again.
+
+Usage:
+    python -m app import posts.jsonl [--batch-size 10000] [--restart]
+"""
+import asyncio
+import csv
+import json
+import time
+from collections.abc import Iterator
+from datetime import datetime
+from datetime import timezone
+from itertools import islice
+from pathlib import Path
+
+import asyncpg
+from loguru import logger
+
+from app.category.services import CATALOGUE
+from app.config import settings
+from app.db.conection import engine
+from app.db.invalidation import INVALIDATION_CHANNEL
+from app.db.invalidation import InvalidationKey
+from app.db.listener import ASYNCPG_DSN
+from app.db.models.catalogue import CatalogueVersion
+from app.db.models.checkpoint import ImportCheckpoint
+from app.db.partitions import create_partitions
+from app.db.partitions import month_start
+
+NAMES_SEPARATOR = "|"
+TITLE_MAX = 50
+DESCRIPTION_MAX = 1000
+NAME_MAX = 50
+
+
+def read_records(path: Path) -> Iterator[dict | None]:
+    """
+    Stream the records of a CSV or JSONL file.
+
+    Args:
+        path: The path of the file, the format is chosen by its suffix
+
+    Returns:
+        An iterator of records, None for JSONL lines which are not JSON objects
+    """
+    with path.open(newline="", encoding="utf-8") as file:
+        if path.suffix.lower() == ".csv":
+            for row in csv.DictReader(file):
+                for key in ("category_names", "tag_names"):
+                    value = row.get(key) or ""
+                    row[key] = [name for name in value.split(NAMES_SEPARATOR) if name]
+                yield row
+        else:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield record if isinstance(record, dict) else None
+
+
+def parse_moment(value: str) -> datetime:
+    # the columns are naive UTC, values with an offset are converted
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def is_names(value) -> bool:
+    return isinstance(value, list) and all(isinstance(name, str) for name in value)
+
+
+def parse_record(record: dict | None, now: datetime) -> tuple | None:
+    """
+    Validate a record.
+
+    Args:
+        record: The record read from the file, None for an unreadable one
+        now: The default created_at and updated_at
+
+    Returns:
+        The title, description, author email, category names, tag names,
+        created_at and updated_at, or None if the record is invalid
+    """
+    if record is None:
+        return None
+    try:
+        title = record["title"]
+        description = record.get("description") or ""
+        email = record["author_email"]
+        category_names = record.get("category_names") or []
+        tag_names = record.get("tag_names") or []
+        if not (
+            isinstance(title, str)
+            and isinstance(description, str)
+            and isinstance(email, str)
+            and is_names(category_names)
+            and is_names(tag_names)
+        ):
+            return None
+        category_names = list(dict.fromkeys(category_names))
+        tag_names = list(dict.fromkeys(tag_names))
+        created_at = record.get("created_at")
+        created_at = parse_moment(created_at) if created_at else now
+        updated_at = record.get("updated_at")
+        updated_at = parse_moment(updated_at) if updated_at else created_at
+    except (KeyError, TypeError, ValueError, OverflowError):
+        return None
+    if (
+        not title
+        or len(title) > TITLE_MAX
+        or len(description) > DESCRIPTION_MAX
+        or any(len(name) > NAME_MAX for name in category_names + tag_names)
+    ):
+        return None
+    return title, description, email, category_names, tag_names, created_at, updated_at
+
+
+class PostImporter:
+    """
+    Load batches of records with one COPY per table, resolving authors,
+    categories and tags with one query per batch and caching their ids.
+    """
+
+    def __init__(self, connection: asyncpg.Connection, source: str):
+        self.connection = connection
+        self.source = source
+        self.authors: dict[str, int] = {}
+        self.categories: dict[str, int] = {}
+        self.tags: dict[str, int] = {}
+        self.months: set[datetime] = set()
+        self.imported = 0
+        self.skipped = 0
+
+    async def resolve_authors(self, emails: set[str]) -> None:
+        missing = list(emails - self.authors.keys())
+        if missing:
+            rows = await self.connection.fetch(
+                "SELECT id, email FROM authors WHERE email = ANY($1::text[])", missing
+            )
+            self.authors.update((row["email"], row["id"]) for row in rows)
+
+    async def resolve_names(
+        self, table: str, cache: dict[str, int], names: set[str]
+    ) -> int:
+        missing = list(names - cache.keys())
+        created = 0
+        if missing:
+            status = await self.connection.execute(
+                f"INSERT INTO {table} (name) SELECT unnest($1::text[]) "
+                "ON CONFLICT (name) DO NOTHING",
+                missing,
+            )
+            rows = await self.connection.fetch(
+                f"SELECT id, name FROM {table} WHERE name = ANY($1::text[])", missing
+            )
+            cache.update((row["name"], row["id"]) for row in rows)
+            created = int(status.split()[-1])
+        return created
+
+    async def publish_categories(self) -> None:
+        # the workers reload their catalogue of the categories once the batch
+        # commits, see app.category.services
+        await self.connection.execute(
+            f"INSERT INTO {CatalogueVersion.__tablename__} (name, version) "
+            "VALUES ($1, 1) ON CONFLICT (name) "
+            f"DO UPDATE SET version = {CatalogueVersion.__tablename__}.version + 1",
+            CATALOGUE,
+        )
+        message = {"source": "import", "keys": [str(InvalidationKey("category"))]}
+        await self.connection.execute(
+            "SELECT pg_notify($1, $2)", INVALIDATION_CHANNEL, json.dumps(message)
+        )
+
+    async def create_partitions(self, moments: list[datetime]) -> None:
+        months = {month_start(moment) for moment in moments} - self.months
+        if months:
+            async with engine.begin() as connection:
+                await create_partitions(connection, min(months), max(months))
+            self.months |= months
+
+    async def load_batch(self, records: list[tuple | None], position: int) -> None:
+        """
+        Load a batch of parsed records and save the checkpoint in one transaction.
+
+        Args:
+            records: The parsed records, None for invalid ones
+            position: The number of records of the file read after this batch
+        """
+        valid = [record for record in records if record is not None]
+        await self.create_partitions([record[5] for record in valid])
+        async with self.connection.transaction():
+            await self.resolve_authors({record[2] for record in valid})
+            if await self.resolve_names(
+                "categories",
+                self.categories,
+                {name for record in valid for name in record[3]},
+            ):
+                await self.publish_categories()
+            await self.resolve_names(
+                "tags", self.tags, {name for record in valid for name in record[4]}
+            )
+
+            valid = [record for record in valid if record[2] in self.authors]
+            post_ids = [
+                row[0]
+                for row in await self.connection.fetch(
+                    "SELECT nextval(pg_get_serial_sequence('posts', 'id')) "
+                    "FROM generate_series(1, $1)",
+                    len(valid),
+                )
+            ]
+
+            posts, categories, tags = [], [], []
+            for post_id, record in zip(post_ids, valid):
+                (
+                    title,
+                    description,
+                    email,
+                    category_names,
+                    tag_names,
+                    created,
+                    updated,
+                ) = record
+                posts.append(
+                    (
+                        post_id,
+                        title,
+                        description,
+                        self.authors[email],
+                        created,
+                        updated,
+                        1,
+                        0,
+                    )
+                )
+                categories.extend(
+                    (post_id, created, self.categories[name]) for name in category_names
+                )
+                tags.extend((post_id, created, self.tags[name]) for name in tag_names)
+
+            await self.connection.copy_records_to_table(
+                "posts",
+                records=posts,
+                columns=[
+                    "id",
+                    "title",
+                    "description",
+                    "author_id",
+                    "created_at",
+                    "updated_at",
+                    "version",
+                    "views",
+                ],
+            )
+            await self.connection.copy_records_to_table(
+                "post_categories",
+                records=categories,
+                columns=["post_id", "post_created_at", "category_id"],
+            )
+            await self.connection.copy_records_to_table(
+                "post_tags",
+                records=tags,
+                columns=["post_id", "post_created_at", "tag_id"],
+            )
+            await self.connection.execute(
+                f"INSERT INTO {ImportCheckpoint.__tablename__} "
+                "(source, position, updated_at) VALUES ($1, $2, $3) "
+                "ON CONFLICT (source) DO UPDATE "
+                "SET position = excluded.position, updated_at = excluded.updated_at",
+                self.source,
+                position,
+                datetime.utcnow(),
+            )
+
+        self.imported += len(valid)
+        self.skipped += len(records) - len(valid)
+
+
+async def import_posts(path: Path, batch_size: int, restart: bool) -> None:
+    """
+    Import the posts of a file, continuing after its last checkpoint.
+
+    Args:
+        path: The path of the CSV or JSONL file
+        batch_size: The number of records loaded per transaction
+        restart: Ignore the checkpoint and import the file from the start
+    """
+    source = str(path.resolve())
+    connection = await asyncpg.connect(ASYNCPG_DSN)
+    try:
+        position = 0
+        if not restart:
+            position = (
+                await connection.fetchval(
+                    f"SELECT position FROM {ImportCheckpoint.__tablename__} "
+                    "WHERE source = $1",
+                    source,
+                )
+                or 0
+            )
+        if position:
+            logger.info(f"Continuing the import of {path} after record {position}")
+
+        importer = PostImporter(connection, source)
+        records = islice(read_records(path), position, None)
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        while batch := [
+            parse_record(record, now) for record in islice(records, batch_size)
+        ]:
+            position += len(batch)
+            await importer.load_batch(batch, position)
+            elapsed = time.perf_counter() - started
+            logger.info(
+                f"{position} records read, {importer.imported} posts imported, "
+                f"{importer.skipped} skipped, {importer.imported / elapsed:,.0f} posts/s"
+            )
+    finally:
+        await connection.close()
+
+
+def run(path: str, batch_size: int | None = None, restart: bool = False) -> None:
+    asyncio.run(
+        import_posts(Path(path), batch_size or settings.IMPORT_BATCH_SIZE, restart)
+    )
@@ -21,6 +21,11 @@ class Settings(BaseSettings):
     POSTGRES_DB: str
 
     DB_PATH: Path = project_dir / "db"
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    # pool connections opened and warmed up at startup, see app.health.services
+    WARMUP_CONNECTIONS: int = 5
+    WARMUP_RETRY_INTERVAL: int = 5
     STATIC_PATH: Path = project_dir.parent / "static"
 
     HOST: str
@@ -30,6 +35,113 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     JWT_ACCESS_EXP: int = 10
     JWT_REFRESH_EXP: int = 10
+    JWT_BACKEND: str = "jose"
+    JWT_CACHE_SIZE: int = 10000
+
+    SESSION_CLEANUP_INTERVAL: int = 600
+    SESSION_CLEANUP_BATCH: int = 1000
+
+    LISTENER_PING_INTERVAL: int = 30
+    # "postgres" or "local", the in-process stand-in for tests
+    INVALIDATION_TRANSPORT: str = "postgres"
+    POST_STREAM_QUEUE_SIZE: int = 100
+    POST_STREAM_HEARTBEAT: int = 15
+    POST_STREAM_RETRY_MS: int = 3000
+    POST_STREAM_RESUME_LIMIT: int = 500
+    POST_IDS_MAX: int = 100
+
+    TAG_INDEX_MAX_SIZE: int = 200000
+    TAG_INDEX_SCAN_LIMIT: int = 2000
+    TAG_INDEX_REFRESH: int = 300
+
+    SEARCH_INDEX_ENABLED: bool = False
+    SEARCH_INDEX_MAX_POSTS: int = 1000000
+    SEARCH_INDEX_REFRESH: int = 600
+
+    COUNT_EXACT_MAX: int = 10000
+    COUNT_CACHE_SIZE: int = 1000
+    COUNT_CACHE_TTL: int = 60
+
+    VIEW_FLUSH_INTERVAL: int = 10
+    TRENDING_HALF_LIFE: int = 6 * 3600
+    TRENDING_LIMIT: int = 50
+
+    # see app.post.related
+    RELATED_POSTS_LIMIT: int = 20
+    RELATED_CATEGORY_WEIGHT: float = 1.0
+    RELATED_TAG_WEIGHT: float = 2.0
+    RELATED_FEATURE_MAX_POSTS: int = 10000
+    RELATED_UPDATE_INTERVAL: int = 5
+    RELATED_REBUILD_INTERVAL: int = 24 * 3600
+    RELATED_REBUILD_CHUNK: int = 1000
+
+    COMPRESSION_MIN_SIZE: int = 1024
+    COMPRESSION_OFFLOAD_SIZE: int = 256 * 1024
+    GZIP_LEVEL: int = 6
+    BROTLI_QUALITY: int = 4
+    STATIC_MAX_AGE: int = 3600
+
+    PROFILES_PATH: Path = project_dir.parent / "profiles"
+    PROFILE_MAX_REQUESTS: int = 100
+
+    # "json" or "text", see app.logs
+    LOG_FORMAT: str = "json"
+    LOG_LEVEL: str = "INFO"
+    LOG_BUFFER_SIZE: int = 10000
+    # the share of successful requests in the access log, per route path,
+    # e.g. {"/api/post/posts/{post_id}": 0.01}
+    LOG_ACCESS_SAMPLE_RATE: float = 1.0
+    LOG_ACCESS_SAMPLE_RATES: dict[str, float] = {}
+    LOG_ACCESS_SLOW_MS: float = 1000
+
+    SLOW_QUERY_MS: float = 200
+    SLOW_QUERY_EXPLAIN_RATE: float = 0.1
+    SLOW_QUERY_EXPLAIN_CONCURRENCY: int = 2
+    QUERY_STATS_MAX_SIZE: int = 1000
+
+    IMPORT_BATCH_SIZE: int = 10000
+    EXPORT_BATCH_SIZE: int = 50000
+    # the longest a post write may take from stamping updated_at to commit
+    EXPORT_WATERMARK_LAG: int = 300
+
+    POST_PARTITIONS_AHEAD: int = 3
+    POST_PARTITION_MAINTENANCE_INTERVAL: int = 24 * 3600
+    POST_ARCHIVE_SCHEMA: str = "archive"
+
+    DELETION_BATCH_SIZE: int = 1000
+    DELETION_BATCH_DELAY: float = 0.05
+    DELETION_POLL_INTERVAL: int = 5
+    DELETION_LEASE: int = 60
+
+    ADMISSION_ENABLED: bool = True
+    # concurrent requests and queued requests per route class, see
+    # app.middleware.admission
+    ADMISSION_LIMITS: dict[str, int] = {"read": 10, "search": 4, "write": 4, "auth": 2}
+    ADMISSION_QUEUE_SIZES: dict[str, int] = {
+        "read": 100,
+        "search": 20,
+        "write": 40,
+        "auth": 20,
+    }
+    ADMISSION_QUEUE_TIMEOUT: float = 2
+    ADMISSION_RETRY_AFTER: int = 1
+    ADMISSION_ADAPTIVE: bool = False
+    ADMISSION_LATENCY_TOLERANCE: float = 2
+
+    # "local" or "s3", see app.storage.services
+    STORAGE_BACKEND: str = "local"
+    STORAGE_LOCAL_PATH: Path = project_dir.parent / "static"
+    STORAGE_LOCAL_URL: str = "/static"
+    STORAGE_S3_ENDPOINT: str = "http://localhost:9000"
+    STORAGE_S3_BUCKET: str = "avatars"
+    STORAGE_S3_REGION: str = "us-east-1"
+    STORAGE_S3_ACCESS_KEY: str = ""
+    STORAGE_S3_SECRET_KEY: str = ""
+    # base URL of a CDN or public bucket, instead of presigned GET URLs
+    STORAGE_PUBLIC_URL: str | None = None
+    STORAGE_UPLOAD_EXPIRES: int = 600
+    STORAGE_DOWNLOAD_EXPIRES: int = 24 * 3600
+    AVATAR_MAX_SIZE: int = 5 * 1024 * 1024
 
 
 settings = Settings()
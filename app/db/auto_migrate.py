@@ -6,6 +6,9 @@ from loguru import logger
 
 from app.config import project_dir
 from app.config import settings
+from app.db.partitions import create_future_partitions
+from app.db.partitions import partition_existing_posts
+from app.db.partitions import run_in_transaction
 
 
 def migrate() -> None:
@@ -15,6 +18,9 @@ def migrate() -> None:
 
     alembic_cfg = Config(settings.DB_PATH / "alembic.ini")
 
+    # partitioning an existing table is not something autogenerate can do
+    run_in_transaction(partition_existing_posts)
+
     # Generate a new migration script
     command.revision(alembic_cfg, autogenerate=True, message="Auto-generated migration")
 
@@ -43,6 +49,8 @@ def migrate() -> None:
         command.upgrade(alembic_cfg, "head")
         logger.success("Migration applied.")
 
+    run_in_transaction(create_future_partitions)
+
 
 def is_migration_empty(migration_file_path: Path) -> bool:
     """
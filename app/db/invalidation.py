@@ -0,0 +1,197 @@
+"""
+Invalidation bus of the in-process caches of all workers.
+
+Write handlers publish typed keys like post:12 or session:<jti> in their
+database session. When the session commits, the keys reach every worker,
+which calls the callbacks registered for their kind; a rolled back session
+publishes nothing. Over Postgres the keys are sent with NOTIFY in the
+committing transaction and received on the shared listener connection, the
+local transport is an in-process stand-in for tests and single worker runs.
+
+A key with the id "*" invalidates a whole kind. Every cache is flushed when
+messages may have been missed, after the listener reconnected.
+"""
+import json
+import uuid
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.db.listener import pg_listener
+
+INVALIDATION_CHANNEL = "invalidations"
+INVALIDATION_KINDS = ("post", "category", "tag", "author", "session")
+ALL = "*"
+# NOTIFY payloads are limited to 8000 bytes
+PAYLOAD_MAX = 7500
+# session.info keys of the keys published in and committed by a session
+PENDING_KEYS = "invalidation_keys"
+COMMITTING_MESSAGE = "invalidation_message"
+
+
+@dataclass(frozen=True)
+class InvalidationKey:
+    kind: str
+    id: str = ALL
+
+    def __post_init__(self):
+        if self.kind not in INVALIDATION_KINDS:
+            raise ValueError(f"Unknown invalidation kind {self.kind}")
+        object.__setattr__(self, "id", str(self.id))
+
+    def __str__(self) -> str:
+        return f"{self.kind}:{self.id}"
+
+
+class PgNotifyTransport:
+    """
+    Sends the messages with NOTIFY in the committing transaction, so Postgres
+    delivers them to the listener of every worker only if it commits.
+    """
+
+    def attach(self, bus: "InvalidationBus") -> None:
+        pg_listener.listen(INVALIDATION_CHANNEL, bus.receive)
+        pg_listener.on_reconnect(bus.flush)
+
+    def prepare(self, session: Session, message: dict) -> None:
+        payload = json.dumps(message)
+        session.execute(select(func.pg_notify(INVALIDATION_CHANNEL, payload)))
+
+    def committed(self, bus: "InvalidationBus", message: dict) -> None:
+        pass
+
+
+class LocalTransport:
+    """
+    In-process stand-in delivering the messages to the other buses attached
+    to it once the session committed.
+    """
+
+    def __init__(self):
+        self.buses: list[InvalidationBus] = []
+
+    def attach(self, bus: "InvalidationBus") -> None:
+        self.buses.append(bus)
+
+    def prepare(self, session: Session, message: dict) -> None:
+        pass
+
+    def committed(self, bus: "InvalidationBus", message: dict) -> None:
+        payload = json.dumps(message)
+        for other in self.buses:
+            if other is not bus:
+                other.receive(payload)
+
+
+class InvalidationBus:
+    """
+    Publishes invalidation keys on commit and applies the received ones to the
+    callbacks registered for their kind. The publishing worker applies its
+    keys right after the commit, without waiting for its own notification.
+    """
+
+    def __init__(self, transport: PgNotifyTransport | LocalTransport):
+        self.transport = transport
+        self.source = uuid.uuid4().hex
+        self._callbacks: dict[str, list[Callable[[str], None]]] = {}
+        transport.attach(self)
+
+    def register(self, kind: str, callback: Callable[[str], None]) -> None:
+        """
+        Register a callback for the invalidations of a kind.
+
+        Args:
+            kind: One of INVALIDATION_KINDS
+            callback: The function called with the invalidated id, or with ALL
+                when every entry of the kind is invalid
+        """
+        if kind not in INVALIDATION_KINDS:
+            raise ValueError(f"Unknown invalidation kind {kind}")
+        self._callbacks.setdefault(kind, []).append(callback)
+
+    def publish(self, session, *keys: InvalidationKey) -> None:
+        """
+        Publish invalidation keys when the session commits.
+
+        Args:
+            session: The database session of the write
+            keys: The invalidated keys
+        """
+        session.info.setdefault(PENDING_KEYS, set()).update(map(str, keys))
+
+    def apply(self, keys: list[str]) -> None:
+        for key in keys:
+            kind, _, id_ = key.partition(":")
+            for callback in self._callbacks.get(kind, ()):
+                try:
+                    callback(id_)
+                except Exception as exc:
+                    logger.exception(f"Invalidation of {key} failed: {exc}")
+
+    def flush(self) -> None:
+        """
+        Invalidate every registered cache, used when invalidations may have
+        been missed.
+        """
+        logger.info("Flushing all invalidated caches.")
+        self.apply([str(InvalidationKey(kind)) for kind in self._callbacks])
+
+    def receive(self, payload: str) -> None:
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logger.warning("Invalid invalidation message, flushing all caches.")
+            self.flush()
+            return
+        if message["source"] != self.source:
+            self.apply(message["keys"])
+
+    def _message(self, keys: set[str]) -> dict:
+        message = {"source": self.source, "keys": sorted(keys)}
+        if len(json.dumps(message)) > PAYLOAD_MAX:
+            # too many keys for one notification, invalidate their kinds instead
+            kinds = {key.partition(":")[0] for key in keys}
+            message["keys"] = [str(InvalidationKey(kind)) for kind in sorted(kinds)]
+        return message
+
+    def _before_commit(self, session: Session) -> None:
+        keys = session.info.pop(PENDING_KEYS, None)
+        if keys:
+            message = self._message(keys)
+            self.transport.prepare(session, message)
+            session.info[COMMITTING_MESSAGE] = message
+
+    def _after_commit(self, session: Session) -> None:
+        message = session.info.pop(COMMITTING_MESSAGE, None)
+        if message is not None:
+            self.apply(message["keys"])
+            self.transport.committed(self, message)
+
+    def _after_rollback(self, session: Session, transaction) -> None:
+        session.info.pop(PENDING_KEYS, None)
+        session.info.pop(COMMITTING_MESSAGE, None)
+
+    def install(self, session_class: type[Session] = Session) -> None:
+        """
+        Hook the bus into the commits of the sessions of a class.
+
+        Args:
+            session_class: The synchronous session class of the session maker
+        """
+        event.listen(session_class, "before_commit", self._before_commit)
+        event.listen(session_class, "after_commit", self._after_commit)
+        event.listen(session_class, "after_soft_rollback", self._after_rollback)
+
+
+INVALIDATION_TRANSPORTS = {"postgres": PgNotifyTransport, "local": LocalTransport}
+
+invalidation_bus = InvalidationBus(
+    INVALIDATION_TRANSPORTS[settings.INVALIDATION_TRANSPORT]()
+)
+invalidation_bus.install()
@@ -0,0 +1,102 @@
+import asyncio
+from collections.abc import Callable
+
+import asyncpg
+from loguru import logger
+
+from app.config import settings
+
+ASYNCPG_DSN = f"postgresql://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}@{settings.POSTGRES_HOST}:{settings.POSTGRES_PORT}/{settings.POSTGRES_DB}"
+
+
+class PgListener:
+    """
+    One LISTEN connection per worker shared by every channel subscriber.
+
+    Callbacks registered with `listen` receive the payload of each NOTIFY on
+    their channel. Callbacks registered with `on_reconnect` are called after the
+    connection was lost and re-established, since notifications sent in between
+    are lost.
+    """
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self._channels: dict[str, list[Callable[[str], None]]] = {}
+        self._reconnect_callbacks: list[Callable[[], None]] = []
+        self._connection: asyncpg.Connection | None = None
+
+    def listen(self, channel: str, callback: Callable[[str], None]) -> None:
+        """
+        Register a callback for the notifications of a channel.
+        Must be called before `run` is started.
+
+        Args:
+            channel: The channel name
+            callback: The function called with the payload of each notification
+        """
+        self._channels.setdefault(channel, []).append(callback)
+
+    def on_reconnect(self, callback: Callable[[], None]) -> None:
+        """
+        Register a callback called when notifications may have been missed.
+
+        Args:
+            callback: The function to be called
+        """
+        self._reconnect_callbacks.append(callback)
+
+    def _dispatch(self, connection, pid, channel: str, payload: str) -> None:
+        for callback in self._channels.get(channel, ()):
+            try:
+                callback(payload)
+            except Exception as exc:
+                logger.exception(f"Listener callback for {channel} failed: {exc}")
+
+    async def run(self) -> None:
+        """
+        Keep the listener connection open, reconnecting with backoff when it is lost.
+        """
+        if not self._channels:
+            return
+
+        connected_before = False
+        backoff = 1
+        while True:
+            lost = asyncio.Event()
+            try:
+                self._connection = await asyncpg.connect(self.dsn)
+                self._connection.add_termination_listener(lambda _: lost.set())
+                for channel in self._channels:
+                    await self._connection.add_listener(channel, self._dispatch)
+
+                if connected_before:
+                    logger.warning("Listener reconnected, notifications may be lost.")
+                    for callback in self._reconnect_callbacks:
+                        callback()
+                connected_before = True
+                backoff = 1
+
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(
+                            lost.wait(), timeout=settings.LISTENER_PING_INTERVAL
+                        )
+                    except asyncio.TimeoutError:
+                        await self._connection.fetchval("SELECT 1", timeout=5)
+            except (
+                OSError,
+                asyncio.TimeoutError,
+                asyncpg.PostgresError,
+                asyncpg.InterfaceError,
+            ) as exc:
+                logger.warning(f"Listener connection failed: {exc}")
+            finally:
+                if self._connection is not None:
+                    self._connection.terminate()
+                    self._connection = None
+
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+
+pg_listener = PgListener(ASYNCPG_DSN)
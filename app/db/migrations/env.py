@@ -1,3 +1,4 @@
+import logging
 from logging.config import fileConfig
 
 from alembic import context
@@ -6,6 +7,7 @@ from sqlalchemy import pool
 
 from app.config import settings
 from app.db.models import Base
+from app.db.partitions import is_partition
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -21,7 +23,8 @@ config.set_section_option(section, "DB_PASS", settings.POSTGRES_PASSWORD)
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
-if config.config_file_name is not None:
+# When migrating at startup, the app has already set up logging, see app.logs
+if config.config_file_name is not None and not logging.getLogger().handlers:
     fileConfig(config.config_file_name)
 
 # add your model's MetaData object here
@@ -30,6 +33,21 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 target_metadata = Base.metadata
 
+
+def include_name(name, type_, parent_names):
+    # partitions are created and archived by app.db.partitions
+    return not (type_ == "table" and is_partition(name))
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    # postgres clones a foreign key to a partitioned table for every partition
+    return not (
+        type_ == "foreign_key_constraint"
+        and reflected
+        and is_partition(obj.referred_table.name)
+    )
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -54,6 +72,8 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_name=include_name,
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -71,7 +91,9 @@ def run_migrations_online():
     with connectable.connect() as connection:
         context.configure(
             connection=connection,
-            target_metadata=target_metadata
+            target_metadata=target_metadata,
+            include_name=include_name,
+            include_object=include_object,
             # other options here
         )
 
@@ -1,31 +1,50 @@
 from sqlalchemy import Column
+from sqlalchemy import DateTime
 from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKeyConstraint
+from sqlalchemy import Index
 from sqlalchemy import Integer
 from sqlalchemy import Table
 
 from app.db.conection import Base
 
+# both tables carry the created_at of their post and are partitioned like posts
 post_categories = Table(
     "post_categories",
     Base.metadata,
-    Column(
-        "post_id", Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True
-    ),
+    Column("post_id", Integer, primary_key=True),
+    Column("post_created_at", DateTime, primary_key=True),
     Column(
         "category_id",
         Integer,
         ForeignKey("categories.id", ondelete="CASCADE"),
         primary_key=True,
     ),
+    ForeignKeyConstraint(
+        ["post_id", "post_created_at"],
+        ["posts.id", "posts.created_at"],
+        ondelete="CASCADE",
+    ),
+    postgresql_partition_by="RANGE (post_created_at)",
 )
+# serves the batched deletion of categories and their foreign key cascade
+Index("ix_post_categories_category_id", post_categories.c.category_id)
 
 post_tags = Table(
     "post_tags",
     Base.metadata,
-    Column(
-        "post_id", Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True
-    ),
+    Column("post_id", Integer, primary_key=True),
+    Column("post_created_at", DateTime, primary_key=True),
     Column(
         "tag_id", Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True
     ),
+    ForeignKeyConstraint(
+        ["post_id", "post_created_at"],
+        ["posts.id", "posts.created_at"],
+        ondelete="CASCADE",
+    ),
+    postgresql_partition_by="RANGE (post_created_at)",
 )
+
+# serves the candidates of the related posts of a post, see app.post.related
+Index("ix_post_tags_tag_id", post_tags.c.tag_id)
@@ -23,11 +23,19 @@ class Author(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, onupdate=datetime.utcnow)
     isadmin = Column(Boolean, default=False, nullable=False)
-    refresh_token = Column(String(1000), nullable=True)
+    # set when the deletion was requested, the deletion worker removes the row
+    deleted_at = Column(DateTime)
 
     image = Column(String(1000), default="static/no_image.png")
 
-    posts = relationship("Post", back_populates="author", cascade="all, delete-orphan")
+    # posts are deleted in batches by the deletion worker, or by the foreign key
+    # cascade, never loaded into the session to be deleted one by one
+    posts = relationship(
+        "Post",
+        back_populates="author",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
 
     @property
     def password(self):
@@ -0,0 +1,17 @@
+from sqlalchemy import BigInteger
+from sqlalchemy import Column
+from sqlalchemy import String
+
+from app.db.conection import Base
+
+
+class CatalogueVersion(Base):
+    """
+    The version of a catalogue cached in memory by the workers, like the
+    categories, increased in the transaction of every write to it.
+    """
+
+    __tablename__ = "catalogue_versions"
+
+    name = Column(String(50), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
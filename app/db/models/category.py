@@ -21,5 +21,12 @@ class Category(Base):
 
     id = Column(Integer, primary_key=True)
     name = Column(String(50), nullable=False, unique=True)
+    # set when the deletion was requested, the deletion worker removes the row
+    deleted_at = Column(DateTime)
 
-    posts = relationship("Post", secondary=post_categories, back_populates="categories")
+    posts = relationship(
+        "Post",
+        secondary=post_categories,
+        back_populates="categories",
+        passive_deletes=True,
+    )
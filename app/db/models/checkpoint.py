@@ -0,0 +1,20 @@
+from datetime import datetime
+
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import Integer
+from sqlalchemy import String
+
+from app.db.conection import Base
+
+
+class ImportCheckpoint(Base):
+    """
+    The number of records of an import file committed so far.
+    """
+
+    __tablename__ = "import_checkpoints"
+
+    source = Column(String(1024), primary_key=True)
+    position = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
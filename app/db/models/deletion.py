@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import Integer
+from sqlalchemy import String
+
+from app.db.conection import Base
+
+
+class DeletionJob(Base):
+    """
+    Background deletion of an author with their posts, or of a category with
+    its post associations, see app.deletion.services.
+
+    updated_at is refreshed by every batch, a running job whose updated_at is
+    older than DELETION_LEASE seconds was abandoned and is taken over by
+    another worker.
+    """
+
+    __tablename__ = "deletion_jobs"
+
+    id = Column(Integer, primary_key=True)
+    # "author" or "category"
+    target = Column(String(16), nullable=False)
+    target_id = Column(Integer, nullable=False)
+    # the author who requested the deletion, no foreign key since authors
+    # delete themselves
+    requested_by = Column(Integer)
+    # "pending", "running" or "done", a failed batch puts the job back to pending
+    status = Column(String(16), nullable=False, default="pending", index=True)
+    deleted_posts = Column(Integer, nullable=False, default=0)
+    deleted_links = Column(Integer, nullable=False, default=0)
+    error = Column(String(1000))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
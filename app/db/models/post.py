@@ -1,8 +1,10 @@
 from datetime import datetime
 
+from sqlalchemy import BigInteger
 from sqlalchemy import Column
 from sqlalchemy import DateTime
 from sqlalchemy import ForeignKey
+from sqlalchemy import Index
 from sqlalchemy import Integer
 from sqlalchemy import String
 from sqlalchemy.orm import relationship
@@ -14,13 +16,23 @@ from app.db.models import post_tags
 
 class Post(Base):
     __tablename__ = "posts"
+    # monthly range partitions, see app.db.partitions
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
 
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     title = Column(String(50))
     description = Column(String(1000))
     author_id = Column(Integer, ForeignKey("authors.id", ondelete="CASCADE"))
-    created_at = Column(DateTime, default=datetime.utcnow)
+    # the partition key is part of the table's primary key, ids stay unique
+    # through their sequence
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow)
     updated_at = Column(DateTime, onupdate=datetime.utcnow, default=datetime.utcnow)
+    # bumped by every update, exposed as the ETag of the post
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # incremented in batches by the view counter
+    views = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+    __mapper_args__ = {"primary_key": [id]}
 
     author = relationship("Author", back_populates="posts")
     categories = relationship(
@@ -29,3 +41,9 @@ class Post(Base):
     tags = relationship(
         "Tag", secondary=post_tags, back_populates="posts", lazy="subquery"
     )
+
+
+# serves the keyset pagination of author feeds and the cascade delete of authors
+Index("ix_posts_author_feed", Post.author_id, Post.updated_at.desc(), Post.id)
+# serves incremental exports, which read the posts updated after a watermark
+Index("ix_posts_updated_at", Post.updated_at)
@@ -0,0 +1,29 @@
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import Float
+from sqlalchemy import Index
+from sqlalchemy import Integer
+
+from app.db.conection import Base
+
+
+class RelatedPost(Base):
+    """
+    One of the RELATED_POSTS_LIMIT posts most related to a post, by the weighted
+    overlap of their categories and tags, see app.post.related.
+    """
+
+    __tablename__ = "related_posts"
+
+    post_id = Column(Integer, primary_key=True)
+    related_id = Column(Integer, primary_key=True)
+    score = Column(Float, nullable=False)
+    # the start of the full rebuild which wrote the row, null for the rows of
+    # incremental updates
+    rebuilt_at = Column(DateTime)
+
+
+# serves the related posts of a post, best first
+Index("ix_related_posts_score", RelatedPost.post_id, RelatedPost.score.desc())
+# serves removing a changed post from the lists of the other posts
+Index("ix_related_posts_related_id", RelatedPost.related_id)
@@ -0,0 +1,25 @@
+from datetime import datetime
+
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import ForeignKey
+from sqlalchemy import Integer
+from sqlalchemy import String
+
+from app.db.conection import Base
+
+
+class AuthSession(Base):
+    __tablename__ = "sessions"
+
+    jti = Column(String(32), primary_key=True)
+    author_id = Column(
+        Integer,
+        ForeignKey("authors.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    token_hash = Column(String(64), nullable=False)
+    device = Column(String(255), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
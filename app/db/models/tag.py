@@ -1,4 +1,5 @@
 from sqlalchemy import Column
+from sqlalchemy import Index
 from sqlalchemy import Integer
 from sqlalchemy import String
 from sqlalchemy.orm import relationship
@@ -9,6 +10,12 @@ from app.db.models import post_tags
 
 class Tag(Base):
     __tablename__ = "tags"
+    __table_args__ = (
+        # serves prefix LIKE queries of tag suggestions
+        Index(
+            "ix_tags_name_pattern", "name", postgresql_ops={"name": "text_pattern_ops"}
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String(50), nullable=False, unique=True)
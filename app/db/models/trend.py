@@ -0,0 +1,31 @@
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import Float
+from sqlalchemy import ForeignKeyConstraint
+from sqlalchemy import Integer
+
+from app.db.conection import Base
+
+
+class PostTrend(Base):
+    """
+    Time-decayed view score of a post.
+
+    log_score is log2 of the sum of 2 ** (age of the view in half-lives before
+    TRENDING_EPOCH) over the views of the post, so newer views weigh more and
+    the ranking never needs to be recomputed as time passes.
+    """
+
+    __tablename__ = "post_trends"
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["post_id", "post_created_at"],
+            ["posts.id", "posts.created_at"],
+            ondelete="CASCADE",
+        ),
+    )
+
+    post_id = Column(Integer, primary_key=True)
+    post_created_at = Column(DateTime, nullable=False)
+    log_score = Column(Float, nullable=False, index=True)
+    scored_at = Column(DateTime, nullable=False)
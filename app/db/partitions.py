@@ -0,0 +1,334 @@
+"""
+Monthly range partitions of posts by created_at.
+
+post_categories and post_tags carry the created_at of their post and are
+partitioned on the same boundaries, so a month of posts is detached together
+with its categories and tags. Partitions are named <table>_pYYYYMM.
+"""
+import asyncio
+import re
+from collections.abc import Awaitable
+from collections.abc import Callable
+from datetime import datetime
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.config import settings
+from app.db.conection import engine
+from app.db.models import post_categories
+from app.db.models import post_tags
+from app.db.models.post import Post
+from app.db.models.trend import PostTrend
+
+# the partitioned tables and their partition key
+PARTITIONED_TABLES = {
+    "posts": "created_at",
+    "post_categories": "post_created_at",
+    "post_tags": "post_created_at",
+}
+PARTITION_NAME = re.compile(r"^(posts|post_categories|post_tags)_p(\d{4})(\d{2})$")
+# the tables rebuilt when an unpartitioned schema is converted, referencing first
+CONVERTED_TABLES = ("post_trends", "post_tags", "post_categories", "posts")
+# serializes partition changes of concurrent workers and commands
+PARTITION_LOCK_ID = 0x706F737473
+
+
+def is_partition(name: str) -> bool:
+    return PARTITION_NAME.match(name) is not None
+
+
+def month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+async def lock_partitions(connection: AsyncConnection) -> None:
+    await connection.execute(
+        text("SELECT pg_advisory_xact_lock(:id)"), {"id": PARTITION_LOCK_ID}
+    )
+
+
+async def create_partitions(
+    connection: AsyncConnection, first: datetime, last: datetime
+) -> list[str]:
+    """
+    Create the missing partitions of the months from `first` to `last`.
+
+    Args:
+        connection: The database connection, in a transaction
+        first: A moment of the first month
+        last: A moment of the last month
+
+    Returns:
+        The names of the created partitions
+    """
+    await lock_partitions(connection)
+    result = await connection.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'posts'::regclass"
+        )
+    )
+    existing = set(result.scalars())
+    created = []
+    month = month_start(first)
+    while month <= last:
+        end = add_months(month, 1)
+        if partition_name("posts", month) not in existing:
+            for table in PARTITIONED_TABLES:
+                name = partition_name(table, month)
+                await connection.execute(
+                    text(
+                        f"CREATE TABLE {name} PARTITION OF {table} "
+                        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{end.isoformat()}')"
+                    )
+                )
+                created.append(name)
+        month = end
+    return created
+
+
+async def create_future_partitions(connection: AsyncConnection) -> list[str]:
+    """
+    Create the partitions of the current month and of the next
+    POST_PARTITIONS_AHEAD months.
+    """
+    now = datetime.utcnow()
+    return await create_partitions(
+        connection, now, add_months(month_start(now), settings.POST_PARTITIONS_AHEAD)
+    )
+
+
+async def archive_partitions(
+    connection: AsyncConnection, before: datetime
+) -> list[str]:
+    """
+    Detach the partitions of the months ending before `before` and move them
+    to the POST_ARCHIVE_SCHEMA schema, where they stay readable but are no
+    longer scanned, indexed or vacuumed with the live posts.
+
+    Args:
+        connection: The database connection, in a transaction
+        before: Months ending after this moment are kept
+
+    Returns:
+        The names of the archived partitions
+    """
+    await lock_partitions(connection)
+    schema = settings.POST_ARCHIVE_SCHEMA
+    await connection.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+    result = await connection.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'posts'::regclass ORDER BY c.relname"
+        )
+    )
+    archived = []
+    for name in result.scalars():
+        match = PARTITION_NAME.match(name)
+        if match is None:
+            continue
+        month = datetime(int(match[2]), int(match[3]), 1)
+        end = add_months(month, 1)
+        if end > before:
+            break
+
+        # trends are kept for live posts only
+        await connection.execute(
+            text(
+                "DELETE FROM post_trends "
+                "WHERE post_created_at >= :month AND post_created_at < :end"
+            ),
+            {"month": month, "end": end},
+        )
+        # the association partitions reference the posts partition, detach them first
+        for table in ("post_categories", "post_tags", "posts"):
+            partition = partition_name(table, month)
+            await connection.execute(
+                text(f"ALTER TABLE {table} DETACH PARTITION {partition}")
+            )
+            if table != "posts":
+                constraints = await connection.execute(
+                    text(
+                        "SELECT conname FROM pg_constraint WHERE conrelid = "
+                        "CAST(:partition AS regclass) AND confrelid = 'posts'::regclass"
+                    ),
+                    {"partition": partition},
+                )
+                for constraint in constraints.scalars():
+                    await connection.execute(
+                        text(f'ALTER TABLE {partition} DROP CONSTRAINT "{constraint}"')
+                    )
+            await connection.execute(
+                text(f"ALTER TABLE {partition} SET SCHEMA {schema}")
+            )
+            archived.append(partition)
+    return archived
+
+
+async def partition_existing_posts(connection: AsyncConnection) -> bool:
+    """
+    Convert unpartitioned posts, post_categories, post_tags and post_trends
+    tables to the partitioned schema of the models, copying their rows.
+
+    Posts without created_at get their updated_at. The conversion runs in the
+    transaction of the connection, a failure leaves the old tables untouched.
+
+    Args:
+        connection: The database connection, in a transaction
+
+    Returns:
+        True if the tables were converted
+    """
+    relkind = await connection.scalar(
+        text("SELECT relkind::text FROM pg_class WHERE oid = to_regclass('posts')")
+    )
+    if relkind != "r":
+        return False
+    logger.info("Converting the posts tables to monthly partitions.")
+    await lock_partitions(connection)
+
+    old_tables = {}
+    for table in CONVERTED_TABLES:
+        if await connection.scalar(text(f"SELECT to_regclass('{table}')")) is None:
+            continue
+        old_tables[table] = f"{table}_unpartitioned"
+        await connection.execute(
+            text(f"ALTER TABLE {table} RENAME TO {table}_unpartitioned")
+        )
+        # index names are unique per schema and taken again by the new tables
+        indexes = await connection.execute(
+            text(
+                "SELECT indexrelid::regclass::text FROM pg_index "
+                "WHERE indrelid = CAST(:table AS regclass)"
+            ),
+            {"table": old_tables[table]},
+        )
+        for index in indexes.scalars():
+            await connection.execute(
+                text(f"ALTER INDEX {index} RENAME TO {index[:48]}_unpartitioned")
+            )
+    sequence = await connection.scalar(
+        text("SELECT pg_get_serial_sequence('posts_unpartitioned', 'id')")
+    )
+    if sequence is not None:
+        await connection.execute(
+            text(f"ALTER SEQUENCE {sequence} RENAME TO posts_unpartitioned_id_seq")
+        )
+
+    tables = [PostTrend.__table__, post_tags, post_categories, Post.__table__]
+    await connection.run_sync(Post.metadata.create_all, tables=tables)
+    first = await connection.scalar(
+        text("SELECT min(coalesce(created_at, updated_at)) FROM posts_unpartitioned")
+    )
+    now = datetime.utcnow()
+    await create_partitions(connection, first or now, now)
+    await create_future_partitions(connection)
+
+    result = await connection.execute(
+        text(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = 'posts_unpartitioned'"
+        )
+    )
+    # columns added later than the old table get their defaults
+    old_columns = set(result.scalars())
+    columns = [
+        column
+        for column in Post.__table__.columns.keys()
+        if column in old_columns and column != "created_at"
+    ]
+    await connection.execute(
+        text(
+            f"INSERT INTO posts ({', '.join(columns)}, created_at) "
+            f"SELECT {', '.join(columns)}, "
+            "coalesce(created_at, updated_at, now() AT TIME ZONE 'utc') "
+            "FROM posts_unpartitioned"
+        )
+    )
+    for table, column in (("post_categories", "category_id"), ("post_tags", "tag_id")):
+        await connection.execute(
+            text(
+                f"INSERT INTO {table} (post_id, post_created_at, {column}) "
+                f"SELECT o.post_id, p.created_at, o.{column} FROM {old_tables[table]} o "
+                "JOIN posts p ON p.id = o.post_id"
+            )
+        )
+    if "post_trends" in old_tables:
+        await connection.execute(
+            text(
+                "INSERT INTO post_trends (post_id, post_created_at, log_score, scored_at) "
+                "SELECT o.post_id, p.created_at, o.log_score, o.scored_at "
+                "FROM post_trends_unpartitioned o JOIN posts p ON p.id = o.post_id"
+            )
+        )
+    await connection.execute(
+        text(
+            "SELECT setval(pg_get_serial_sequence('posts', 'id'), "
+            "coalesce(max(id), 0) + 1, false) FROM posts"
+        )
+    )
+    for table in old_tables.values():
+        await connection.execute(text(f"DROP TABLE {table}"))
+    logger.success("Converted the posts tables to monthly partitions.")
+    return True
+
+
+def run_in_transaction(step: Callable[[AsyncConnection], Awaitable]):
+    """
+    Run a partition step in its own transaction and event loop, for the
+    synchronous migration and the commands.
+
+    Args:
+        step: The step, called with the connection
+
+    Returns:
+        The result of the step
+    """
+
+    async def run():
+        try:
+            async with engine.begin() as connection:
+                return await step(connection)
+        finally:
+            # the pooled connections belong to this event loop
+            await engine.dispose()
+
+    # not asyncio.run, which unsets the event loop that the synchronous
+    # alembic engine (async_fallback) takes from the main thread
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+async def maintain_partitions_periodically() -> None:
+    """
+    Background task which creates the upcoming partitions and refreshes the
+    planner statistics of the partitioned tables, which autovacuum only
+    collects for the partitions, every POST_PARTITION_MAINTENANCE_INTERVAL
+    seconds.
+    """
+    while True:
+        try:
+            async with engine.begin() as connection:
+                created = await create_future_partitions(connection)
+                if created:
+                    logger.info(f"Created partitions {', '.join(created)}")
+                await connection.execute(
+                    text(f"ANALYZE {', '.join(PARTITIONED_TABLES)}")
+                )
+        except Exception as exc:
+            logger.warning(f"Partition maintenance failed: {exc}")
+        await asyncio.sleep(settings.POST_PARTITION_MAINTENANCE_INTERVAL)
@@ -0,0 +1,236 @@
+import asyncio
+import random
+import re
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from dataclasses import field
+from functools import lru_cache
+
+import asyncpg
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.config import settings
+from app.db.listener import ASYNCPG_DSN
+
+# the ASGI scope of the current request, the router adds the endpoint to it
+request_scope: ContextVar[dict | None] = ContextVar("request_scope", default=None)
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+PLACEHOLDER_LIST = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+VALUES_LIST = re.compile(r"(VALUES\s*\(\?\))(?:\s*,\s*\(\?\))+", re.IGNORECASE)
+PLACEHOLDER = re.compile(r"\$\d+")
+WHITESPACE = re.compile(r"\s+")
+# SELECTs with side effects, which EXPLAIN ANALYZE would run a second time
+SIDE_EFFECTS = re.compile(
+    r"\b(pg_notify|pg_advisory\w*|pg_try_advisory\w*|setval|nextval)\s*\("
+    r"|\bFOR\s+(NO\s+KEY\s+)?(UPDATE|SHARE)\b|\bFOR\s+KEY\s+SHARE\b",
+    re.IGNORECASE,
+)
+
+
+@lru_cache(maxsize=2048)
+def normalize_sql(statement: str) -> str:
+    """
+    Normalize a statement into its fingerprint, so statements which only differ
+    in literals, placeholder numbers or list lengths are aggregated together.
+
+    Args:
+        statement: The statement as sent to the database
+
+    Returns:
+        The normalized statement
+    """
+    sql = STRING_LITERAL.sub("?", statement)
+    sql = PLACEHOLDER.sub("?", sql)
+    sql = NUMBER_LITERAL.sub("?", sql)
+    sql = PLACEHOLDER_LIST.sub("(?, ...)", sql)
+    sql = VALUES_LIST.sub(r"\1, ...", sql)
+    return WHITESPACE.sub(" ", sql).strip()
+
+
+def bind_shape(parameters, executemany: bool) -> str:
+    """
+    Describe the bind parameters without their values, e.g. "(int, str, list[3])".
+
+    Args:
+        parameters: The parameters of the statement
+        executemany: If the statement is executed for a list of parameter sets
+
+    Returns:
+        The shape of the parameters
+    """
+    if executemany:
+        rows = list(parameters)
+        return f"{len(rows)} x {bind_shape(rows[0], False)}" if rows else "0 x ()"
+    if isinstance(parameters, dict):
+        parameters = parameters.values()
+    shapes = []
+    for value in parameters or ():
+        if isinstance(value, list | tuple):
+            shapes.append(f"{type(value).__name__}[{len(value)}]")
+        else:
+            shapes.append(type(value).__name__)
+    return f"({', '.join(shapes)})"
+
+
+def current_route() -> str:
+    scope = request_scope.get()
+    if scope is None:
+        return "-"
+    endpoint = scope.get("endpoint")
+    name = f" ({endpoint.__name__})" if endpoint is not None else ""
+    return f"{scope['method']} {scope['path']}{name}"
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    slow: int = 0
+    routes: dict[str, int] = field(default_factory=dict)
+    last_plan: str | None = None
+
+
+class QueryLog:
+    """
+    Aggregate every statement of an engine by fingerprint and log the ones
+    slower than SLOW_QUERY_MS.
+
+    A sample of the slow SELECT statements is explained with
+    EXPLAIN (ANALYZE, BUFFERS) in a background task on its own connection, so
+    the request which ran the statement is not delayed. ANALYZE runs the
+    statement again, so it runs in a transaction which is rolled back, and
+    SELECTs with side effects like pg_notify, advisory locks, sequence calls
+    or row locks are never explained.
+    """
+
+    def __init__(self):
+        self.stats: dict[str, QueryStats] = {}
+        self.dropped = 0
+        self._explains: set[asyncio.Task] = set()
+
+    def install(self, engine: Engine) -> None:
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+        event.listen(engine, "handle_error", self._handle_error)
+
+    def _before_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _handle_error(self, context):
+        if context.connection is not None and context.connection.info.get(
+            "query_started"
+        ):
+            context.connection.info["query_started"].pop()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_started"].pop()) * 1000
+        scope = request_scope.get()
+        if scope is not None:
+            # the database time of the request, for the access log
+            state = scope.setdefault("state", {})
+            state["db_ms"] = state.get("db_ms", 0.0) + elapsed_ms
+            state["db_queries"] = state.get("db_queries", 0) + 1
+        fingerprint = normalize_sql(statement)
+        route = current_route()
+
+        stats = self.stats.get(fingerprint)
+        if stats is None:
+            if len(self.stats) >= settings.QUERY_STATS_MAX_SIZE:
+                self.dropped += 1
+                return
+            stats = self.stats[fingerprint] = QueryStats()
+        stats.count += 1
+        stats.total_ms += elapsed_ms
+        stats.max_ms = max(stats.max_ms, elapsed_ms)
+        if len(stats.routes) < 20 or route in stats.routes:
+            stats.routes[route] = stats.routes.get(route, 0) + 1
+
+        if elapsed_ms < settings.SLOW_QUERY_MS:
+            return
+        stats.slow += 1
+        logger.warning(
+            f"Slow query {elapsed_ms:.1f}ms route={route} "
+            f"binds={bind_shape(parameters, executemany)}: {fingerprint}"
+        )
+        if (
+            not executemany
+            and fingerprint[:6].upper() == "SELECT"
+            and SIDE_EFFECTS.search(statement) is None
+            and len(self._explains) < settings.SLOW_QUERY_EXPLAIN_CONCURRENCY
+            and random.random() < settings.SLOW_QUERY_EXPLAIN_RATE
+        ):
+            task = asyncio.get_running_loop().create_task(
+                self._explain(fingerprint, statement, tuple(parameters or ()))
+            )
+            self._explains.add(task)
+            task.add_done_callback(self._explains.discard)
+
+    async def _explain(
+        self, fingerprint: str, statement: str, parameters: tuple
+    ) -> None:
+        try:
+            connection = await asyncpg.connect(ASYNCPG_DSN)
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as exc:
+            logger.warning(f"Could not explain slow query: {exc}")
+            return
+        transaction = connection.transaction()
+        try:
+            await transaction.start()
+            rows = await connection.fetch(
+                f"EXPLAIN (ANALYZE, BUFFERS) {statement}", *parameters
+            )
+        except asyncpg.PostgresError as exc:
+            logger.warning(f"Could not explain slow query: {exc}")
+            return
+        finally:
+            # whatever the statement did is undone
+            if connection.is_in_transaction():
+                await transaction.rollback()
+            await connection.close()
+        plan = "\n".join(row[0] for row in rows)
+        if fingerprint in self.stats:
+            self.stats[fingerprint].last_plan = plan
+        logger.info(f"Plan of slow query {fingerprint}\n{plan}")
+
+    def top(self, order: str, limit: int) -> list[dict]:
+        """
+        Get the fingerprints with the highest total, count or max time.
+
+        Args:
+            order: "total_ms", "count" or "max_ms"
+            limit: The maximum number of fingerprints
+
+        Returns:
+            A list of fingerprints with their stats
+        """
+        items = sorted(
+            self.stats.items(), key=lambda item: getattr(item[1], order), reverse=True
+        )
+        return [
+            {
+                "fingerprint": fingerprint,
+                "count": stats.count,
+                "total_ms": round(stats.total_ms, 3),
+                "mean_ms": round(stats.total_ms / stats.count, 3),
+                "max_ms": round(stats.max_ms, 3),
+                "slow": stats.slow,
+                "routes": stats.routes,
+                "last_plan": stats.last_plan,
+            }
+            for fingerprint, stats in items[:limit]
+        ]
+
+    def reset(self) -> None:
+        self.stats.clear()
+        self.dropped = 0
+
+
+query_log = QueryLog()
@@ -0,0 +1,41 @@
+from fastapi import APIRouter
+from fastapi import Depends
+from fastapi import HTTPException
+from fastapi import status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.auth.manager import verified_author
+from app.db.conection import get_async_session
+from app.db.models.author import Author
+from app.db.models.deletion import DeletionJob
+from app.deletion.schemas import DeletionJobRetrieve
+
+deletion_router = APIRouter(prefix="/api/deletions", tags=["deletions"])
+
+
+@deletion_router.get("/{job_id}", response_model=DeletionJobRetrieve)
+async def get_deletion(
+    job_id: int,
+    session: AsyncSession = Depends(get_async_session),
+    current_author: Author = Depends(verified_author),
+):
+    """
+    get the progress of a deletion job, for the author who requested it or an
+    admin
+
+    Args:
+        job_id: The id of the job, returned by the deletion request
+        session: The database session
+        current_author: The authenticated author
+
+    Returns:
+        The status and the number of deleted posts and post associations
+    """
+    job = await session.get(DeletionJob, job_id)
+    if job is None or (
+        job.requested_by != current_author.id and not current_author.isadmin
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Deletion not found"
+        )
+    return job
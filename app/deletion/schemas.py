@@ -0,0 +1,25 @@
+from datetime import datetime
+
+from pydantic import BaseModel
+from pydantic import field_validator
+
+# returned instead of the error of a failed batch, which is only logged
+JOB_ERROR = "The last batch failed, the deletion is retried"
+
+
+class DeletionJobRetrieve(BaseModel):
+    id: int
+    target: str
+    target_id: int
+    status: str
+    deleted_posts: int
+    deleted_links: int
+    error: str | None
+    created_at: datetime
+    updated_at: datetime
+    finished_at: datetime | None
+
+    @field_validator("error")
+    @classmethod
+    def hide_error(cls, error: str | None) -> str | None:
+        return None if error is None else JOB_ERROR
@@ -0,0 +1,380 @@
+import asyncio
+from datetime import datetime
+from datetime import timedelta
+
+from fastapi import Response
+from loguru import logger
+from sqlalchemy import and_
+from sqlalchemy import delete
+from sqlalchemy import func
+from sqlalchemy import or_
+from sqlalchemy import tuple_
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.config import settings
+from app.db.conection import async_session_maker
+from app.db.invalidation import invalidation_bus
+from app.db.invalidation import InvalidationKey
+from app.db.models import Author
+from app.db.models import post_categories
+from app.db.models import post_tags
+from app.db.models.category import Category
+from app.db.models.deletion import DeletionJob
+from app.db.models.post import Post
+from app.db.models.related import RelatedPost
+from app.db.models.session import AuthSession
+from app.db.models.tag import Tag
+from app.db.models.trend import PostTrend
+from app.post.services import build_post_change
+from app.post.services import notify_post_changes
+from app.storage.services import delete_image
+from app.tag.services import tag_index
+
+DELETION_MODELS = {"author": Author, "category": Category}
+
+
+async def request_deletion(
+    session: AsyncSession, target: str, target_id: int, requested_by: int
+) -> DeletionJob:
+    """
+    Mark an author or a category as deleted and queue the job which removes it
+    with its posts or post associations. An author is logged out of all
+    sessions at once.
+
+    Args:
+        session: The database session
+        target: "author" or "category"
+        target_id: The id of the author or category
+        requested_by: The id of the author requesting the deletion
+
+    Returns:
+        The queued job
+    """
+    model = DELETION_MODELS[target]
+    await session.execute(
+        update(model)
+        .where(model.id == target_id)
+        .values(deleted_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    keys = [InvalidationKey(target, target_id)]
+    if target == "author":
+        result = await session.execute(
+            delete(AuthSession)
+            .where(AuthSession.author_id == target_id)
+            .returning(AuthSession.jti)
+        )
+        keys.extend(InvalidationKey("session", jti) for jti in result.scalars())
+    invalidation_bus.publish(session, *keys)
+    job = DeletionJob(target=target, target_id=target_id, requested_by=requested_by)
+    session.add(job)
+    await session.commit()
+    deletion_worker.wake()
+    return job
+
+
+def set_job_location(response: Response, job: DeletionJob) -> None:
+    response.headers["Location"] = f"/api/deletions/{job.id}"
+
+
+def post_names_query():
+    category_names = (
+        select(func.array_agg(Category.name))
+        .join(post_categories, post_categories.c.category_id == Category.id)
+        .where(
+            post_categories.c.post_id == Post.id,
+            post_categories.c.post_created_at == Post.created_at,
+        )
+        .scalar_subquery()
+    )
+    tag_names = (
+        select(func.array_agg(Tag.name))
+        .join(post_tags, post_tags.c.tag_id == Tag.id)
+        .where(
+            post_tags.c.post_id == Post.id,
+            post_tags.c.post_created_at == Post.created_at,
+        )
+        .scalar_subquery()
+    )
+    return select(
+        Post.id,
+        Post.created_at,
+        Post.author_id,
+        Post.updated_at,
+        category_names,
+        tag_names,
+    )
+
+
+async def delete_author_batch(
+    session: AsyncSession, author_id: int
+) -> tuple[int, int, list[str]] | None:
+    """
+    Delete up to DELETION_BATCH_SIZE posts of an author with their category
+    and tag associations and their trending scores, one set-based statement
+    per table.
+
+    Args:
+        session: The database session
+        author_id: The id of the author
+
+    Returns:
+        The number of deleted posts and associations and the tag names of the
+        deleted posts, or None if the author has no posts left
+    """
+    result = await session.execute(
+        post_names_query()
+        .where(Post.author_id == author_id)
+        .limit(settings.DELETION_BATCH_SIZE)
+    )
+    rows = result.all()
+    if not rows:
+        return None
+    keys = [(row[0], row[1]) for row in rows]
+
+    links = 0
+    for table in (post_categories, post_tags):
+        result = await session.execute(
+            delete(table).where(
+                tuple_(table.c.post_id, table.c.post_created_at).in_(keys)
+            )
+        )
+        links += result.rowcount
+    await session.execute(
+        delete(PostTrend).where(
+            tuple_(PostTrend.post_id, PostTrend.post_created_at).in_(keys)
+        )
+    )
+    post_ids = [key[0] for key in keys]
+    await session.execute(
+        delete(RelatedPost).where(
+            or_(RelatedPost.post_id.in_(post_ids), RelatedPost.related_id.in_(post_ids))
+        )
+    )
+    result = await session.execute(
+        delete(Post)
+        .where(tuple_(Post.id, Post.created_at).in_(keys))
+        .execution_options(synchronize_session=False)
+    )
+    invalidation_bus.publish(
+        session, *(InvalidationKey("post", key[0]) for key in keys)
+    )
+    await notify_post_changes(
+        session,
+        [
+            build_post_change(
+                "delete",
+                post_id,
+                author,
+                category_names or [],
+                tag_names or [],
+                updated,
+            )
+            for post_id, _, author, updated, category_names, tag_names in rows
+        ],
+    )
+    return result.rowcount, links, [name for row in rows for name in row[5] or ()]
+
+
+async def delete_category_batch(
+    session: AsyncSession, category_id: int
+) -> tuple[int, int, list[str]] | None:
+    """
+    Remove a category from up to DELETION_BATCH_SIZE posts.
+
+    Args:
+        session: The database session
+        category_id: The id of the category
+
+    Returns:
+        No deleted posts, the number of deleted associations and no tag names,
+        or None if no post has the category left
+    """
+    batch = (
+        select(post_categories.c.post_id, post_categories.c.post_created_at)
+        .where(post_categories.c.category_id == category_id)
+        .limit(settings.DELETION_BATCH_SIZE)
+    )
+    result = await session.execute(
+        delete(post_categories)
+        .where(
+            post_categories.c.category_id == category_id,
+            tuple_(post_categories.c.post_id, post_categories.c.post_created_at).in_(
+                batch
+            ),
+        )
+        .returning(post_categories.c.post_id, post_categories.c.post_created_at)
+    )
+    keys = [tuple(row) for row in result.all()]
+    if not keys:
+        return None
+
+    # not the category itself, request_deletion invalidated it once and the
+    # post changes below carry the new categories of the posts
+    invalidation_bus.publish(
+        session, *(InvalidationKey("post", key[0]) for key in keys)
+    )
+    # the posts keep their updated_at, the change only carries their new categories
+    result = await session.execute(
+        post_names_query().where(tuple_(Post.id, Post.created_at).in_(keys))
+    )
+    await notify_post_changes(
+        session,
+        [
+            build_post_change(
+                "update",
+                post_id,
+                author,
+                category_names or [],
+                tag_names or [],
+                updated,
+            )
+            for post_id, _, author, updated, category_names, tag_names in result.all()
+        ],
+    )
+    return 0, len(keys), []
+
+
+DELETION_BATCHES = {"author": delete_author_batch, "category": delete_category_batch}
+
+
+async def claim_job() -> tuple[int, str, int] | None:
+    """
+    Take the oldest pending job, or a running job abandoned by its worker.
+
+    Returns:
+        The id, target and target id of the job, or None if there is no job
+    """
+    now = datetime.utcnow()
+    abandoned = now - timedelta(seconds=settings.DELETION_LEASE)
+    claimable = (
+        select(DeletionJob.id)
+        .where(
+            or_(
+                DeletionJob.status == "pending",
+                and_(
+                    DeletionJob.status == "running",
+                    DeletionJob.updated_at < abandoned,
+                ),
+            )
+        )
+        .order_by(DeletionJob.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    async with async_session_maker() as session:
+        result = await session.execute(
+            update(DeletionJob)
+            .where(DeletionJob.id == claimable)
+            .values(status="running", updated_at=now)
+            .returning(DeletionJob.id, DeletionJob.target, DeletionJob.target_id)
+            .execution_options(synchronize_session=False)
+        )
+        job = result.first()
+        await session.commit()
+    return None if job is None else tuple(job)
+
+
+async def run_job(job_id: int, target: str, target_id: int) -> None:
+    """
+    Run a deletion job one batch per transaction until nothing is left, then
+    delete the author or category itself. Every batch saves the progress of
+    the job and renews its lease, so an interrupted job continues where it
+    stopped. Batches are idempotent, a job taken over by a second worker
+    while the first is still running is only deleted faster.
+
+    Args:
+        job_id: The id of the job
+        target: "author" or "category"
+        target_id: The id of the author or category
+    """
+    model = DELETION_MODELS[target]
+    while True:
+        async with async_session_maker() as session:
+            deleted = await DELETION_BATCHES[target](session, target_id)
+            now = datetime.utcnow()
+            values = {"updated_at": now}
+            if deleted is None:
+                image = None
+                if target == "author":
+                    image = await session.scalar(
+                        select(Author.image).where(Author.id == target_id)
+                    )
+                await session.execute(delete(model).where(model.id == target_id))
+                invalidation_bus.publish(session, InvalidationKey(target, target_id))
+                values.update(status="done", error=None, finished_at=now)
+            else:
+                posts, links, removed_tag_names = deleted
+                values.update(
+                    deleted_posts=DeletionJob.deleted_posts + posts,
+                    deleted_links=DeletionJob.deleted_links + links,
+                )
+            await session.execute(
+                update(DeletionJob)
+                .where(DeletionJob.id == job_id)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+        if deleted is None:
+            await delete_image(image)
+            logger.info(f"Deleted {target} {target_id}")
+            return
+        tag_index.update(removed=removed_tag_names)
+        await asyncio.sleep(settings.DELETION_BATCH_DELAY)
+
+
+async def release_job(job_id: int, error: str) -> None:
+    async with async_session_maker() as session:
+        await session.execute(
+            update(DeletionJob)
+            .where(DeletionJob.id == job_id)
+            .values(status="pending", error=error[:1000])
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+
+
+class DeletionWorker:
+    """
+    Background worker running the deletion jobs of all app workers.
+
+    It polls for jobs every DELETION_POLL_INTERVAL seconds, and right away
+    when a job is requested in this process. A failed job goes back to
+    pending with its error and is retried after the poll interval.
+    """
+
+    def __init__(self):
+        self._wakeup = asyncio.Event()
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    async def run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            job = None
+            try:
+                job = await claim_job()
+                if job is not None:
+                    await run_job(*job)
+                    continue
+            except Exception as exc:
+                logger.warning(f"Deletion job {job} failed: {exc}")
+                if job is not None:
+                    try:
+                        await release_job(job[0], str(exc))
+                    except Exception as release_exc:
+                        logger.warning(f"Releasing deletion job failed: {release_exc}")
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), settings.DELETION_POLL_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                pass
+
+
+deletion_worker = DeletionWorker()
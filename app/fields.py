@@ -0,0 +1,52 @@
+from functools import lru_cache
+
+from fastapi import HTTPException
+from fastapi import status
+from pydantic import BaseModel
+from pydantic import create_model
+
+
+def parse_fields(fields: str | None, model: type[BaseModel]) -> frozenset[str] | None:
+    """
+    Parse a comma separated `fields` query parameter.
+
+    Args:
+        fields: The requested fields, e.g. "id,title"
+        model: The full response model the fields are picked from
+
+    Returns:
+        The requested field names or None if all fields are requested
+
+    Raises:
+        HTTPException: If a field is not part of the model
+    """
+    if not fields:
+        return None
+    requested = frozenset(field.strip() for field in fields.split(",") if field.strip())
+    unknown = requested - set(model.model_fields)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}",
+        )
+    return requested
+
+
+@lru_cache(maxsize=256)
+def sparse_model(model: type[BaseModel], fields: frozenset[str]) -> type[BaseModel]:
+    """
+    Build a response model with only the given fields of a model.
+
+    Args:
+        model: The full response model
+        fields: The field names to keep
+
+    Returns:
+        The lean response model
+    """
+    definitions = {
+        name: (field.annotation, field)
+        for name, field in model.model_fields.items()
+        if name in fields
+    }
+    return create_model(f"{model.__name__}Fields", **definitions)
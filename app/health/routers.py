@@ -0,0 +1,39 @@
+from fastapi import APIRouter
+from fastapi import Response
+from fastapi import status
+
+from app.health.schemas import ReadinessRetrieve
+from app.health.services import readiness
+
+health_router = APIRouter(prefix="/api/health", tags=["health"])
+
+
+@health_router.get("/live")
+async def live():
+    """
+    check that the worker is running
+    """
+    return {"status": "alive"}
+
+
+@health_router.get(
+    "/ready",
+    response_model=ReadinessRetrieve,
+    responses={503: {"model": ReadinessRetrieve}},
+)
+async def ready(response: Response):
+    """
+    check that the worker is warmed up and takes traffic, 503 until then
+    and while shutting down
+
+    Args:
+        response: The response, for the status code
+
+    Returns:
+        The readiness and the duration of the warmup
+    """
+    if not readiness.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return ReadinessRetrieve(
+        ready=readiness.ready, warmup_seconds=readiness.warmup_seconds
+    )
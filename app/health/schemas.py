@@ -0,0 +1,6 @@
+from pydantic import BaseModel
+
+
+class ReadinessRetrieve(BaseModel):
+    ready: bool
+    warmup_seconds: float | None
@@ -0,0 +1,162 @@
+"""
+Warmup of a worker before it takes traffic.
+
+Pool connections are opened lazily, asyncpg prepares every statement on first
+use per connection and SQLAlchemy compiles it on first use per engine, so the
+first requests of a new worker pay for all of it. The warmup runs the hot
+queries of the app, with the same query builders as the routes, so they are
+compiled, and opens WARMUP_CONNECTIONS pool connections, on which they are
+prepared, and loads the catalogue of the categories. The worker reports ready
+once it is done.
+"""
+import asyncio
+import time
+from typing import Any
+
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy import select
+from sqlalchemy.engine import Connection
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.auth.manager import session_author_query
+from app.auth.services import author_by_email_query
+from app.category.services import category_catalogue
+from app.config import settings
+from app.db.conection import async_session_maker
+from app.db.conection import engine
+from app.db.models.post import Post
+from app.post.services import get_post
+
+
+class Readiness:
+    """
+    Readiness of the worker for traffic, set when the warmup is done and unset
+    on shutdown, so load balancers stop routing to a draining worker.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.warmup_seconds: float | None = None
+
+    def mark_ready(self, warmup_seconds: float) -> None:
+        self.ready = True
+        self.warmup_seconds = warmup_seconds
+
+
+async def run_hot_queries(session: AsyncSession) -> None:
+    """
+    Run the hot queries of the app once on the connection of a session.
+
+    Args:
+        session: The database session
+    """
+    await session.execute(author_by_email_query(""))
+    await session.execute(session_author_query("", ""))
+    # an existing post, so the category and tag loads run too
+    post_id = await session.scalar(select(Post.id).limit(1))
+    await get_post(post_id or 0, session)
+
+
+class HotStatements:
+    """
+    The hot queries as sent to the database, recorded once and replayed on
+    the first checkout of every pool connection, also the ones opened later
+    for overflow or after a disconnect. asyncpg prepares the statements and
+    introspects their types per connection, so the replay does it before the
+    connection serves a request.
+    """
+
+    def __init__(self):
+        self.statements: list[tuple[str, Any]] = []
+        self._recorded_connection: Connection | None = None
+
+    def install(self, engine: Engine) -> None:
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "checkout", self._checkout)
+
+    async def record(self, session: AsyncSession) -> None:
+        """
+        Record the statements of the hot queries run on a session.
+
+        Args:
+            session: The database session
+        """
+        connection = await session.connection()
+        self._recorded_connection = connection.sync_connection
+        try:
+            await run_hot_queries(session)
+        finally:
+            self._recorded_connection = None
+
+    def _before_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ) -> None:
+        if conn is self._recorded_connection:
+            self.statements.append((statement, parameters))
+
+    def _checkout(self, dbapi_connection, connection_record, connection_proxy):
+        if not self.statements or connection_record.info.get("warm"):
+            return
+        connection_record.info["warm"] = True
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement, parameters in self.statements:
+                cursor.execute(statement, parameters)
+        except Exception as exc:
+            logger.warning(f"Warming up a connection failed: {exc}")
+        finally:
+            cursor.close()
+            dbapi_connection.rollback()
+
+
+async def warm_up_pool(connections: int) -> None:
+    """
+    Record the hot statements, then open pool connections, which are warmed
+    up on checkout.
+
+    Args:
+        connections: The number of connections
+    """
+    async with async_session_maker() as session:
+        await hot_statements.record(session)
+    barrier = asyncio.Barrier(connections)
+
+    async def open_connection() -> None:
+        async with async_session_maker() as session:
+            await session.connection()
+            # keep the connection until all are checked out, so each session
+            # opens a different one
+            await barrier.wait()
+
+    async with asyncio.TaskGroup() as tasks:
+        for _ in range(connections):
+            tasks.create_task(open_connection())
+
+
+async def warm_up() -> None:
+    """
+    Background task which warms up the worker, retrying every
+    WARMUP_RETRY_INTERVAL seconds while the database is unavailable, and then
+    marks it ready.
+    """
+    started = time.perf_counter()
+    connections = min(settings.WARMUP_CONNECTIONS, settings.DB_POOL_SIZE)
+    while connections:
+        try:
+            await warm_up_pool(connections)
+            await category_catalogue.get()
+            break
+        except Exception as exc:
+            logger.warning(f"Warmup failed: {exc}")
+            await asyncio.sleep(settings.WARMUP_RETRY_INTERVAL)
+    readiness.mark_ready(time.perf_counter() - started)
+    logger.info(
+        f"Warmed up {connections} connections in {readiness.warmup_seconds:.2f}s"
+    )
+
+
+readiness = Readiness()
+hot_statements = HotStatements()
+hot_statements.install(engine.sync_engine)
@@ -0,0 +1,229 @@
+"""
+Logging of the app: loguru, the standard logging of uvicorn and the access log
+of AccessLogMiddleware all go through one QueueSink, which writes JSON lines
+(or text with LOG_FORMAT=text) to stdout from a background thread.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+import traceback
+from collections.abc import Callable
+from datetime import datetime
+from typing import TextIO
+
+from loguru import logger
+
+from app.config import settings
+
+# records written per write call of the writer thread
+WRITE_BATCH = 500
+
+
+def json_line(record: dict) -> str:
+    data = {
+        "time": record["time"].isoformat(),
+        "level": record["level"].name,
+        "logger": record["name"],
+        "message": record["message"],
+    }
+    data.update(record["extra"])
+    if record["exception"] is not None:
+        data["exception"] = "".join(traceback.format_exception(*record["exception"]))
+    return json.dumps(data, default=str) + "\n"
+
+
+def text_line(record: dict) -> str:
+    line = (
+        f"{record['time']:%Y-%m-%d %H:%M:%S.%f}"[:-3]
+        + f" | {record['level'].name:<8} | {record['name']}:{record['function']}:"
+        f"{record['line']} - {record['message']}"
+    )
+    if record["extra"]:
+        line += " " + " ".join(
+            f"{key}={value}" for key, value in record["extra"].items()
+        )
+    if record["exception"] is not None:
+        line += "\n" + "".join(traceback.format_exception(*record["exception"]))
+    return line.rstrip("\n") + "\n"
+
+
+LINE_FORMATS = {"json": json_line, "text": text_line}
+
+
+class QueueSink:
+    """
+    Loguru sink putting the records into a queue of LOG_BUFFER_SIZE records,
+    which a background thread formats and writes, so a slow log collector
+    never blocks the event loop. Records which don't fit into the queue are
+    dropped and counted per level, the writer logs the number of dropped
+    records once there is room again.
+    """
+
+    def __init__(self, stream: TextIO, capacity: int):
+        self.stream = stream
+        self.capacity = capacity
+        self.queue: queue.Queue = queue.Queue(capacity)
+        self.format: Callable[[dict], str] = json_line
+        self.written = 0
+        self.dropped: dict[str, int] = {}
+        self._reported_drops = 0
+        self._thread: threading.Thread | None = None
+
+    def __call__(self, message) -> None:
+        try:
+            self.queue.put_nowait(message.record)
+        except queue.Full:
+            level = message.record["level"].name
+            self.dropped[level] = self.dropped.get(level, 0) + 1
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._write_records, name="log-writer", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout: float = 5) -> None:
+        """
+        Write the queued records and stop the writer thread.
+        """
+        if self._thread is None:
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _write_records(self) -> None:
+        while True:
+            records = [self.queue.get()]
+            while records[-1] is not None and len(records) < WRITE_BATCH:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = [self.format(record) for record in records if record is not None]
+            dropped = sum(self.dropped.values())
+            if dropped > self._reported_drops:
+                lines.append(self._drop_line(dropped - self._reported_drops))
+                self._reported_drops = dropped
+            try:
+                self.stream.write("".join(lines))
+                self.stream.flush()
+            except Exception as exc:
+                print(f"Writing logs failed: {exc}", file=sys.stderr)
+            self.written += len(lines)
+            if records[-1] is None:
+                return
+
+    def _drop_line(self, count: int) -> str:
+        # written directly, logging it would go through the full queue again
+        message = f"Dropped {count} log records, the log buffer was full"
+        if self.format is text_line:
+            return f"WARNING | {__name__} - {message}\n"
+        data = {
+            "time": datetime.now().astimezone().isoformat(),
+            "level": "WARNING",
+            "logger": __name__,
+            "message": message,
+            "dropped": dict(self.dropped),
+        }
+        return json.dumps(data) + "\n"
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "queued": self.queue.qsize(),
+            "written": self.written,
+            "dropped": dict(self.dropped),
+            "sampled_out": access_log.sampled_out,
+        }
+
+
+class InterceptHandler(logging.Handler):
+    """
+    Standard logging handler passing the records of uvicorn and other
+    libraries to loguru.
+    """
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            level = logger.level(record.levelname).name
+        except ValueError:
+            level = record.levelno
+        logger.bind(logger=record.name).opt(exception=record.exc_info).log(
+            level, record.getMessage()
+        )
+
+
+class AccessLog:
+    """
+    Structured access log records. Successful requests faster than
+    LOG_ACCESS_SLOW_MS are sampled with the rate of their route in
+    LOG_ACCESS_SAMPLE_RATES or LOG_ACCESS_SAMPLE_RATE, errors and slow
+    requests are always logged. Every record has the rate it was sampled
+    with, so counts can be scaled back up.
+    """
+
+    def __init__(self):
+        self.sampled_out = 0
+
+    def log(self, scope: dict, status_code: int, duration_ms: float) -> None:
+        """
+        Log a finished request.
+
+        Args:
+            scope: The ASGI scope of the request
+            status_code: The status code of the response
+            duration_ms: The duration of the request
+        """
+        route = scope.get("route")
+        path = route.path if route is not None else scope.get("root_path") or "-"
+        rate = 1.0
+        if status_code < 400 and duration_ms < settings.LOG_ACCESS_SLOW_MS:
+            rate = settings.LOG_ACCESS_SAMPLE_RATES.get(
+                path, settings.LOG_ACCESS_SAMPLE_RATE
+            )
+            if rate < 1 and random.random() >= rate:
+                self.sampled_out += 1
+                return
+        state = scope.get("state") or {}
+        logger.info(
+            "{method} {route} {status}",
+            type="access",
+            method=scope["method"],
+            route=path,
+            path=scope["path"],
+            status=status_code,
+            duration_ms=round(duration_ms, 2),
+            db_ms=round(state.get("db_ms", 0.0), 2),
+            db_queries=state.get("db_queries", 0),
+            author_id=state.get("author_id"),
+            sample_rate=rate,
+        )
+
+
+def configure_logging() -> None:
+    """
+    Send loguru and the standard logging through the QueueSink, in the
+    LOG_FORMAT format.
+    """
+    log_sink.format = LINE_FORMATS[settings.LOG_FORMAT]
+    log_sink.start()
+    logger.remove()
+    logger.add(log_sink, level=settings.LOG_LEVEL, format="{message}")
+    logging.basicConfig(
+        handlers=[InterceptHandler()], level=settings.LOG_LEVEL, force=True
+    )
+
+
+log_sink = QueueSink(sys.stdout, settings.LOG_BUFFER_SIZE)
+access_log = AccessLog()
@@ -0,0 +1,226 @@
+import asyncio
+import json
+import re
+import time
+from collections import deque
+
+from starlette.types import ASGIApp
+from starlette.types import Message
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+from app.config import settings
+
+# long lived, operator and documentation routes are never shed
+EXEMPT_PREFIXES = (
+    "/static",
+    "/api/post/stream",
+    "/api/admin",
+    "/api/health",
+    "/docs",
+    "/redoc",
+    "/openapi.json",
+)
+# routes hashing passwords
+AUTH_ROUTES = {
+    ("POST", "/api/auth/login"),
+    ("POST", "/api/author/register"),
+    ("PATCH", "/api/author/change_password"),
+}
+SEARCH_PATH = re.compile(r"^/api/(post/posts|post/posts/search|author/\d+/posts)$")
+# smoothing of the latency average of adaptive limits
+LATENCY_SMOOTHING = 0.1
+# the minimum latency is re-measured after this many requests
+MIN_LATENCY_WINDOW = 1000
+
+
+def route_class(method: str, path: str) -> str | None:
+    """
+    Classify a request by its cost.
+
+    Args:
+        method: The HTTP method
+        path: The request path
+
+    Returns:
+        "auth", "search", "read" or "write", or None if it is never shed
+    """
+    if path.startswith(EXEMPT_PREFIXES):
+        return None
+    path = path.rstrip("/") or "/"
+    if (method, path) in AUTH_ROUTES:
+        return "auth"
+    if method in ("GET", "HEAD"):
+        return "search" if SEARCH_PATH.match(path) else "read"
+    return "write"
+
+
+class ConcurrencyLimiter:
+    """
+    Concurrency limit of a route class with a bounded FIFO queue of waiting
+    requests.
+
+    With adaptive limits, the limit shrinks while the average latency is more
+    than ADMISSION_LATENCY_TOLERANCE times the minimum latency seen, i.e. while
+    requests queue up downstream in the database, and grows back up to the
+    configured limit while it is reached with healthy latencies.
+    """
+
+    def __init__(self, name: str, limit: int, queue_size: int, adaptive: bool):
+        self.name = name
+        self.max_limit = limit
+        self.limit = float(limit)
+        self.queue_size = queue_size
+        self.adaptive = adaptive
+        self.active = 0
+        self.waiters: deque[asyncio.Future] = deque()
+        self.rejected = 0
+        self.timed_out = 0
+        self.latency: float | None = None
+        self.min_latency: float | None = None
+        self.samples = 0
+
+    def _free(self) -> bool:
+        return self.active < max(int(self.limit), 1)
+
+    async def acquire(self, timeout: float) -> bool:
+        """
+        Wait for a free slot.
+
+        Args:
+            timeout: The maximum wait in seconds
+
+        Returns:
+            True if the request was admitted, False if the queue is full or
+            the wait timed out
+        """
+        if self._free() and not self.waiters:
+            self.active += 1
+            return True
+        if len(self.waiters) >= self.queue_size:
+            self.rejected += 1
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            # a slot handed over just as the wait times out is still taken
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            return False
+        finally:
+            if waiter.cancelled() and waiter in self.waiters:
+                self.waiters.remove(waiter)
+        return True
+
+    def release(self, latency: float | None = None) -> None:
+        self.active -= 1
+        if latency is not None and self.adaptive:
+            self._adapt(latency)
+        while self.waiters and self._free():
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.active += 1
+                waiter.set_result(True)
+
+    def _adapt(self, latency: float) -> None:
+        self.samples += 1
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += (latency - self.latency) * LATENCY_SMOOTHING
+        if self.min_latency is None or self.samples % MIN_LATENCY_WINDOW == 0:
+            self.min_latency = self.latency
+        self.min_latency = min(self.min_latency, latency)
+
+        if self.latency > self.min_latency * settings.ADMISSION_LATENCY_TOLERANCE:
+            self.limit = max(self.limit * 0.9, 1.0)
+        elif self.active + 1 >= int(self.limit) or self.waiters:
+            self.limit = min(self.limit + 1 / self.limit, float(self.max_limit))
+
+    def stats(self) -> dict:
+        return {
+            "route_class": self.name,
+            "limit": int(self.limit),
+            "max_limit": self.max_limit,
+            "active": self.active,
+            "queued": len(self.waiters),
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "latency_ms": None if self.latency is None else self.latency * 1000,
+        }
+
+
+class AdmissionMiddleware:
+    """
+    Limit the concurrent requests of each route class, so a burst of one
+    class, e.g. password hashing logins, can't take the event loop and the
+    connection pool from the others.
+
+    Requests over the limit wait in a bounded queue for at most
+    ADMISSION_QUEUE_TIMEOUT seconds. When the queue is full or the wait
+    times out, the request is rejected at once with 503 and Retry-After,
+    instead of piling up and slowing down every other request.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.ADMISSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        name = route_class(scope["method"], scope["path"])
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = admission_limiters[name]
+        if not await limiter.acquire(settings.ADMISSION_QUEUE_TIMEOUT):
+            await reject(send)
+            return
+        started = time.perf_counter()
+        failed = False
+
+        async def send_status(message: Message) -> None:
+            nonlocal failed
+            if message["type"] == "http.response.start":
+                failed = message["status"] >= 500
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            # errors are often fast and would hide an overloaded database
+            limiter.release(None if failed else time.perf_counter() - started)
+
+
+async def reject(send: Send) -> None:
+    body = json.dumps({"detail": "Server overloaded, retry later"}).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(settings.ADMISSION_RETRY_AFTER).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+admission_limiters = {
+    name: ConcurrencyLimiter(
+        name,
+        limit,
+        settings.ADMISSION_QUEUE_SIZES[name],
+        settings.ADMISSION_ADAPTIVE,
+    )
+    for name, limit in settings.ADMISSION_LIMITS.items()
+}
@@ -0,0 +1,141 @@
+import asyncio
+import gzip
+
+from starlette.datastructures import Headers
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp
+from starlette.types import Message
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+from app.config import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    """
+    Parse an Accept-Encoding header.
+
+    Args:
+        accept_encoding: The header value, e.g. "gzip, br;q=0.9"
+
+    Returns:
+        The accepted encodings, without the ones with q=0
+    """
+    encodings = set()
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        if name:
+            encodings.add(name)
+    return encodings
+
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    """
+    Choose the best supported encoding accepted by the client.
+
+    Args:
+        accept_encoding: The Accept-Encoding header
+
+    Returns:
+        "br", "gzip" or None
+    """
+    encodings = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in encodings:
+        return "br"
+    if "gzip" in encodings:
+        return "gzip"
+    return None
+
+
+def is_compressible(content_type: str) -> bool:
+    return content_type.startswith(COMPRESSIBLE_TYPES) or "+json" in content_type
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=settings.BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=settings.GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    Compress complete response bodies with brotli or gzip.
+
+    Bodies smaller than COMPRESSION_MIN_SIZE are sent as is, bodies larger than
+    COMPRESSION_OFFLOAD_SIZE are compressed in a worker thread so they don't
+    block the event loop. Streaming responses, like the post change feed, and
+    the excluded path prefixes, like the precompressed static files, are never
+    touched.
+    """
+
+    def __init__(self, app: ASGIApp, exclude_paths: tuple[str, ...] = ()):
+        self.app = app
+        self.exclude_paths = exclude_paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude_paths):
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Message | None = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start["headers"])
+            if (
+                message["type"] != "http.response.body"
+                or message.get("more_body", False)
+                or start["status"] in (204, 206, 304)
+                or "content-encoding" in headers
+                or len(body) < settings.COMPRESSION_MIN_SIZE
+                or not is_compressible(headers.get("content-type", ""))
+            ):
+                await send(start)
+                await send(message)
+                return
+
+            if len(body) >= settings.COMPRESSION_OFFLOAD_SIZE:
+                body = await asyncio.to_thread(compress, body, encoding)
+            else:
+                body = compress(body, encoding)
+
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
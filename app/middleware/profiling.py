@@ -0,0 +1,51 @@
+import asyncio
+
+from loguru import logger
+from starlette.types import ASGIApp
+from starlette.types import Message
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+from app.profiling import request_profiler
+from app.profiling import RequestSampler
+from app.profiling import write_profile
+
+
+class ProfilingMiddleware:
+    """
+    Sample the requests matching the target armed by an admin and write their
+    profiles. Unless a target is armed, a request costs a single attribute check.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if request_profiler.target is None or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        interval = request_profiler.claim(scope)
+        if interval is None:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        sampler = RequestSampler(asyncio.current_task(), interval)
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            sampler.stop()
+            name = await asyncio.to_thread(
+                write_profile, sampler, scope["method"], scope["path"], status_code
+            )
+            logger.info(f"Wrote request profile {name}")
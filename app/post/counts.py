@@ -0,0 +1,299 @@
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from fastapi import Response
+from sqlalchemy import func
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.config import settings
+from app.db.invalidation import invalidation_bus
+from app.db.models import post_categories
+from app.db.models import post_tags
+from app.db.models.category import Category
+from app.db.models.post import Post
+from app.db.models.tag import Tag
+
+COUNT_DESCRIPTION = (
+    "Total number of matching posts in the X-Total-Count header: exact, "
+    "estimate (from the planner statistics) or none"
+)
+COUNT_PATTERN = "^(exact|estimate|none)$"
+CREATED_AFTER_DESCRIPTION = (
+    "Only posts created at or after this moment, only the partitions of the "
+    "window are read"
+)
+CREATED_BEFORE_DESCRIPTION = "Only posts created before this moment"
+# a cached marker for filters with more than COUNT_EXACT_MAX posts
+TOO_MANY = -1
+
+
+class CountCache:
+    """
+    LRU cache of exact post counts per normalized filter. Every post or
+    category write of any worker clears it, entries also expire after
+    COUNT_CACHE_TTL seconds.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._counts: OrderedDict[tuple, tuple[int, float]] = OrderedDict()
+
+    def get(self, key: tuple) -> int | None:
+        entry = self._counts.get(key)
+        if entry is None:
+            return None
+        count, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._counts[key]
+            return None
+        self._counts.move_to_end(key)
+        return count
+
+    def put(self, key: tuple, count: int) -> None:
+        self._counts[key] = (count, time.monotonic() + settings.COUNT_CACHE_TTL)
+        self._counts.move_to_end(key)
+        while len(self._counts) > self.maxsize:
+            self._counts.popitem(last=False)
+
+    def clear(self, *args) -> None:
+        self._counts.clear()
+
+
+def count_key(
+    category_names: list[str] | None = None,
+    tag_names: list[str] | None = None,
+    match: str = "any",
+    exclude_category_names: list[str] | None = None,
+    exclude_tag_names: list[str] | None = None,
+    created_after: datetime | None = None,
+    created_before: datetime | None = None,
+) -> tuple:
+    """
+    Build the cache key of a post filter, equal for equivalent filters.
+    """
+    names = [
+        tuple(sorted(set(names or ())))
+        for names in (
+            category_names,
+            tag_names,
+            exclude_category_names,
+            exclude_tag_names,
+        )
+    ]
+    if len(names[0]) < 2 and len(names[1]) < 2:
+        match = "any"
+    return (match, *names, created_after, created_before)
+
+
+async def exact_count(session: AsyncSession, filters: list) -> int | None:
+    """
+    Count the posts matching the filters, reading at most COUNT_EXACT_MAX + 1 ids.
+
+    Args:
+        session: The database session
+        filters: The where clauses for select(Post)
+
+    Returns:
+        The number of posts or None if there are more than COUNT_EXACT_MAX
+    """
+    ids = select(Post.id).filter(*filters).limit(settings.COUNT_EXACT_MAX + 1)
+    total = await session.scalar(select(func.count()).select_from(ids.subquery()))
+    return None if total > settings.COUNT_EXACT_MAX else total
+
+
+async def planner_estimate(session: AsyncSession, filters: list) -> int:
+    """
+    Get the planner estimate of the number of posts matching the filters,
+    which only costs planning the query.
+
+    Args:
+        session: The database session
+        filters: The where clauses for select(Post)
+
+    Returns:
+        The estimated number of posts
+    """
+    compiled = (
+        select(Post.id)
+        .filter(*filters)
+        .compile(
+            dialect=postgresql.dialect(paramstyle="named"),
+            compile_kwargs={"render_postcompile": True},
+        )
+    )
+    plan = await session.scalar(
+        text(f"EXPLAIN (FORMAT JSON) {compiled}"), compiled.params
+    )
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+async def column_frequencies(
+    session: AsyncSession, table: str, column: str
+) -> tuple[dict[int, float], float, float] | None:
+    """
+    Read the planner statistics of a foreign key column of an association table,
+    cached for COUNT_CACHE_TTL seconds since they only change on ANALYZE.
+
+    Args:
+        session: The database session
+        table: The association table name
+        column: The foreign key column name
+
+    Returns:
+        The frequencies of the most common values, the frequency of any other
+        value and the number of rows, or None if the table was never analyzed
+    """
+    cached = _frequencies.get((table, column))
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+
+    row = (
+        await session.execute(
+            text(
+                "SELECT s.most_common_vals::text::int[], s.most_common_freqs, "
+                "s.n_distinct, c.reltuples FROM pg_stats s JOIN pg_class c "
+                "ON c.relname = s.tablename "
+                "AND c.relnamespace = s.schemaname::regnamespace "
+                "WHERE s.tablename = :table AND s.attname = :column"
+            ),
+            {"table": table, "column": column},
+        )
+    ).first()
+    frequencies = None
+    if row is not None and row[3] > 0:
+        values, freqs, n_distinct, rows = row
+        values, freqs = values or [], freqs or []
+        distinct = n_distinct if n_distinct >= 0 else -n_distinct * rows
+        others = max(distinct - len(values), 1)
+        frequencies = (
+            dict(zip(values, freqs)),
+            max(1 - sum(freqs), 0) / others,
+            rows,
+        )
+    _frequencies[(table, column)] = (
+        frequencies,
+        time.monotonic() + settings.COUNT_CACHE_TTL,
+    )
+    return frequencies
+
+
+async def name_fractions(
+    session: AsyncSession, model, association, column: str, names: tuple[str, ...]
+) -> list[float] | None:
+    """
+    Estimate the fraction of posts having each of the given categories or tags.
+    """
+    frequencies = await column_frequencies(session, association.name, column)
+    total = await posts_estimate(session)
+    if frequencies is None or total is None:
+        return None
+    common, other, rows = frequencies
+    result = await session.execute(select(model.id).filter(model.name.in_(names)))
+    ids = list(result.scalars())
+    fractions = [min(common.get(id_, other) * rows / max(total, 1), 1) for id_ in ids]
+    # unknown names have no posts
+    return fractions + [0.0] * (len(names) - len(ids))
+
+
+async def posts_estimate(session: AsyncSession) -> float | None:
+    # autovacuum keeps the row counts of the partitions, not of posts itself
+    total = await session.scalar(
+        text(
+            "SELECT sum(c.reltuples) FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'posts'::regclass AND c.reltuples >= 0"
+        )
+    )
+    return total if total is not None and total >= 0 else None
+
+
+async def estimated_count(session: AsyncSession, filters: list, key: tuple) -> int:
+    """
+    Estimate the number of posts matching the filters from the planner
+    statistics of post_categories and post_tags, assuming categories and tags
+    are independent. The cost doesn't depend on the number of posts.
+
+    Args:
+        session: The database session
+        filters: The where clauses for select(Post)
+        key: The count_key of the filters
+
+    Returns:
+        The estimated number of posts
+    """
+    match, category_names, tag_names, exclude_category_names, exclude_tag_names = key[
+        :5
+    ]
+    total = await posts_estimate(session)
+    # the statistics don't know the share of a created_at window, the planner
+    # estimates it from the partitions of the window
+    if total is None or any(moment is not None for moment in key[5:]):
+        return await planner_estimate(session, filters)
+
+    fraction = 1.0
+    for names, model, association, column, exclude in (
+        (category_names, Category, post_categories, "category_id", False),
+        (tag_names, Tag, post_tags, "tag_id", False),
+        (exclude_category_names, Category, post_categories, "category_id", True),
+        (exclude_tag_names, Tag, post_tags, "tag_id", True),
+    ):
+        if not names:
+            continue
+        fractions = await name_fractions(session, model, association, column, names)
+        if fractions is None:
+            return await planner_estimate(session, filters)
+        if exclude:
+            fraction *= math.prod(1 - f for f in fractions)
+        elif match == "all":
+            fraction *= math.prod(fractions)
+        else:
+            fraction *= 1 - math.prod(1 - f for f in fractions)
+    return round(total * fraction)
+
+
+async def count_posts(
+    session: AsyncSession, mode: str, filters: list, key: tuple
+) -> tuple[int, str] | None:
+    """
+    Count the posts matching the filters as requested by a `count` parameter.
+    Exact counts of more than COUNT_EXACT_MAX posts fall back to the estimate,
+    so the cost of counting stays bounded.
+
+    Args:
+        session: The database session
+        mode: "exact", "estimate" or "none"
+        filters: The where clauses for select(Post)
+        key: The count_key of the filters
+
+    Returns:
+        The count and "exact" or "estimate", or None if no count was requested
+    """
+    if mode == "none":
+        return None
+    if mode == "exact":
+        total = count_cache.get(key)
+        if total is None:
+            total = await exact_count(session, filters)
+            count_cache.put(key, TOO_MANY if total is None else total)
+        if total is not None and total != TOO_MANY:
+            return total, "exact"
+    return await estimated_count(session, filters, key), "estimate"
+
+
+def set_total_count(response: Response, count: tuple[int, str] | None) -> None:
+    if count is None:
+        return
+    total, kind = count
+    response.headers["X-Total-Count"] = str(total)
+    response.headers["X-Total-Count-Type"] = kind
+
+
+count_cache = CountCache(settings.COUNT_CACHE_SIZE)
+_frequencies: dict[tuple[str, str], tuple[tuple | None, float]] = {}
+invalidation_bus.register("post", count_cache.clear)
+invalidation_bus.register("category", count_cache.clear)
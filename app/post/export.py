@@ -0,0 +1,234 @@
+import asyncio
+from collections.abc import AsyncIterator
+from datetime import datetime
+from datetime import timedelta
+
+from sqlalchemy import func
+from sqlalchemy.future import select
+
+from app.config import settings
+from app.db.conection import engine
+from app.db.models import post_categories
+from app.db.models import post_tags
+from app.db.models.author import Author
+from app.db.models.category import Category
+from app.db.models.post import Post
+from app.db.models.tag import Tag
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+EXPORT_FORMATS = {
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+    "arrow": (".arrow", "application/vnd.apache.arrow.stream"),
+}
+EXPORT_FORMAT_PATTERN = "^(parquet|arrow)$"
+# the schema metadata key of the max updated_at of the exported snapshot
+WATERMARK_KEY = b"watermark"
+
+
+class ChunkSink:
+    """
+    Write-only file collecting the written bytes until they are taken, so an
+    export can be streamed one row group at a time. It keeps counting the
+    position, which Parquet writes into its footer.
+    """
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def export_schema(watermark: datetime | None) -> "pa.Schema":
+    names = pa.list_(pa.dictionary(pa.int32(), pa.string()))
+    return pa.schema(
+        [
+            ("id", pa.int32()),
+            ("title", pa.string()),
+            ("description", pa.string()),
+            ("author_id", pa.int32()),
+            ("author_email", pa.string()),
+            ("author_username", pa.string()),
+            ("created_at", pa.timestamp("us")),
+            ("updated_at", pa.timestamp("us")),
+            ("views", pa.int64()),
+            ("categories", names),
+            ("tags", names),
+        ],
+        metadata={WATERMARK_KEY: watermark.isoformat() if watermark else ""},
+    )
+
+
+def names_array(
+    ids: list[list[int] | None], positions: dict[int, int], dictionary: "pa.Array"
+) -> "pa.ListArray":
+    """
+    Build a list column of dictionary encoded names.
+
+    Args:
+        ids: The category or tag ids of every post
+        positions: The position of every id in the dictionary
+        dictionary: The names of all categories or tags
+
+    Returns:
+        The list of names of every post
+    """
+    offsets, indices = [0], []
+    for post_ids in ids:
+        indices.extend(positions[id_] for id_ in post_ids or ())
+        offsets.append(len(indices))
+    values = pa.DictionaryArray.from_arrays(pa.array(indices, pa.int32()), dictionary)
+    return pa.ListArray.from_arrays(pa.array(offsets, pa.int32()), values)
+
+
+def open_writer(sink, schema: "pa.Schema", export_format: str, stream: bool):
+    if export_format == "parquet":
+        return pq.ParquetWriter(sink, schema, compression="zstd")
+    if stream:
+        return pa.ipc.new_stream(sink, schema)
+    return pa.ipc.new_file(sink, schema)
+
+
+def posts_query(since: datetime | None):
+    category_ids = (
+        select(func.array_agg(post_categories.c.category_id))
+        .where(
+            post_categories.c.post_id == Post.id,
+            post_categories.c.post_created_at == Post.created_at,
+        )
+        .scalar_subquery()
+    )
+    tag_ids = (
+        select(func.array_agg(post_tags.c.tag_id))
+        .where(
+            post_tags.c.post_id == Post.id,
+            post_tags.c.post_created_at == Post.created_at,
+        )
+        .scalar_subquery()
+    )
+    query = select(
+        Post.id,
+        Post.title,
+        Post.description,
+        Post.author_id,
+        Author.email,
+        Author.username,
+        Post.created_at,
+        Post.updated_at,
+        Post.views,
+        category_ids,
+        tag_ids,
+    ).join(Author, Author.id == Post.author_id)
+    if since is not None:
+        query = query.where(Post.updated_at > since)
+    return query
+
+
+class PostExport:
+    """
+    Export of the posts with their author, category and tag names to a Parquet
+    or Arrow IPC file, written one row group of EXPORT_BATCH_SIZE posts at a
+    time.
+
+    The posts are read from one REPEATABLE READ snapshot with a server-side
+    cursor, so memory doesn't grow with the number of posts. The watermark of
+    the export, stored in the schema metadata, is the max updated_at of the
+    snapshot but at most EXPORT_WATERMARK_LAG seconds before it was taken; the
+    next incremental export passes it as `since`. updated_at is stamped
+    before the commit, so a write in flight during the snapshot can commit
+    with an updated_at below the max, the lag makes the next export read it.
+    Posts updated within the lag are exported again by the next export,
+    consumers keep the row with the latest updated_at per id.
+    """
+
+    def __init__(
+        self,
+        export_format: str,
+        since: datetime | None = None,
+        stream: bool = False,
+    ):
+        self.export_format = export_format
+        self.since = since
+        self.stream = stream
+        self.watermark: datetime | None = since
+        self.total = 0
+
+    async def write(self, sink) -> AsyncIterator[int]:
+        """
+        Write the posts updated after `since`.
+
+        Args:
+            sink: A path or a writable file
+
+        Returns:
+            An iterator of the number of posts of every written row group
+        """
+        snapshot = engine.execution_options(isolation_level="REPEATABLE READ")
+        async with snapshot.connect() as connection:
+            # the writes stamped since are not all visible in the snapshot
+            settled = datetime.utcnow() - timedelta(
+                seconds=settings.EXPORT_WATERMARK_LAG
+            )
+            watermark = await connection.scalar(select(func.max(Post.updated_at)))
+            if watermark is not None:
+                watermark = min(watermark, settled)
+                if self.since is None or watermark > self.since:
+                    self.watermark = watermark
+            categories = dict(
+                (await connection.execute(select(Category.id, Category.name))).all()
+            )
+            tags = dict((await connection.execute(select(Tag.id, Tag.name))).all())
+            category_positions = {
+                id_: position for position, id_ in enumerate(categories)
+            }
+            tag_positions = {id_: position for position, id_ in enumerate(tags)}
+            category_names = pa.array(list(categories.values()), pa.string())
+            tag_names = pa.array(list(tags.values()), pa.string())
+
+            schema = export_schema(self.watermark)
+            writer = open_writer(sink, schema, self.export_format, self.stream)
+
+            def write_batch(rows) -> None:
+                columns = list(zip(*rows))
+                arrays = [
+                    pa.array(values, field.type)
+                    for values, field in zip(columns[:9], schema)
+                ]
+                arrays.append(
+                    names_array(columns[9], category_positions, category_names)
+                )
+                arrays.append(names_array(columns[10], tag_positions, tag_names))
+                writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+
+            result = await connection.stream(
+                posts_query(self.since).execution_options(
+                    yield_per=settings.EXPORT_BATCH_SIZE
+                )
+            )
+            async for rows in result.partitions():
+                await asyncio.to_thread(write_batch, rows)
+                self.total += len(rows)
+                yield len(rows)
+            await asyncio.to_thread(writer.close)
@@ -0,0 +1,97 @@
+import asyncio
+
+from sqlalchemy import any_
+from sqlalchemy import bindparam
+from sqlalchemy import Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import selectinload
+
+from app.db.models.post import Post
+
+
+class PostLoader:
+    """
+    Batch the posts requested during one event loop iteration into a single
+    `WHERE id = ANY(:ids)` query, with one query each for their categories and
+    tags. Every post id is loaded at most once per loader.
+
+    A loader is bound to a session, so it lives as long as the request.
+    """
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self._futures: dict[int, asyncio.Future] = {}
+        self._pending: list[int] = []
+        self._tasks: set[asyncio.Task] = set()
+
+    def load(self, post_id: int) -> asyncio.Future:
+        """
+        Get a post by its id.
+
+        Args:
+            post_id: The id of the post
+
+        Returns:
+            A future of the post or None if there is no such post
+        """
+        future = self._futures.get(post_id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._futures[post_id] = loop.create_future()
+            if not self._pending:
+                loop.call_soon(self._dispatch)
+            self._pending.append(post_id)
+        return future
+
+    async def load_many(self, post_ids: list[int]) -> list[Post | None]:
+        """
+        Get posts by their ids.
+
+        Args:
+            post_ids: The ids of the posts
+
+        Returns:
+            The posts in the order of the ids, None for missing posts
+        """
+        return list(await asyncio.gather(*(self.load(post_id) for post_id in post_ids)))
+
+    def _dispatch(self) -> None:
+        post_ids, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._fetch(post_ids))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, post_ids: list[int]) -> None:
+        try:
+            result = await self.session.execute(
+                select(Post)
+                .where(
+                    Post.id == any_(bindparam("ids", post_ids, type_=ARRAY(Integer)))
+                )
+                .options(selectinload(Post.categories), selectinload(Post.tags))
+            )
+            posts = {post.id: post for post in result.scalars().all()}
+        except Exception as exc:
+            for post_id in post_ids:
+                self._futures.pop(post_id).set_exception(exc)
+            return
+        for post_id in post_ids:
+            self._futures[post_id].set_result(posts.get(post_id))
+
+
+def post_loader(session: AsyncSession) -> PostLoader:
+    """
+    Get the post loader of a session, creating it on first use.
+
+    Args:
+        session: The database session
+
+    Returns:
+        The post loader
+    """
+    loader = session.info.get("post_loader")
+    if loader is None:
+        loader = session.info["post_loader"] = PostLoader(session)
+    return loader
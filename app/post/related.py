@@ -0,0 +1,454 @@
+"""
+Related posts, ranked by the weighted overlap of their categories and tags.
+
+Every post is a sparse vector over the categories and tags. A feature weighs
+the weight of its kind, RELATED_CATEGORY_WEIGHT or RELATED_TAG_WEIGHT, times
+ln(1 + posts / posts with the feature), so rare features count more, and the
+score of two posts is the sum of the weights of their shared features.
+Features of more than RELATED_FEATURE_MAX_POSTS posts are ignored, they say
+little about a post and would make every post a candidate of every other.
+
+The RELATED_POSTS_LIMIT best posts of every post are kept in related_posts.
+The routes queue the posts whose categories or tags changed, and the workers
+update them every RELATED_UPDATE_INTERVAL seconds: the list of the post is
+recomputed from the posts sharing a feature with it, and the post is put into
+or taken out of their lists. Taking a post out can leave a list short until
+the next full rebuild, which recomputes the table with sparse matrix products
+of NumPy and SciPy every RELATED_REBUILD_INTERVAL seconds, in one worker at a
+time.
+"""
+import asyncio
+import math
+import time
+from datetime import datetime
+
+from loguru import logger
+from sqlalchemy import column
+from sqlalchemy import delete
+from sqlalchemy import Float
+from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy import Integer
+from sqlalchemy import literal
+from sqlalchemy import or_
+from sqlalchemy import text
+from sqlalchemy import tuple_
+from sqlalchemy import values
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.config import settings
+from app.db.conection import async_session_maker
+from app.db.conection import engine
+from app.db.models import post_categories
+from app.db.models import post_tags
+from app.db.models.post import Post
+from app.db.models.related import RelatedPost
+from app.post.counts import posts_estimate
+
+try:
+    import numpy as np
+    import scipy.sparse as sp
+except ImportError:
+    np = sp = None
+
+# serializes the full rebuilds of the workers and the incremental updates
+RELATED_LOCK_ID = 0x72656C61746564
+# seconds between the checks whether a full rebuild is due
+REBUILD_CHECK_INTERVAL = 300
+# rows are inserted in chunks, each row binds two parameters
+INSERT_CHUNK_SIZE = 5000
+
+
+def feature_kinds() -> list[tuple]:
+    """
+    Get the association table, feature column and weight of the categories
+    and of the tags.
+    """
+    return [
+        (
+            post_categories,
+            post_categories.c.category_id,
+            settings.RELATED_CATEGORY_WEIGHT,
+        ),
+        (post_tags, post_tags.c.tag_id, settings.RELATED_TAG_WEIGHT),
+    ]
+
+
+def feature_weight(kind_weight: float, posts: float, feature_posts: int) -> float:
+    return kind_weight * math.log1p(posts / feature_posts)
+
+
+def feature_count(feature, feature_id: int):
+    # features of more posts are ignored, so counting stops after the maximum
+    posts = (
+        select(literal(1))
+        .where(feature == feature_id)
+        .limit(settings.RELATED_FEATURE_MAX_POSTS + 1)
+        .subquery()
+    )
+    return select(func.count()).select_from(posts).scalar_subquery()
+
+
+async def candidate_scores(session: AsyncSession, post_id: int) -> dict[int, float]:
+    """
+    Score the posts sharing a feature with a post.
+
+    Args:
+        session: The database session
+        post_id: The id of the post
+
+    Returns:
+        The scores by post id, empty for posts without features or deleted posts
+    """
+    total = await posts_estimate(session)
+    if total is None:
+        total = await session.scalar(select(func.count(Post.id)))
+    scores: dict[int, float] = {}
+    for table, feature, kind_weight in feature_kinds():
+        result = await session.execute(
+            select(feature).where(table.c.post_id == post_id)
+        )
+        feature_ids = list(result.scalars())
+        if not feature_ids:
+            continue
+        counts = (
+            await session.execute(
+                select(*(feature_count(feature, id_) for id_ in feature_ids))
+            )
+        ).one()
+        weights = [
+            (id_, feature_weight(kind_weight, max(total, count), count))
+            for id_, count in zip(feature_ids, counts)
+            if count <= settings.RELATED_FEATURE_MAX_POSTS
+        ]
+        if not weights:
+            continue
+        batch = values(
+            column("feature_id", Integer), column("weight", Float), name="weights"
+        ).data(weights)
+        result = await session.execute(
+            select(table.c.post_id, func.sum(batch.c.weight))
+            .join(batch, batch.c.feature_id == feature)
+            .where(table.c.post_id != post_id)
+            .group_by(table.c.post_id)
+        )
+        for other_id, score in result:
+            scores[other_id] = scores.get(other_id, 0.0) + score
+    return scores
+
+
+async def update_related_posts(session: AsyncSession, post_id: int) -> None:
+    """
+    Recompute the related posts of a post whose categories or tags changed,
+    and put it into the lists of the posts it is now among the best of.
+
+    Args:
+        session: The database session
+        post_id: The id of the post, also of a deleted one
+    """
+    limit = settings.RELATED_POSTS_LIMIT
+    scores = await candidate_scores(session, post_id)
+    await session.execute(
+        delete(RelatedPost).where(
+            or_(RelatedPost.post_id == post_id, RelatedPost.related_id == post_id)
+        )
+    )
+    if not scores:
+        return
+
+    best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+    await session.execute(
+        insert(RelatedPost),
+        [
+            {"post_id": post_id, "related_id": related_id, "score": score}
+            for related_id, score in best
+        ],
+    )
+
+    rows = sorted(scores.items())
+    changed_ids = []
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        batch = values(
+            column("post_id", Integer), column("score", Float), name="batch"
+        ).data(rows[start : start + INSERT_CHUNK_SIZE])
+        # the score of the last post of a full list
+        last_score = (
+            select(RelatedPost.score)
+            .where(RelatedPost.post_id == batch.c.post_id)
+            .order_by(RelatedPost.score.desc())
+            .offset(limit - 1)
+            .limit(1)
+            .scalar_subquery()
+        )
+        result = await session.execute(
+            insert(RelatedPost)
+            .from_select(
+                ["post_id", "related_id", "score"],
+                select(batch.c.post_id, literal(post_id), batch.c.score).where(
+                    or_(last_score.is_(None), batch.c.score >= last_score)
+                ),
+            )
+            .returning(RelatedPost.post_id)
+        )
+        changed_ids.extend(result.scalars())
+    if changed_ids:
+        await trim_related_posts(session, changed_ids)
+
+
+async def trim_related_posts(session: AsyncSession, post_ids: list[int]) -> None:
+    """
+    Cut the lists of related posts of posts down to RELATED_POSTS_LIMIT.
+    """
+    ranked = (
+        select(
+            RelatedPost.post_id,
+            RelatedPost.related_id,
+            func.row_number()
+            .over(
+                partition_by=RelatedPost.post_id,
+                order_by=(RelatedPost.score.desc(), RelatedPost.related_id),
+            )
+            .label("rank"),
+        )
+        .where(RelatedPost.post_id.in_(post_ids))
+        .subquery()
+    )
+    await session.execute(
+        delete(RelatedPost).where(
+            tuple_(RelatedPost.post_id, RelatedPost.related_id).in_(
+                select(ranked.c.post_id, ranked.c.related_id).where(
+                    ranked.c.rank > settings.RELATED_POSTS_LIMIT
+                )
+            )
+        )
+    )
+
+
+async def get_related_post_ids(
+    session: AsyncSession, post_id: int, limit: int
+) -> list[int]:
+    """
+    Get the ids of the posts most related to a post.
+
+    Args:
+        session: The database session
+        post_id: The id of the post
+        limit: The maximum number of posts
+
+    Returns:
+        The post ids, most related first
+    """
+    result = await session.execute(
+        select(RelatedPost.related_id)
+        .where(RelatedPost.post_id == post_id)
+        .order_by(RelatedPost.score.desc(), RelatedPost.related_id)
+        .limit(limit)
+    )
+    return list(result.scalars())
+
+
+class RelatedPostsUpdater:
+    """
+    Per worker queue of the posts whose categories or tags changed, whose
+    related posts `flush` updates. Posts queued when a worker crashes are
+    updated by the next full rebuild.
+    """
+
+    def __init__(self):
+        self.post_ids: set[int] = set()
+
+    def add(self, *post_ids: int) -> None:
+        self.post_ids.update(post_ids)
+
+    async def flush(self, session: AsyncSession) -> None:
+        """
+        Update the queued posts, queueing them again if the update fails.
+
+        Args:
+            session: The database session
+        """
+        post_ids, self.post_ids = self.post_ids, set()
+        if not post_ids:
+            return
+        try:
+            # waits for a running full rebuild, which would overwrite the updates
+            await session.execute(
+                text("SELECT pg_advisory_xact_lock_shared(:id)"),
+                {"id": RELATED_LOCK_ID},
+            )
+            for post_id in sorted(post_ids):
+                await update_related_posts(session, post_id)
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            self.post_ids |= post_ids
+            raise
+
+
+def top_related(
+    post_ids: list[int], features: list[tuple[list, float]], limit: int
+) -> tuple:
+    """
+    Find the best related posts of every post with sparse matrix products,
+    RELATED_REBUILD_CHUNK posts at a time, so memory stays bounded.
+
+    Args:
+        post_ids: The ids of all posts, ascending
+        features: Per kind of feature the (post id, feature id) pairs and the
+            weight of the kind
+        limit: The maximum number of related posts per post
+
+    Returns:
+        Arrays of the post ids, related post ids and scores
+    """
+    ids = np.asarray(post_ids, dtype=np.int64)
+    posts = len(ids)
+    matrices, weights = [], []
+    for pairs, kind_weight in features:
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        rows = np.searchsorted(ids, pairs[:, 0])
+        # pairs of posts created after the ids were read
+        known = rows < posts
+        known[known] = ids[rows[known]] == pairs[known, 0]
+        feature_ids, columns = np.unique(pairs[known, 1], return_inverse=True)
+        matrix = sp.csr_matrix(
+            (np.ones(len(columns)), (rows[known], columns)),
+            shape=(posts, len(feature_ids)),
+        )
+        counts = np.bincount(columns, minlength=len(feature_ids))
+        kind_weights = kind_weight * np.log1p(posts / np.maximum(counts, 1))
+        kind_weights[counts > settings.RELATED_FEATURE_MAX_POSTS] = 0
+        matrices.append(matrix)
+        weights.append(kind_weights)
+
+    weights = np.concatenate(weights)
+    used = np.flatnonzero(weights)
+    empty = np.empty(0, dtype=np.int64)
+    if not posts or not len(used):
+        return empty, empty, np.empty(0)
+    # post x feature, 1 for the features of a post, and weighted
+    binary = sp.hstack(matrices, format="csc")[:, used].tocsr()
+    weighted = (binary @ sp.diags(weights[used])).tocsr()
+    transposed = binary.T.tocsr()
+
+    chunks = []
+    for start in range(0, posts, settings.RELATED_REBUILD_CHUNK):
+        scores = (
+            weighted[start : start + settings.RELATED_REBUILD_CHUNK] @ transposed
+        ).tocoo()
+        rows = scores.row.astype(np.int64) + start
+        other = rows != scores.col
+        rows, columns, data = rows[other], scores.col[other], scores.data[other]
+        order = np.lexsort((columns, -data, rows))
+        rows, columns, data = rows[order], columns[order], data[order]
+        # the position of every score within the scores of its post
+        rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        best = rank < limit
+        chunks.append((ids[rows[best]], ids[columns[best]], data[best]))
+    return tuple(np.concatenate(arrays) for arrays in zip(*chunks))
+
+
+async def rebuild_related_posts(force: bool = False) -> bool:
+    """
+    Recompute the related posts of all posts, if no other worker is doing it
+    and the last full rebuild is older than RELATED_REBUILD_INTERVAL.
+
+    Args:
+        force: Rebuild even if the last full rebuild is recent
+
+    Returns:
+        Whether the related posts were rebuilt
+    """
+    if np is None:
+        raise RuntimeError("Full rebuilds of the related posts need numpy and scipy")
+    started = datetime.utcnow()
+    async with engine.begin() as connection:
+        locked = await connection.scalar(
+            text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": RELATED_LOCK_ID}
+        )
+        if not locked:
+            return False
+        rebuilt_at = await connection.scalar(select(func.max(RelatedPost.rebuilt_at)))
+        if (
+            not force
+            and rebuilt_at is not None
+            and (started - rebuilt_at).total_seconds()
+            < settings.RELATED_REBUILD_INTERVAL
+        ):
+            return False
+
+        post_ids = (
+            await connection.execute(select(Post.id).order_by(Post.id))
+        ).scalars()
+        features = [
+            ((await connection.execute(select(table.c.post_id, feature))).all(), weight)
+            for table, feature, weight in feature_kinds()
+        ]
+        post_ids, related_ids, scores = await asyncio.to_thread(
+            top_related, list(post_ids), features, settings.RELATED_POSTS_LIMIT
+        )
+
+        await connection.execute(delete(RelatedPost))
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            RelatedPost.__tablename__,
+            records=(
+                (post_id, related_id, score, started)
+                for post_id, related_id, score in zip(
+                    post_ids.tolist(), related_ids.tolist(), scores.tolist()
+                )
+            ),
+            columns=["post_id", "related_id", "score", "rebuilt_at"],
+        )
+    logger.info(
+        f"Rebuilt {len(post_ids)} related posts in "
+        f"{(datetime.utcnow() - started).total_seconds():.2f}s"
+    )
+    return True
+
+
+async def maintain_related_posts_periodically() -> None:
+    """
+    Background task which updates the related posts of the queued posts every
+    RELATED_UPDATE_INTERVAL seconds, and once more when it is cancelled on
+    shutdown, and checks every REBUILD_CHECK_INTERVAL seconds whether a full
+    rebuild is due. The related posts of the existing posts are built on start
+    if there are none yet.
+    """
+    if np is None:
+        logger.warning(
+            "Full rebuilds of the related posts need numpy and scipy, install "
+            "them with pip install numpy scipy"
+        )
+    else:
+        try:
+            async with async_session_maker() as session:
+                empty = (
+                    await session.scalar(select(RelatedPost.post_id).limit(1)) is None
+                )
+            if empty:
+                await rebuild_related_posts(force=True)
+        except Exception as exc:
+            logger.warning(f"Building the related posts failed: {exc}")
+    next_check = time.monotonic() + REBUILD_CHECK_INTERVAL
+    try:
+        while True:
+            try:
+                async with async_session_maker() as session:
+                    await related_posts_updater.flush(session)
+            except Exception as exc:
+                logger.warning(f"Updating related posts failed: {exc}")
+            if np is not None and time.monotonic() >= next_check:
+                next_check = time.monotonic() + REBUILD_CHECK_INTERVAL
+                try:
+                    await rebuild_related_posts()
+                except Exception as exc:
+                    logger.warning(f"Rebuilding related posts failed: {exc}")
+            await asyncio.sleep(settings.RELATED_UPDATE_INTERVAL)
+    finally:
+        async with async_session_maker() as session:
+            await related_posts_updater.flush(session)
+
+
+related_posts_updater = RelatedPostsUpdater()
@@ -1,33 +1,80 @@
+import asyncio
+from datetime import datetime
+
 from fastapi import Depends
+from fastapi import Header
 from fastapi import HTTPException
 from fastapi import Query
+from fastapi import Response
 from fastapi import status
+from fastapi.responses import StreamingResponse
 from fastapi.routing import APIRouter
 from sqlalchemy import asc
 from sqlalchemy import desc
-from sqlalchemy import or_
+from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 
 from app.auth.manager import verified_author
+from app.config import settings
 from app.db.conection import get_async_session
+from app.db.invalidation import invalidation_bus
+from app.db.invalidation import InvalidationKey
 from app.db.models import Author
 from app.db.models.category import Category
 from app.db.models.post import Post
 from app.db.models.tag import Tag
+from app.fields import parse_fields
+from app.post.counts import COUNT_DESCRIPTION
+from app.post.counts import count_key
+from app.post.counts import COUNT_PATTERN
+from app.post.counts import count_posts
+from app.post.counts import CREATED_AFTER_DESCRIPTION
+from app.post.counts import CREATED_BEFORE_DESCRIPTION
+from app.post.counts import set_total_count
+from app.post.loader import post_loader
+from app.post.related import get_related_post_ids
+from app.post.related import related_posts_updater
 from app.post.schemas import PostCreate
 from app.post.schemas import PostRetrieve
+from app.post.search import search_index
+from app.post.services import build_post_change
+from app.post.services import convert_post_to_fields
 from app.post.services import convert_post_to_post_retrieve
+from app.post.services import convert_row_to_post_retrieve
+from app.post.services import created_filters
+from app.post.services import find_missing_names
+from app.post.services import get_categories_by_names
+from app.post.services import get_or_create_tags
 from app.post.services import get_post
+from app.post.services import get_post_taxonomy
+from app.post.services import notify_post_change
+from app.post.services import parse_ids
+from app.post.services import parse_if_match
+from app.post.services import post_change
+from app.post.services import post_etag
+from app.post.services import post_filters
+from app.post.services import post_load_options
+from app.post.services import replace_post_categories
+from app.post.services import replace_post_tags
+from app.post.stream import format_event
+from app.post.stream import post_change_broker
+from app.post.stream import Subscriber
+from app.post.views import get_trending_post_ids
+from app.post.views import view_counter
+from app.tag.services import tag_index
 
 
 post_router = APIRouter(prefix="/api/post", tags=["posts"])
 
+FIELDS_DESCRIPTION = "Comma separated fields to return, e.g. id,title"
+
 
 @post_router.post("/")
 async def create_post(
     post_data: PostCreate,
+    response: Response,
     session: AsyncSession = Depends(get_async_session),
     current_author: Author = Depends(verified_author),
 ):
@@ -36,33 +83,15 @@ async def create_post(
 
     Args:
         post_data: The post data
+        response: The response, used to set the ETag header
         session: The database session
         current_author: The authenticated author
 
     Returns:
         The created post
     """
-    categories = await session.execute(
-        select(Category).filter(Category.name.in_(post_data.category_names))
-    )
-    categories = categories.scalars().all()
-    if len(categories) != len(post_data.category_names):
-        existing_category_names = [category.name for category in categories]
-        missing_categories = set(post_data.category_names) - set(
-            existing_category_names
-        )
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Categories not found: {', '.join(missing_categories)}",
-        )
-
-    tags = []
-    for tag_name in post_data.tag_names:
-        tag = await session.execute(select(Tag).filter(Tag.name == tag_name))
-        tag = tag.scalars().first()
-        if not tag:
-            tag = Tag(name=tag_name)
-        tags.append(tag)
+    categories = await get_categories_by_names(session, post_data.category_names)
+    tags = await get_or_create_tags(session, post_data.tag_names)
 
     post = Post(
         title=post_data.title,
@@ -72,125 +101,298 @@ async def create_post(
         tags=tags,
     )
     session.add(post)
+    await session.flush()
+    change = post_change("create", post)
+    await notify_post_change(session, change)
+    invalidation_bus.publish(
+        session,
+        InvalidationKey("post", post.id),
+        *(InvalidationKey("tag", tag.name) for tag in post.tags),
+    )
 
     await session.commit()
-    await session.refresh(post)
+    tag_index.update(added=[tag.name for tag in post.tags])
+    search_index.apply(change)
+    related_posts_updater.add(post.id)
+    response.headers["ETag"] = post_etag(post.version)
     return convert_post_to_post_retrieve(post)
 
 
 @post_router.patch("/posts/{post_id}")
 async def update_post(
     post_id: int,
+    response: Response,
     title: str = None,
     description: str = None,
     category_names: list[str] = None,
     tag_names: list[str] = None,
+    if_match: str | None = Header(default=None),
     session: AsyncSession = Depends(get_async_session),
     current_author: Author = Depends(verified_author),
 ):
     """
-    Update a post by its id if the authenticated author is the author of the post
+    Update a post by its id if the authenticated author is the author of the post.
+    The post row is updated and returned by a single UPDATE ... RETURNING statement,
+    and only the changed categories and tags are deleted or inserted.
 
     Args:
         post_id: The id of the post to be updated
+        response: The response, used to set the ETag header
         title: The new title of the post
         description: The new description of the post
         category_names: The new category names of the post
         tag_names: The new tag names of the post
+        if_match: The ETag of the post version the update is based on
         session: The database session
         current_author: The authenticated author
 
     Returns:
         The updated post
     """
-    post = await get_post(post_id, session)
-    if not post or post.author_id != current_author.id:
+    expected_version = parse_if_match(if_match)
+
+    values = {"updated_at": datetime.utcnow(), "version": Post.version + 1}
+    if title:
+        values["title"] = title
+    if description:
+        values["description"] = description
+
+    stmt = (
+        update(Post)
+        .where(Post.id == post_id, Post.author_id == current_author.id)
+        .values(**values)
+        .returning(
+            Post.id,
+            Post.title,
+            Post.description,
+            Post.author_id,
+            Post.created_at,
+            Post.updated_at,
+            Post.version,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if expected_version is not None:
+        stmt = stmt.where(Post.version == expected_version)
+    row = (await session.execute(stmt)).first()
+
+    if row is None:
+        owned = await session.scalar(
+            select(Post.id).filter(
+                Post.id == post_id, Post.author_id == current_author.id
+            )
+        )
+        if owned is not None and expected_version is not None:
+            raise HTTPException(
+                status_code=status.HTTP_412_PRECONDITION_FAILED,
+                detail="Post was modified by another request",
+            )
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Post not found or you are not the author of this post",
         )
 
-    if title:
-        post.title = title
-    if description:
-        post.description = description
-
-    categories = []
-    tags = []
+    if not category_names or not tag_names:
+        current_category_names, current_tag_names = await get_post_taxonomy(
+            session, post_id
+        )
 
     if category_names:
-        result = await session.execute(
-            select(Category).filter(Category.name.in_(category_names))
+        categories = await get_categories_by_names(session, category_names)
+        await replace_post_categories(
+            session, post_id, row.created_at, [category.id for category in categories]
         )
-        categories = result.scalars().all()
-        if len(categories) != len(category_names):
-            existing_category_names = [category.name for category in categories]
-            missing_categories = set(category_names) - set(existing_category_names)
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Categories not found: {', '.join(missing_categories)}",
-            )
-        post.categories = categories
+        current_category_names = [category.name for category in categories]
 
+    added_tag_names, removed_tag_names = [], []
     if tag_names:
-        tags = []
-        for tag_name in tag_names:
-            result = await session.execute(select(Tag).filter(Tag.name == tag_name))
-            tag = result.scalars().first()
-            if not tag:
-                tag = Tag(name=tag_name)
-            tags.append(tag)
-        post.tags = tags
-
-    session.add(post)
+        tags = await get_or_create_tags(session, tag_names)
+        added_tag_names, removed_tag_names = await replace_post_tags(
+            session, post_id, row.created_at, tags
+        )
+        current_tag_names = [tag.name for tag in tags]
+
+    change = build_post_change(
+        "update",
+        row.id,
+        row.author_id,
+        current_category_names,
+        current_tag_names,
+        row.updated_at,
+    )
+    await notify_post_change(session, change)
+    invalidation_bus.publish(
+        session,
+        InvalidationKey("post", row.id),
+        *(InvalidationKey("tag", name) for name in added_tag_names + removed_tag_names),
+    )
     await session.commit()
-    await session.refresh(post)
-    return convert_post_to_post_retrieve(post)
 
+    tag_index.update(added=added_tag_names, removed=removed_tag_names)
+    search_index.apply(change)
+    if category_names or added_tag_names or removed_tag_names:
+        related_posts_updater.add(row.id)
+    response.headers["ETag"] = post_etag(row.version)
+    return convert_row_to_post_retrieve(row, current_category_names, current_tag_names)
 
-@post_router.get("/posts/{post_id}", response_model=PostRetrieve)
+
+@post_router.get(
+    "/posts/{post_id}", response_model=None, responses={200: {"model": PostRetrieve}}
+)
 async def get_single_post(
-    post_id: int, session: AsyncSession = Depends(get_async_session)
+    post_id: int,
+    response: Response,
+    fields: str = Query(None, description=FIELDS_DESCRIPTION),
+    session: AsyncSession = Depends(get_async_session),
 ):
     """
     Get a single post by its id
 
     Args:
         post_id: The id of the post to be retrieved
+        response: The response, used to set the ETag header
+        fields: Comma separated PostRetrieve fields to return, all by default
         session: The database session
 
     Returns:
         The post with the given id
     """
+    requested_fields = parse_fields(fields, PostRetrieve)
 
-    result = await session.execute(
-        select(Post)
-        .filter(Post.id == post_id)
-        .options(selectinload(Post.categories), selectinload(Post.tags))
-    )
-    post = result.scalars().first()
+    if requested_fields is None:
+        post = await get_post(post_id, session)
+    else:
+        result = await session.execute(
+            select(Post)
+            .filter(Post.id == post_id)
+            .options(*post_load_options(requested_fields))
+        )
+        post = result.scalars().first()
     if not post:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Post not found"
         )
+    view_counter.increment(post.id)
+    response.headers["ETag"] = post_etag(post.version)
+    if requested_fields is not None:
+        return convert_post_to_fields(post, requested_fields)
     return convert_post_to_post_retrieve(post)
 
 
-@post_router.get("/posts", response_model=list[PostRetrieve])
-async def get_all_posts(session: AsyncSession = Depends(get_async_session)):
+@post_router.get("/trending", response_model=list[PostRetrieve])
+async def get_trending_posts(
+    limit: int = Query(10, ge=1, le=settings.TRENDING_LIMIT),
+    session: AsyncSession = Depends(get_async_session),
+):
     """
-    Get all posts
+    Get the most viewed posts, recent views weighing more than older ones.
+    Views are counted in batches, so new views show up after a few seconds.
 
     Args:
+        limit: The maximum number of posts
         session: The database session
 
     Returns:
-        A list of all posts
+        A list of posts, most trending first
     """
+    post_ids = await get_trending_post_ids(session, limit)
+    posts = await post_loader(session).load_many(post_ids)
+    return [convert_post_to_post_retrieve(post) for post in posts if post is not None]
+
+
+@post_router.get("/posts/{post_id}/related", response_model=list[PostRetrieve])
+async def get_related_posts(
+    post_id: int,
+    limit: int = Query(10, ge=1, le=settings.RELATED_POSTS_LIMIT),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Get the posts sharing the most categories and tags with a post, rare ones
+    weighing more. Changed categories and tags show up after a few seconds.
+
+    Args:
+        post_id: The id of the post
+        limit: The maximum number of posts
+        session: The database session
+
+    Returns:
+        A list of posts, most related first
+    """
+    related_ids = await get_related_post_ids(session, post_id, limit)
+    post, *posts = await post_loader(session).load_many([post_id, *related_ids])
+    if post is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Post not found"
+        )
+    return [convert_post_to_post_retrieve(post) for post in posts if post is not None]
+
+
+@post_router.get(
+    "/posts",
+    response_model=None,
+    responses={200: {"model": list[PostRetrieve | None]}},
+)
+async def get_all_posts(
+    response: Response,
+    ids: str = Query(
+        None, description="Comma separated post ids, returned in the same order"
+    ),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(None, ge=1, le=1000),
+    created_after: datetime = Query(None, description=CREATED_AFTER_DESCRIPTION),
+    created_before: datetime = Query(None, description=CREATED_BEFORE_DESCRIPTION),
+    count: str = Query("none", pattern=COUNT_PATTERN, description=COUNT_DESCRIPTION),
+    fields: str = Query(None, description=FIELDS_DESCRIPTION),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Get all posts ordered by id, or the posts with the given ids with null for
+    missing posts
+
+    Args:
+        response: The response, used to set the X-Total-Count header
+        ids: Comma separated post ids, all posts by default
+        offset: The number of posts to skip
+        limit: The maximum number of posts, all by default
+        created_after: Only posts created at or after this moment
+        created_before: Only posts created before this moment
+        count: Put the total number of posts in the X-Total-Count header
+        fields: Comma separated PostRetrieve fields to return, all by default
+        session: The database session
+
+    Returns:
+        A list of posts
+    """
+    requested_fields = parse_fields(fields, PostRetrieve)
+
+    if ids is not None:
+        posts = await post_loader(session).load_many(parse_ids(ids))
+        if requested_fields is not None:
+            return [
+                convert_post_to_fields(post, requested_fields) if post else None
+                for post in posts
+            ]
+        return [convert_post_to_post_retrieve(post) if post else None for post in posts]
+
+    filters = created_filters(created_after, created_before)
     result = await session.execute(
-        select(Post).options(selectinload(Post.categories), selectinload(Post.tags))
+        select(Post)
+        .filter(*filters)
+        .options(*post_load_options(requested_fields))
+        .order_by(Post.id)
+        .offset(offset)
+        .limit(limit)
     )
     posts = result.scalars().all()
+
+    if count != "none" and limit is None and (posts or not offset):
+        set_total_count(response, (offset + len(posts), "exact"))
+    else:
+        key = count_key(created_after=created_after, created_before=created_before)
+        set_total_count(response, await count_posts(session, count, filters, key))
+
+    if requested_fields is not None:
+        return [convert_post_to_fields(post, requested_fields) for post in posts]
     return [convert_post_to_post_retrieve(post) for post in posts]
 
 
@@ -225,42 +427,70 @@ async def delete_post(
             detail="You are not the author of this post",
         )
 
+    change = post_change("delete", post)
+    await notify_post_change(session, change)
+    removed_tag_names = [tag.name for tag in post.tags]
+    invalidation_bus.publish(
+        session,
+        InvalidationKey("post", post.id),
+        *(InvalidationKey("tag", name) for name in removed_tag_names),
+    )
     await session.delete(post)
     await session.commit()
+    tag_index.update(removed=removed_tag_names)
+    search_index.apply(change)
+    related_posts_updater.add(post.id)
 
     return {"message": "Post deleted successfully"}
 
 
 @post_router.get("/posts/search/")
 async def search_posts(
+    response: Response,
     category_names: list[str] = Query(None),
     tag_names: list[str] = Query(None),
     order_by: str = Query("desc"),
+    match: str = Query("any", pattern="^(any|all)$"),
+    exclude_category_names: list[str] = Query(None),
+    exclude_tag_names: list[str] = Query(None),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(None, ge=1, le=1000),
+    created_after: datetime = Query(None, description=CREATED_AFTER_DESCRIPTION),
+    created_before: datetime = Query(None, description=CREATED_BEFORE_DESCRIPTION),
+    count: str = Query("none", pattern=COUNT_PATTERN, description=COUNT_DESCRIPTION),
+    fields: str = Query(None, description=FIELDS_DESCRIPTION),
     session: AsyncSession = Depends(get_async_session),
 ):
     """
-    Search posts by categories and tags and order by updated_at
+    Search posts by categories and tags and order by updated_at.
+    Served from the in-memory search index when it is enabled and no created_at
+    window is given.
 
     Args:
+        response: The response, used to set the X-Total-Count header
         category_names: list of category names
         tag_names: list of tag names
         order_by: order by updated_at field. Default is 'desc'
+        match: 'any' (default) or 'all' of the categories and of the tags
+        exclude_category_names: list of category names the posts must not have
+        exclude_tag_names: list of tag names the posts must not have
+        offset: The number of posts to skip
+        limit: The maximum number of posts, all by default
+        created_after: Only posts created at or after this moment
+        created_before: Only posts created before this moment
+        count: Put the total number of matching posts in the X-Total-Count header
+        fields: Comma separated PostRetrieve fields to return
         session: The database session
 
     Returns:
         A list of posts that match the search criteria
     """
-    existing_categories = []
-    existing_tags = []
+    requested_fields = parse_fields(fields, PostRetrieve)
 
     if category_names:
-        existing_categories = await session.execute(
-            select(Category).filter(Category.name.in_(category_names))
+        not_found_categories = await find_missing_names(
+            session, Category, category_names, search_index.categories
         )
-        existing_categories = [
-            category.name for category in existing_categories.scalars()
-        ]
-        not_found_categories = set(category_names) - set(existing_categories)
         if not_found_categories:
             raise HTTPException(
                 status_code=404,
@@ -268,40 +498,158 @@ async def search_posts(
             )
 
     if tag_names:
-        existing_tags = await session.execute(
-            select(Tag).filter(Tag.name.in_(tag_names))
+        not_found_tags = await find_missing_names(
+            session, Tag, tag_names, search_index.tags
         )
-        existing_tags = [tag.name for tag in existing_tags.scalars()]
-        not_found_tags = set(tag_names) - set(existing_tags)
         if not_found_tags:
             raise HTTPException(
                 status_code=404,
                 detail=f"Next tags not found: {', '.join(not_found_tags)}",
             )
 
-    query = select(Post)
-
-    if existing_categories:
-        query = query.filter(
-            or_(
-                Post.categories.any(Category.name == category_name)
-                for category_name in existing_categories
-            )
-        )
-    if existing_tags:
-        query = query.filter(
-            or_(Post.tags.any(Tag.name == tag_name) for tag_name in existing_tags)
-        )
-
-    if order_by == "desc":
-        query = query.order_by(desc(Post.updated_at))
-    elif order_by == "asc":
-        query = query.order_by(asc(Post.updated_at))
-    else:
+    if order_by not in ("desc", "asc"):
         raise HTTPException(
             status_code=400,
             detail="Does not support this order_by value. Use 'desc' or 'asc'",
         )
 
-    posts = await session.execute(query)
-    return posts.scalars().all()
+    if search_index.enabled and created_after is None and created_before is None:
+        post_ids = search_index.search(
+            category_names,
+            tag_names,
+            match,
+            exclude_category_names,
+            exclude_tag_names,
+        )
+        page = search_index.page(post_ids, order_by == "desc", offset, limit)
+        if count != "none":
+            set_total_count(response, (len(post_ids), "exact"))
+        posts = await post_loader(session).load_many(page)
+        posts = [post for post in posts if post is not None]
+    else:
+        filters = post_filters(
+            category_names,
+            tag_names,
+            match,
+            exclude_category_names,
+            exclude_tag_names,
+            created_after,
+            created_before,
+        )
+        order = desc if order_by == "desc" else asc
+        query = (
+            select(Post)
+            .filter(*filters)
+            .order_by(order(Post.updated_at), order(Post.id))
+            .offset(offset)
+            .limit(limit)
+        )
+        if requested_fields is not None:
+            query = query.options(*post_load_options(requested_fields))
+        posts = (await session.execute(query)).scalars().all()
+        if count != "none" and limit is None and (posts or not offset):
+            set_total_count(response, (offset + len(posts), "exact"))
+        else:
+            key = count_key(
+                category_names,
+                tag_names,
+                match,
+                exclude_category_names,
+                exclude_tag_names,
+                created_after,
+                created_before,
+            )
+            set_total_count(response, await count_posts(session, count, filters, key))
+
+    if requested_fields is not None:
+        return [convert_post_to_fields(post, requested_fields) for post in posts]
+    return posts
+
+
+@post_router.get("/stream")
+async def stream_posts(
+    category_names: list[str] = Query(None),
+    tag_names: list[str] = Query(None),
+    author_id: int = None,
+    last_event_id: str | None = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Stream created, updated and deleted posts as Server-Sent Events.
+    A post matches if it has any of the given categories and any of the given tags.
+    Reconnecting clients send the Last-Event-ID header and first receive the
+    posts updated since then; deletions are not replayed.
+
+    Args:
+        category_names: list of category names
+        tag_names: list of tag names
+        author_id: The id of the author
+        last_event_id: The id of the last event received by the client
+        session: The database session
+
+    Returns:
+        The event stream
+    """
+    since = None
+    if last_event_id:
+        try:
+            since = datetime.fromisoformat(last_event_id)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid Last-Event-ID"
+            )
+
+    subscriber = Subscriber(
+        category_names=set(category_names or ()),
+        tag_names=set(tag_names or ()),
+        author_id=author_id,
+    )
+    # subscribe before the backfill query so no change falls in between
+    post_change_broker.subscribe(subscriber)
+
+    backlog = []
+    if since is not None:
+        query = (
+            select(Post)
+            .filter(Post.updated_at > since)
+            .options(selectinload(Post.categories), selectinload(Post.tags))
+            .order_by(asc(Post.updated_at))
+            .limit(settings.POST_STREAM_RESUME_LIMIT)
+        )
+        if author_id is not None:
+            query = query.filter(Post.author_id == author_id)
+        if category_names:
+            query = query.filter(Post.categories.any(Category.name.in_(category_names)))
+        if tag_names:
+            query = query.filter(Post.tags.any(Tag.name.in_(tag_names)))
+        try:
+            result = await session.execute(query)
+        except BaseException:
+            post_change_broker.unsubscribe(subscriber)
+            raise
+        backlog = [post_change("update", post) for post in result.scalars()]
+
+    async def events():
+        try:
+            yield f"retry: {settings.POST_STREAM_RETRY_MS}\n\n"
+            for change in backlog:
+                yield format_event(change)
+            while True:
+                try:
+                    change = await asyncio.wait_for(
+                        subscriber.queue.get(), timeout=settings.POST_STREAM_HEARTBEAT
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if change is None:
+                    return
+                yield format_event(change)
+        finally:
+            post_change_broker.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
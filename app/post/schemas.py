@@ -16,6 +16,12 @@ class TagSchema(BaseModel):
     name: str
 
 
+class PostSummary(BaseModel):
+    id: int
+    title: str
+    updated_at: str
+
+
 class PostRetrieve(BaseModel):
     id: int
     title: str
@@ -25,3 +31,8 @@ class PostRetrieve(BaseModel):
     updated_at: str
     categories: list[CategorySchema]
     tags: list[TagSchema]
+
+
+class PostPage(BaseModel):
+    items: list[PostRetrieve] | list[PostSummary]
+    next_cursor: str | None
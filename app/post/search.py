@@ -0,0 +1,334 @@
+import asyncio
+import bisect
+import json
+from datetime import datetime
+
+from loguru import logger
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.bitmap import Bitmap
+from app.config import settings
+from app.db.conection import async_session_maker
+from app.db.invalidation import invalidation_bus
+from app.db.listener import pg_listener
+from app.db.models import post_categories
+from app.db.models import post_tags
+from app.db.models.category import Category
+from app.db.models.post import Post
+from app.db.models.tag import Tag
+from app.post.stream import POST_CHANNEL
+
+
+class PostSearchIndex:
+    """
+    In-memory inverted index of the posts of each category and tag.
+
+    Every category and tag maps to a Bitmap of post ids, so any/all/not
+    filters are set operations, and the (updated_at, id) pairs of all posts
+    are kept sorted to order the matches without the database.
+
+    The index is built by `load_search_index` and kept current by `apply`,
+    which the post write handlers call with their change after the commit and
+    the listener calls with the changes of every worker.
+    It is disabled when there are more than SEARCH_INDEX_MAX_POSTS posts.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.categories: dict[str, Bitmap] = {}
+        self.tags: dict[str, Bitmap] = {}
+        self.posts: dict[int, tuple[frozenset[str], frozenset[str], datetime]] = {}
+        self.order: list[tuple[datetime, int]] = []
+        self.all_posts = Bitmap()
+        self._replay: list[dict] | None = None
+
+    def load(self, rows: list[tuple[int, datetime, list[str], list[str]]]) -> None:
+        """
+        Replace the index with the given posts and replay the changes applied
+        while they were read.
+
+        Args:
+            rows: The id, updated_at, category names and tag names of every post
+        """
+        replay, self._replay = self._replay or [], None
+        self.categories, self.tags, self.posts = {}, {}, {}
+        self.order, self.all_posts = [], Bitmap()
+        for post_id, updated_at, category_names, tag_names in rows:
+            self.posts[post_id] = (
+                frozenset(category_names),
+                frozenset(tag_names),
+                updated_at,
+            )
+            self.all_posts.add(post_id)
+            for name in category_names:
+                self.categories.setdefault(name, Bitmap()).add(post_id)
+            for name in tag_names:
+                self.tags.setdefault(name, Bitmap()).add(post_id)
+        self.order = sorted(
+            (updated_at, post_id) for post_id, (_, _, updated_at) in self.posts.items()
+        )
+        self.enabled = True
+        for change in replay:
+            self.apply(change)
+
+    def start_loading(self) -> None:
+        self._replay = []
+
+    def disable(self) -> None:
+        self.enabled = False
+        self.categories, self.tags, self.posts = {}, {}, {}
+        self.order, self.all_posts = [], Bitmap()
+
+    def apply(self, change: dict) -> None:
+        """
+        Apply a post change of the change feed.
+
+        Args:
+            change: The change built by build_post_change
+        """
+        if self._replay is not None:
+            self._replay.append(change)
+        if not self.enabled:
+            return
+        post_id = change["id"]
+        if change["event"] == "delete":
+            self._remove(post_id)
+            return
+        updated_at = datetime.fromisoformat(change["updated_at"])
+        current = self.posts.get(post_id)
+        if current is not None and current[2] > updated_at:
+            return
+        self._remove(post_id)
+        self._add(post_id, change["categories"], change["tags"], updated_at)
+
+    def _add(
+        self,
+        post_id: int,
+        category_names: list[str],
+        tag_names: list[str],
+        updated_at: datetime,
+    ) -> None:
+        if len(self.posts) >= settings.SEARCH_INDEX_MAX_POSTS:
+            logger.warning("Too many posts for the search index, disabling it.")
+            self.disable()
+            return
+        self.posts[post_id] = (
+            frozenset(category_names),
+            frozenset(tag_names),
+            updated_at,
+        )
+        self.all_posts.add(post_id)
+        for name in category_names:
+            self.categories.setdefault(name, Bitmap()).add(post_id)
+        for name in tag_names:
+            self.tags.setdefault(name, Bitmap()).add(post_id)
+        bisect.insort(self.order, (updated_at, post_id))
+
+    def _remove(self, post_id: int) -> None:
+        current = self.posts.pop(post_id, None)
+        if current is None:
+            return
+        category_names, tag_names, updated_at = current
+        self.all_posts.discard(post_id)
+        for names, bitmaps in (
+            (category_names, self.categories),
+            (tag_names, self.tags),
+        ):
+            for name in names:
+                bitmaps[name].discard(post_id)
+                if not bitmaps[name]:
+                    del bitmaps[name]
+        position = bisect.bisect_left(self.order, (updated_at, post_id))
+        if position < len(self.order) and self.order[position] == (updated_at, post_id):
+            del self.order[position]
+
+    def search(
+        self,
+        category_names: list[str] | None = None,
+        tag_names: list[str] | None = None,
+        match: str = "any",
+        exclude_category_names: list[str] | None = None,
+        exclude_tag_names: list[str] | None = None,
+    ) -> Bitmap:
+        """
+        Get the ids of the posts matching the filters.
+
+        Args:
+            category_names: The posts must have any (or all) of these categories
+            tag_names: The posts must have any (or all) of these tags
+            match: "any" or "all"
+            exclude_category_names: The posts must have none of these categories
+            exclude_tag_names: The posts must have none of these tags
+
+        Returns:
+            The ids of the matching posts
+        """
+        combine = Bitmap.union if match == "any" else Bitmap.intersection
+        filters = []
+        for names, bitmaps in (
+            (category_names, self.categories),
+            (tag_names, self.tags),
+        ):
+            if names:
+                filters.append(combine(bitmaps.get(name, Bitmap()) for name in names))
+        result = Bitmap.intersection(filters) if filters else self.all_posts.copy()
+
+        for names, bitmaps in (
+            (exclude_category_names, self.categories),
+            (exclude_tag_names, self.tags),
+        ):
+            for name in names or ():
+                if name in bitmaps:
+                    result = result - bitmaps[name]
+        return result
+
+    def page(
+        self, post_ids: Bitmap, descending: bool, offset: int, limit: int | None
+    ) -> list[int]:
+        """
+        Order post ids by updated_at and id and slice a page.
+
+        Small results are sorted, large ones are picked from the sorted order
+        of all posts.
+
+        Args:
+            post_ids: The ids of the matching posts
+            descending: Newest first if True
+            offset: The number of posts to skip
+            limit: The maximum number of posts, None for all
+
+        Returns:
+            The post ids of the page
+        """
+        end = None if limit is None else offset + limit
+        if end is None or len(post_ids) * 8 < len(self.order):
+            ordered = sorted(
+                post_ids,
+                key=lambda post_id: (self.posts[post_id][2], post_id),
+                reverse=descending,
+            )
+            return ordered[offset:end]
+
+        page = []
+        order = reversed(self.order) if descending else iter(self.order)
+        for _, post_id in order:
+            if post_id in post_ids:
+                page.append(post_id)
+                if len(page) == end:
+                    break
+        return page[offset:]
+
+
+async def load_search_index(session: AsyncSession) -> None:
+    """
+    Rebuild the search index from the database, or disable it if there are too
+    many posts.
+
+    Args:
+        session: The database session
+    """
+    total = await session.scalar(select(func.count(Post.id)))
+    if total > settings.SEARCH_INDEX_MAX_POSTS:
+        search_index.disable()
+        return
+
+    search_index.start_loading()
+    posts = {
+        post_id: (updated_at, [], [])
+        for post_id, updated_at in await session.execute(
+            select(Post.id, Post.updated_at)
+        )
+    }
+    category_rows = await session.execute(
+        select(post_categories.c.post_id, Category.name).join(
+            Category, Category.id == post_categories.c.category_id
+        )
+    )
+    for post_id, name in category_rows:
+        if post_id in posts:
+            posts[post_id][1].append(name)
+    tag_rows = await session.execute(
+        select(post_tags.c.post_id, Tag.name).join(Tag, Tag.id == post_tags.c.tag_id)
+    )
+    for post_id, name in tag_rows:
+        if post_id in posts:
+            posts[post_id][2].append(name)
+
+    search_index.load(
+        [
+            (post_id, updated_at, category_names, tag_names)
+            for post_id, (updated_at, category_names, tag_names) in posts.items()
+        ]
+    )
+
+
+async def refresh_search_index_periodically() -> None:
+    """
+    Background task which rebuilds the search index every SEARCH_INDEX_REFRESH
+    seconds, repairing it if a change was missed.
+    """
+    if not settings.SEARCH_INDEX_ENABLED:
+        return
+    while True:
+        try:
+            async with async_session_maker() as session:
+                await load_search_index(session)
+        except Exception as exc:
+            logger.warning(f"Search index refresh failed: {exc}")
+        await asyncio.sleep(settings.SEARCH_INDEX_REFRESH)
+
+
+class SearchIndexRebuilder:
+    """
+    Rebuilds the search index in the background, one rebuild at a time.
+    Requests during a rebuild are coalesced into one more rebuild after it, so
+    a burst of invalidations never runs overlapping full rebuilds.
+    """
+
+    def __init__(self):
+        self.task: asyncio.Task | None = None
+        self.dirty = False
+
+    def request(self) -> None:
+        if self.task is not None:
+            self.dirty = True
+            return
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                self.dirty = False
+                try:
+                    async with async_session_maker() as session:
+                        await load_search_index(session)
+                except Exception as exc:
+                    logger.warning(f"Search index rebuild failed: {exc}")
+                if not self.dirty:
+                    return
+        finally:
+            self.task = None
+
+
+def rebuild_search_index() -> None:
+    """
+    Rebuild the search index in the background, used when changes may have
+    been lost.
+    """
+    if search_index.enabled:
+        search_index_rebuilder.request()
+
+
+def apply_post_change(payload: str) -> None:
+    search_index.apply(json.loads(payload))
+
+
+search_index = PostSearchIndex()
+search_index_rebuilder = SearchIndexRebuilder()
+if settings.SEARCH_INDEX_ENABLED:
+    pg_listener.listen(POST_CHANNEL, apply_post_change)
+    # the index keeps category names, renames and full flushes after missed
+    # notifications rebuild it
+    invalidation_bus.register("category", lambda id_: rebuild_search_index())
@@ -1,30 +1,165 @@
+import base64
+import json
+from collections.abc import Iterable
+from datetime import datetime
+
 from fastapi import Depends
 from fastapi import HTTPException
 from fastapi import status
+from pydantic import BaseModel
+from sqlalchemy import and_
+from sqlalchemy import ARRAY
+from sqlalchemy import cast
+from sqlalchemy import delete
+from sqlalchemy import func
+from sqlalchemy import literal
+from sqlalchemy import or_
+from sqlalchemy import Text
+from sqlalchemy import union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.orm import load_only
+from sqlalchemy.orm import raiseload
+from sqlalchemy.orm import selectinload
 
+from app.config import settings
 from app.db.conection import get_async_session
+from app.db.models import post_categories
+from app.db.models import post_tags
+from app.db.models.category import Category
 from app.db.models.post import Post
+from app.db.models.tag import Tag
+from app.fields import sparse_model
+from app.post.loader import post_loader
 from app.post.schemas import CategorySchema
 from app.post.schemas import PostRetrieve
+from app.post.schemas import PostSummary
 from app.post.schemas import TagSchema
+from app.post.stream import POST_CHANNEL
 
 
 async def get_post(post_id: int, session: AsyncSession):
     """
-    Get a post by its id.
+    Get a post by its id with its categories and tags.
+    Posts requested concurrently in the same request are loaded in one batch.
 
     Args:
         post_id: The id of the post
         session: The database session
 
     Returns:
-        The post
+        The post or None if there is no such post
+    """
+    return await post_loader(session).load(post_id)
+
+
+async def find_missing_names(
+    session: AsyncSession, model, names: list[str], known: Iterable[str]
+) -> set[str]:
+    """
+    Find the names without a category or tag, only querying the names which
+    are not known to exist.
+
+    Args:
+        session: The database session
+        model: Category or Tag
+        names: The names to be checked
+        known: Names known to exist, e.g. the ones in the search index
+
+    Returns:
+        The names not found
+    """
+    unknown = set(names) - set(known)
+    if not unknown:
+        return set()
+    result = await session.execute(select(model.name).filter(model.name.in_(unknown)))
+    return unknown - set(result.scalars())
+
+
+def post_filters(
+    category_names: list[str] | None,
+    tag_names: list[str] | None,
+    match: str = "any",
+    exclude_category_names: list[str] | None = None,
+    exclude_tag_names: list[str] | None = None,
+    created_after: datetime | None = None,
+    created_before: datetime | None = None,
+) -> list:
+    """
+    Build the where clauses of a post search.
+
+    Args:
+        category_names: The posts must have any (or all) of these categories
+        tag_names: The posts must have any (or all) of these tags
+        match: "any" or "all"
+        exclude_category_names: The posts must have none of these categories
+        exclude_tag_names: The posts must have none of these tags
+        created_after: The posts must be created at or after this moment
+        created_before: The posts must be created before this moment
+
+    Returns:
+        The where clauses for select(Post)
     """
-    result = await session.execute(select(Post).filter_by(id=post_id))
-    post = result.scalars().first()
-    return post
+    combine = or_ if match == "any" else and_
+    filters = created_filters(created_after, created_before)
+    if category_names:
+        filters.append(
+            combine(
+                *(Post.categories.any(Category.name == name) for name in category_names)
+            )
+        )
+    if tag_names:
+        filters.append(
+            combine(*(Post.tags.any(Tag.name == name) for name in tag_names))
+        )
+    if exclude_category_names:
+        filters.append(~Post.categories.any(Category.name.in_(exclude_category_names)))
+    if exclude_tag_names:
+        filters.append(~Post.tags.any(Tag.name.in_(exclude_tag_names)))
+    return filters
+
+
+def created_filters(
+    created_after: datetime | None, created_before: datetime | None
+) -> list:
+    """
+    Build the where clauses of a created_at window, which restrict the scan to
+    the partitions of the window.
+    """
+    filters = []
+    if created_after is not None:
+        filters.append(Post.created_at >= created_after)
+    if created_before is not None:
+        filters.append(Post.created_at < created_before)
+    return filters
+
+
+def parse_ids(ids: str) -> list[int]:
+    """
+    Parse a comma separated `ids` query parameter.
+
+    Args:
+        ids: The post ids, e.g. "3,1,2"
+
+    Returns:
+        The post ids in the given order
+
+    Raises:
+        HTTPException: If an id is not an integer or there are too many ids
+    """
+    try:
+        post_ids = [int(post_id) for post_id in ids.split(",") if post_id.strip()]
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="ids must be integers"
+        )
+    if len(post_ids) > settings.POST_IDS_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.POST_IDS_MAX} ids are allowed",
+        )
+    return post_ids
 
 
 def convert_post_to_post_retrieve(post: Post) -> PostRetrieve:
@@ -37,15 +172,413 @@ def convert_post_to_post_retrieve(post: Post) -> PostRetrieve:
     Returns:
         The PostRetrieve object
     """
-    categories = [CategorySchema(name=category.name) for category in post.categories]
-    tags = [TagSchema(name=tag.name) for tag in post.tags]
+    return convert_row_to_post_retrieve(
+        post,
+        [category.name for category in post.categories],
+        [tag.name for tag in post.tags],
+    )
+
+
+def convert_row_to_post_retrieve(
+    row, category_names: list[str], tag_names: list[str]
+) -> PostRetrieve:
+    """
+    Convert a row of the posts table to a PostRetrieve object.
+
+    Args:
+        row: The row or Post object
+        category_names: The category names of the post
+        tag_names: The tag names of the post
+
+    Returns:
+        The PostRetrieve object
+    """
     return PostRetrieve(
+        id=row.id,
+        title=row.title,
+        description=row.description,
+        user_id=row.author_id,
+        created_at=row.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        updated_at=row.updated_at.strftime("%Y-%m-%d %H:%M:%S"),
+        categories=[CategorySchema(name=name) for name in category_names],
+        tags=[TagSchema(name=name) for name in tag_names],
+    )
+
+
+POST_COLUMNS = {
+    "id": Post.id,
+    "title": Post.title,
+    "description": Post.description,
+    "user_id": Post.author_id,
+    "created_at": Post.created_at,
+    "updated_at": Post.updated_at,
+}
+
+
+def post_load_options(fields: frozenset[str] | None) -> list:
+    """
+    Build the loader options selecting only the columns and relationships
+    needed for the requested fields.
+
+    Args:
+        fields: The requested PostRetrieve fields or None for all fields
+
+    Returns:
+        The loader options for select(Post)
+    """
+    if fields is None:
+        return [selectinload(Post.categories), selectinload(Post.tags)]
+
+    columns = [column for name, column in POST_COLUMNS.items() if name in fields]
+    options = [load_only(Post.id, Post.version, *columns)]
+    for name in ("categories", "tags"):
+        relationship = getattr(Post, name)
+        options.append(
+            selectinload(relationship) if name in fields else raiseload(relationship)
+        )
+    return options
+
+
+def convert_post_to_fields(post: Post, fields: frozenset[str]) -> BaseModel:
+    """
+    Convert a Post object loaded with post_load_options to a lean response model
+    with only the requested fields.
+
+    Args:
+        post: The Post object
+        fields: The requested PostRetrieve fields
+
+    Returns:
+        The lean response model
+    """
+    data = {}
+    for name in fields:
+        if name == "categories":
+            data[name] = [
+                CategorySchema(name=category.name) for category in post.categories
+            ]
+        elif name == "tags":
+            data[name] = [TagSchema(name=tag.name) for tag in post.tags]
+        elif name in ("created_at", "updated_at"):
+            data[name] = getattr(post, name).strftime("%Y-%m-%d %H:%M:%S")
+        else:
+            data[name] = getattr(post, POST_COLUMNS[name].key)
+    return sparse_model(PostRetrieve, fields)(**data)
+
+
+def convert_post_to_post_summary(post: Post) -> PostSummary:
+    """
+    Convert a Post object to a PostSummary object.
+
+    Args:
+        post: The Post object
+
+    Returns:
+        The PostSummary object
+    """
+    return PostSummary(
         id=post.id,
         title=post.title,
-        description=post.description,
-        user_id=post.author_id,
-        created_at=post.created_at.strftime("%Y-%m-%d %H:%M:%S"),
         updated_at=post.updated_at.strftime("%Y-%m-%d %H:%M:%S"),
-        categories=categories,
-        tags=tags,
     )
+
+
+def encode_cursor(updated_at: datetime, post_id: int) -> str:
+    """
+    Encode the position of a post in a feed ordered by updated_at desc, id asc.
+
+    Args:
+        updated_at: The updated_at of the last returned post
+        post_id: The id of the last returned post
+
+    Returns:
+        The opaque cursor
+    """
+    raw = f"{updated_at.isoformat()}|{post_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """
+    Decode a cursor created by encode_cursor.
+
+    Args:
+        cursor: The opaque cursor
+
+    Returns:
+        The updated_at and id of the last returned post
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    updated_at, post_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(updated_at), int(post_id)
+
+
+def build_post_change(
+    event: str,
+    post_id: int,
+    author_id: int,
+    category_names: list[str],
+    tag_names: list[str],
+    updated_at: datetime,
+) -> dict:
+    """
+    Build the change feed entry of a post.
+
+    Args:
+        event: "create", "update" or "delete"
+        post_id: The id of the post
+        author_id: The id of the author of the post
+        category_names: The category names of the post
+        tag_names: The tag names of the post
+        updated_at: The updated_at of the post
+
+    Returns:
+        The post change
+    """
+    if event == "delete":
+        updated_at = datetime.utcnow()
+    return {
+        "event": event,
+        "id": post_id,
+        "author_id": author_id,
+        "categories": list(category_names),
+        "tags": list(tag_names),
+        "updated_at": updated_at.isoformat(),
+    }
+
+
+def post_change(event: str, post: Post) -> dict:
+    """
+    Build the change feed entry of a Post object.
+
+    Args:
+        event: "create", "update" or "delete"
+        post: The Post object
+
+    Returns:
+        The post change
+    """
+    return build_post_change(
+        event,
+        post.id,
+        post.author_id,
+        [category.name for category in post.categories],
+        [tag.name for tag in post.tags],
+        post.updated_at,
+    )
+
+
+async def notify_post_change(session: AsyncSession, change: dict) -> None:
+    """
+    Queue a post change notification in the current transaction.
+    Postgres delivers it to the listeners only when the transaction commits.
+
+    Args:
+        session: The database session
+        change: The post change
+    """
+    payload = json.dumps(change)
+    await session.execute(select(func.pg_notify(POST_CHANNEL, payload)))
+
+
+async def notify_post_changes(session: AsyncSession, changes: list[dict]) -> None:
+    """
+    Queue the notifications of many post changes with one statement.
+
+    Args:
+        session: The database session
+        changes: The post changes
+    """
+    if not changes:
+        return
+    payloads = func.unnest(
+        cast([json.dumps(change) for change in changes], ARRAY(Text))
+    ).column_valued("payload")
+    await session.execute(select(func.pg_notify(POST_CHANNEL, payloads)))
+
+
+async def get_categories_by_names(
+    session: AsyncSession, category_names: list[str]
+) -> list[Category]:
+    """
+    Get the categories with the given names.
+
+    Args:
+        session: The database session
+        category_names: The category names
+
+    Returns:
+        The categories in the order of the given names
+
+    Raises:
+        HTTPException: If any of the categories does not exist
+    """
+    result = await session.execute(
+        select(Category).filter(
+            Category.name.in_(category_names), Category.deleted_at.is_(None)
+        )
+    )
+    categories = {category.name: category for category in result.scalars()}
+    missing_categories = set(category_names) - set(categories)
+    if missing_categories:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Categories not found: {', '.join(missing_categories)}",
+        )
+    return [categories[name] for name in dict.fromkeys(category_names)]
+
+
+async def get_or_create_tags(session: AsyncSession, tag_names: list[str]) -> list[Tag]:
+    """
+    Get the tags with the given names, creating the missing ones in one statement.
+
+    Args:
+        session: The database session
+        tag_names: The tag names
+
+    Returns:
+        The tags in the order of the given names
+    """
+    tag_names = list(dict.fromkeys(tag_names))
+    if not tag_names:
+        return []
+    await session.execute(
+        pg_insert(Tag)
+        .values([{"name": name} for name in tag_names])
+        .on_conflict_do_nothing(index_elements=[Tag.name])
+    )
+    result = await session.execute(select(Tag).filter(Tag.name.in_(tag_names)))
+    tags = {tag.name: tag for tag in result.scalars()}
+    return [tags[name] for name in tag_names]
+
+
+async def get_post_taxonomy(
+    session: AsyncSession, post_id: int
+) -> tuple[list[str], list[str]]:
+    """
+    Get the category and tag names of a post in one query.
+
+    Args:
+        session: The database session
+        post_id: The id of the post
+
+    Returns:
+        The category names and the tag names of the post
+    """
+    categories = (
+        select(literal("category").label("kind"), Category.name)
+        .join(post_categories, post_categories.c.category_id == Category.id)
+        .filter(post_categories.c.post_id == post_id)
+    )
+    tags = (
+        select(literal("tag").label("kind"), Tag.name)
+        .join(post_tags, post_tags.c.tag_id == Tag.id)
+        .filter(post_tags.c.post_id == post_id)
+    )
+    result = await session.execute(union_all(categories, tags))
+    category_names, tag_names = [], []
+    for kind, name in result.all():
+        (category_names if kind == "category" else tag_names).append(name)
+    return category_names, tag_names
+
+
+async def replace_post_categories(
+    session: AsyncSession, post_id: int, created_at: datetime, category_ids: list[int]
+) -> None:
+    """
+    Set the categories of a post, only deleting and inserting the differences.
+
+    Args:
+        session: The database session
+        post_id: The id of the post
+        created_at: The created_at of the post, the partition key of its rows
+        category_ids: The new category ids of the post
+    """
+    await session.execute(
+        delete(post_categories).where(
+            post_categories.c.post_id == post_id,
+            post_categories.c.post_created_at == created_at,
+            post_categories.c.category_id.not_in(category_ids),
+        )
+    )
+    await session.execute(
+        pg_insert(post_categories)
+        .values(
+            [
+                {"post_id": post_id, "post_created_at": created_at, "category_id": id_}
+                for id_ in category_ids
+            ]
+        )
+        .on_conflict_do_nothing()
+    )
+
+
+async def replace_post_tags(
+    session: AsyncSession, post_id: int, created_at: datetime, tags: list[Tag]
+) -> tuple[list[str], list[str]]:
+    """
+    Set the tags of a post, only deleting and inserting the differences.
+
+    Args:
+        session: The database session
+        post_id: The id of the post
+        created_at: The created_at of the post, the partition key of its rows
+        tags: The new tags of the post
+
+    Returns:
+        The names of the added tags and the names of the removed tags
+    """
+    names = {tag.id: tag.name for tag in tags}
+    removed = await session.execute(
+        delete(post_tags)
+        .where(
+            post_tags.c.post_id == post_id,
+            post_tags.c.post_created_at == created_at,
+            post_tags.c.tag_id.not_in(list(names)),
+            post_tags.c.tag_id == Tag.id,
+        )
+        .returning(Tag.name)
+    )
+    removed_names = list(removed.scalars())
+    added = await session.execute(
+        pg_insert(post_tags)
+        .values(
+            [
+                {"post_id": post_id, "post_created_at": created_at, "tag_id": id_}
+                for id_ in names
+            ]
+        )
+        .on_conflict_do_nothing()
+        .returning(post_tags.c.tag_id)
+    )
+    added_names = [names[id_] for id_ in added.scalars()]
+    return added_names, removed_names
+
+
+def parse_if_match(if_match: str | None) -> int | None:
+    """
+    Parse the post version from an If-Match header.
+
+    Args:
+        if_match: The If-Match header, e.g. "3" or W/"3"
+
+    Returns:
+        The expected version or None if the header is not set
+
+    Raises:
+        HTTPException: If the header is not a post version
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    value = if_match.strip().removeprefix("W/").strip('"')
+    if not value.isdigit():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid If-Match header"
+        )
+    return int(value)
+
+
+def post_etag(version: int) -> str:
+    return f'"{version}"'
@@ -0,0 +1,106 @@
+import asyncio
+import json
+from dataclasses import dataclass
+from dataclasses import field
+
+from loguru import logger
+
+from app.config import settings
+from app.db.listener import pg_listener
+
+POST_CHANNEL = "post_changes"
+
+
+@dataclass(eq=False)
+class Subscriber:
+    """
+    A client of the post change feed with its filters and bounded queue.
+    A None in the queue tells the client to stop, e.g. after it was dropped.
+    """
+
+    category_names: set[str] = field(default_factory=set)
+    tag_names: set[str] = field(default_factory=set)
+    author_id: int | None = None
+    queue: asyncio.Queue = field(
+        default_factory=lambda: asyncio.Queue(settings.POST_STREAM_QUEUE_SIZE)
+    )
+
+    def matches(self, change: dict) -> bool:
+        if self.author_id is not None and change["author_id"] != self.author_id:
+            return False
+        if self.category_names and self.category_names.isdisjoint(change["categories"]):
+            return False
+        if self.tag_names and self.tag_names.isdisjoint(change["tags"]):
+            return False
+        return True
+
+
+class PostChangeBroker:
+    """
+    Fan out post change notifications of the shared listener connection to the
+    subscribed clients of this worker.
+    """
+
+    def __init__(self):
+        self.subscribers: set[Subscriber] = set()
+
+    def subscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.add(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+
+    def drop(self, subscriber: Subscriber) -> None:
+        """
+        Disconnect a subscriber, it can resume from its last event id.
+
+        Args:
+            subscriber: The subscriber to be dropped
+        """
+        self.unsubscribe(subscriber)
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+
+    def dispatch(self, payload: str) -> None:
+        """
+        Put a change on the queue of every matching subscriber.
+        Subscribers whose queue is full are too slow and get dropped.
+
+        Args:
+            payload: The json payload of the notification
+        """
+        change = json.loads(payload)
+        for subscriber in list(self.subscribers):
+            if not subscriber.matches(change):
+                continue
+            try:
+                subscriber.queue.put_nowait(change)
+            except asyncio.QueueFull:
+                logger.info("Dropping slow post stream subscriber.")
+                self.drop(subscriber)
+
+    def drop_all(self) -> None:
+        """
+        Disconnect every subscriber, used when notifications may have been lost.
+        """
+        for subscriber in list(self.subscribers):
+            self.drop(subscriber)
+
+
+def format_event(change: dict) -> str:
+    """
+    Format a post change as a Server-Sent Event.
+
+    Args:
+        change: The post change
+
+    Returns:
+        The event text
+    """
+    return f"id: {change['updated_at']}\nevent: {change['event']}\ndata: {json.dumps(change)}\n\n"
+
+
+post_change_broker = PostChangeBroker()
+pg_listener.listen(POST_CHANNEL, post_change_broker.dispatch)
+pg_listener.on_reconnect(post_change_broker.drop_all)
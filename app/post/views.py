@@ -0,0 +1,164 @@
+import asyncio
+import math
+from datetime import datetime
+
+from loguru import logger
+from sqlalchemy import BigInteger
+from sqlalchemy import column
+from sqlalchemy import delete
+from sqlalchemy import func
+from sqlalchemy import Integer
+from sqlalchemy import literal
+from sqlalchemy import update
+from sqlalchemy import values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.config import settings
+from app.db.conection import async_session_maker
+from app.db.models.post import Post
+from app.db.models.trend import PostTrend
+
+TRENDING_EPOCH = datetime(2024, 1, 1)
+LN2 = math.log(2)
+# rows are flushed in chunks, each row binds two parameters
+FLUSH_CHUNK_SIZE = 5000
+# scores below 2 ** -PRUNE_HALF_LIVES of a single view now are deleted
+PRUNE_HALF_LIVES = 20
+# 2 ** -x underflows a double past ~1074, and log2(1 + 2 ** -64) is already 0
+MERGE_MAX = 64
+
+
+def half_lives(moment: datetime) -> float:
+    return (moment - TRENDING_EPOCH).total_seconds() / settings.TRENDING_HALF_LIFE
+
+
+class ViewCounter:
+    """
+    Per worker buffer of post views.
+
+    Views are coalesced per post in memory and written by `flush` with one
+    UPDATE ... FROM (VALUES ...) per chunk, and added to the decayed scores of
+    post_trends by one upsert, instead of one write per view. Views buffered
+    when a worker crashes are lost.
+    """
+
+    def __init__(self):
+        self.counts: dict[int, int] = {}
+
+    def increment(self, post_id: int, count: int = 1) -> None:
+        self.counts[post_id] = self.counts.get(post_id, 0) + count
+
+    async def flush(self, session: AsyncSession) -> None:
+        """
+        Write the buffered views, putting them back into the buffer if the
+        write fails.
+
+        Args:
+            session: The database session
+        """
+        counts, self.counts = self.counts, {}
+        if not counts:
+            return
+        # rows are locked in id order, so concurrent flushes can't deadlock
+        rows = sorted(counts.items())
+        try:
+            for start in range(0, len(rows), FLUSH_CHUNK_SIZE):
+                await write_views(session, rows[start : start + FLUSH_CHUNK_SIZE])
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            for post_id, count in counts.items():
+                self.increment(post_id, count)
+            raise
+
+
+async def write_views(session: AsyncSession, rows: list[tuple[int, int]]) -> None:
+    """
+    Add view counts to the posts and to their trending scores.
+
+    Args:
+        session: The database session
+        rows: The (post id, views) pairs
+    """
+    now = datetime.utcnow()
+    batch = values(
+        column("post_id", Integer), column("views", BigInteger), name="batch"
+    ).data(rows)
+
+    await session.execute(
+        update(Post)
+        .where(Post.id == batch.c.post_id)
+        # views are not an edit of the post, keep its updated_at
+        .values(views=Post.views + batch.c.views, updated_at=Post.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+
+    # log2(2 ** a + 2 ** b) = max(a, b) + log2(1 + 2 ** -|a - b|)
+    stmt = pg_insert(PostTrend).from_select(
+        ["post_id", "post_created_at", "log_score", "scored_at"],
+        select(
+            batch.c.post_id,
+            Post.created_at,
+            func.ln(batch.c.views) / LN2 + half_lives(now),
+            literal(now),
+        ).join(Post, Post.id == batch.c.post_id),
+    )
+    difference = stmt.excluded.log_score - PostTrend.log_score
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[PostTrend.post_id],
+            set_={
+                "log_score": func.greatest(PostTrend.log_score, stmt.excluded.log_score)
+                + func.ln(
+                    1 + func.power(2.0, -func.least(func.abs(difference), MERGE_MAX))
+                )
+                / LN2,
+                "scored_at": stmt.excluded.scored_at,
+            },
+        )
+    )
+    await session.execute(
+        delete(PostTrend).where(
+            PostTrend.log_score < half_lives(now) - PRUNE_HALF_LIVES
+        )
+    )
+
+
+async def get_trending_post_ids(session: AsyncSession, limit: int) -> list[int]:
+    """
+    Get the ids of the posts with the highest decayed view scores.
+
+    Args:
+        session: The database session
+        limit: The maximum number of posts
+
+    Returns:
+        The post ids, most trending first
+    """
+    result = await session.execute(
+        select(PostTrend.post_id).order_by(PostTrend.log_score.desc()).limit(limit)
+    )
+    return list(result.scalars())
+
+
+async def flush_views_periodically() -> None:
+    """
+    Background task which flushes the buffered views every VIEW_FLUSH_INTERVAL
+    seconds, and once more when it is cancelled on shutdown.
+    """
+    try:
+        while True:
+            await asyncio.sleep(settings.VIEW_FLUSH_INTERVAL)
+            try:
+                async with async_session_maker() as session:
+                    await view_counter.flush(session)
+            except Exception as exc:
+                logger.warning(f"Flushing post views failed: {exc}")
+    finally:
+        async with async_session_maker() as session:
+            await view_counter.flush(session)
+
+
+view_counter = ViewCounter()
@@ -0,0 +1,249 @@
+import asyncio
+import json
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+from app.config import settings
+
+# the innermost frame matching one of the patterns decides the category of a sample
+CATEGORIES = (
+    ("password_hashing", ("werkzeug/security", "passlib/", "/hashlib")),
+    ("jwt", ("jose/", "app/auth/tokens")),
+    ("sql", ("sqlalchemy/", "asyncpg/")),
+    (
+        "serialization",
+        ("pydantic", "fastapi/encoders", "/json/", "starlette/responses"),
+    ),
+)
+
+
+@dataclass
+class ProfileTarget:
+    """
+    The requests to be profiled, matched by path prefix and/or header.
+    """
+
+    remaining: int
+    path: str | None = None
+    header: str | None = None
+    header_value: str | None = None
+    interval: float = 0.001
+
+    def matches(self, scope) -> bool:
+        if self.path is not None and not scope["path"].startswith(self.path):
+            return False
+        if self.header is not None:
+            name = self.header.lower().encode()
+            values = [value for key, value in scope["headers"] if key == name]
+            if not values:
+                return False
+            if (
+                self.header_value is not None
+                and self.header_value.encode() not in values
+            ):
+                return False
+        return True
+
+
+def categorize(frames: list) -> str:
+    for frame in reversed(frames):
+        filename = frame.f_code.co_filename.replace("\\", "/")
+        for category, patterns in CATEGORIES:
+            if any(pattern in filename for pattern in patterns):
+                return category
+    return "app"
+
+
+def task_stack(task: asyncio.Task, loop_thread_id: int) -> list:
+    """
+    Get the stack of a task, outermost frame first.
+
+    Running tasks are read from the frames of the event loop thread, so
+    synchronous work like password hashing is visible. Suspended tasks are read
+    from their chain of awaited coroutines, so time spent waiting on the
+    database is attributed too.
+    """
+    coro = task.get_coro()
+    root = getattr(coro, "cr_frame", None)
+    if root is None:
+        return []
+
+    if asyncio.tasks._current_tasks.get(task.get_loop()) is task:
+        frames = []
+        frame = sys._current_frames().get(loop_thread_id)
+        while frame is not None:
+            frames.append(frame)
+            if frame is root:
+                return frames[::-1]
+            frame = frame.f_back
+
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return frames
+
+
+class RequestSampler(threading.Thread):
+    """
+    Sample the stack of one request task from a background thread.
+    """
+
+    def __init__(self, task: asyncio.Task, interval: float):
+        super().__init__(daemon=True)
+        self.task = task
+        self.interval = interval
+        self.loop_thread_id = threading.get_ident()
+        self.stopped = threading.Event()
+        self.samples: list[tuple[tuple[tuple[str, str, int], ...], str]] = []
+        self.started_at = time.perf_counter()
+        self.duration = 0.0
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            frames = task_stack(self.task, self.loop_thread_id)
+            if not frames:
+                continue
+            stack = tuple(
+                (frame.f_code.co_qualname, frame.f_code.co_filename, frame.f_lineno)
+                for frame in frames
+            )
+            self.samples.append((stack, categorize(frames)))
+
+    def stop(self) -> None:
+        self.duration = time.perf_counter() - self.started_at
+        self.stopped.set()
+        self.join()
+
+
+def write_profile(sampler: RequestSampler, method: str, path: str, status: int) -> str:
+    """
+    Write the samples of a request as speedscope and folded stack files.
+
+    Args:
+        sampler: The stopped sampler
+        method: The request method
+        path: The request path
+        status: The response status code
+
+    Returns:
+        The name of the profile
+    """
+    directory = Path(settings.PROFILES_PATH)
+    directory.mkdir(parents=True, exist_ok=True)
+    slug = re.sub(r"[^a-zA-Z0-9]+", "_", path).strip("_") or "root"
+    name = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{method}-{slug}"
+    interval_ms = sampler.interval * 1000
+
+    frame_index: dict[tuple[str, str, int], int] = {}
+    samples = []
+    folded = Counter()
+    categories = Counter()
+    for stack, category in sampler.samples:
+        samples.append(
+            [frame_index.setdefault(frame, len(frame_index)) for frame in stack]
+        )
+        folded[
+            ";".join(f"{qualname} ({Path(file).name})" for qualname, file, _ in stack)
+        ] += 1
+        categories[category] += 1
+
+    speedscope = {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {
+            "frames": [
+                {"name": qualname, "file": file, "line": line}
+                for qualname, file, line in frame_index
+            ]
+        },
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": f"{method} {path}",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": len(samples) * interval_ms,
+                "samples": samples,
+                "weights": [interval_ms] * len(samples),
+            }
+        ],
+        "name": name,
+        "exporter": "app.profiling",
+    }
+    meta = {
+        "name": name,
+        "method": method,
+        "path": path,
+        "status": status,
+        "duration_ms": round(sampler.duration * 1000, 3),
+        "samples": len(samples),
+        "categories_ms": {
+            category: round(count * interval_ms, 3)
+            for category, count in categories.items()
+        },
+    }
+
+    (directory / f"{name}.speedscope.json").write_text(json.dumps(speedscope))
+    (directory / f"{name}.folded").write_text(
+        "".join(f"{stack} {count}\n" for stack, count in folded.items())
+    )
+    (directory / f"{name}.meta.json").write_text(json.dumps(meta))
+    return name
+
+
+class RequestProfiler:
+    """
+    Holds the current profile target. While no target is armed the profiling
+    middleware only checks `target is None`.
+    """
+
+    def __init__(self):
+        self.target: ProfileTarget | None = None
+        self._lock = threading.Lock()
+
+    def arm(self, target: ProfileTarget) -> None:
+        self.target = target
+
+    def disarm(self) -> None:
+        self.target = None
+
+    def claim(self, scope) -> float | None:
+        """
+        Check if a request should be profiled and count it against the target.
+
+        Args:
+            scope: The ASGI scope of the request
+
+        Returns:
+            The sampling interval or None if the request is not profiled
+        """
+        target = self.target
+        if target is None or not target.matches(scope):
+            return None
+        with self._lock:
+            if target.remaining <= 0:
+                return None
+            target.remaining -= 1
+            if target.remaining == 0:
+                self.target = None
+        return target.interval
+
+
+def list_profiles() -> list[dict]:
+    directory = Path(settings.PROFILES_PATH)
+    if not directory.exists():
+        return []
+    metas = [json.loads(path.read_text()) for path in directory.glob("*.meta.json")]
+    return sorted(metas, key=lambda meta: meta["name"], reverse=True)
+
+
+request_profiler = RequestProfiler()
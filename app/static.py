@@ -0,0 +1,223 @@
+import gzip
+import os
+import re
+from mimetypes import guess_type
+from pathlib import Path
+
+import anyio
+from loguru import logger
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.responses import Response
+from starlette.staticfiles import NotModifiedResponse
+from starlette.staticfiles import StaticFiles
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+from app.config import settings
+from app.middleware.compression import accepted_encodings
+from app.middleware.compression import brotli
+from app.middleware.compression import is_compressible
+
+# avatars are named by uuid4, after the author id in the object store, and
+# built assets by a content hash, so their content never changes under the same name
+CONTENT_NAMED = re.compile(
+    r"(^(\d+-)?[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$)|(\.[0-9a-f]{8,}$)"
+)
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+
+def cache_control(path: str) -> str:
+    """
+    Get the Cache-Control header of a static file.
+
+    Args:
+        path: The path of the file
+
+    Returns:
+        The header value
+    """
+    if CONTENT_NAMED.search(Path(path).stem):
+        return "public, max-age=31536000, immutable"
+    return f"public, max-age={settings.STATIC_MAX_AGE}"
+
+
+def parse_range(range_header: str, size: int) -> tuple[int, int] | None:
+    """
+    Parse a single byte range of a Range header.
+
+    Args:
+        range_header: The Range header, e.g. "bytes=0-1023"
+        size: The size of the file
+
+    Returns:
+        The first and last byte positions, or None if the range is not a single
+        byte range
+
+    Raises:
+        ValueError: If the range is not satisfiable
+    """
+    match = RANGE.match(range_header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+    if first > last or first >= size:
+        raise ValueError("unsatisfiable range")
+    return first, last
+
+
+class RangeFileResponse(FileResponse):
+    """
+    A 206 response with a single byte range of a file.
+    """
+
+    def __init__(self, path: str, first: int, last: int, **kwargs):
+        super().__init__(path, status_code=206, **kwargs)
+        self.first = first
+        self.last = last
+        self.headers[
+            "content-range"
+        ] = f"bytes {first}-{last}/{self.stat_result.st_size}"
+        self.headers["content-length"] = str(last - first + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+            return
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.first)
+            remaining = self.last - self.first + 1
+            while remaining:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                remaining -= len(chunk)
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": bool(remaining) and bool(chunk),
+                    }
+                )
+                if not chunk:
+                    break
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles with Cache-Control headers, single byte range requests and
+    precompressed .br/.gz siblings, so nothing is compressed at request time.
+    """
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        headers = {
+            "cache-control": cache_control(str(full_path)),
+            "accept-ranges": "bytes",
+            "vary": "Accept-Encoding",
+        }
+        media_type = guess_type(str(full_path))[0] or "text/plain"
+        range_header = request_headers.get("range")
+
+        response = None
+        if not range_header:
+            encodings = accepted_encodings(request_headers.get("accept-encoding", ""))
+            for encoding, suffix in PRECOMPRESSED:
+                if encoding not in encodings:
+                    continue
+                sibling = f"{full_path}{suffix}"
+                try:
+                    sibling_stat = os.stat(sibling)
+                except OSError:
+                    continue
+                if sibling_stat.st_mtime < stat_result.st_mtime:
+                    continue
+                response = FileResponse(
+                    sibling,
+                    status_code=status_code,
+                    headers={**headers, "content-encoding": encoding},
+                    media_type=media_type,
+                    stat_result=sibling_stat,
+                )
+                break
+
+        if response is None:
+            response = FileResponse(
+                full_path,
+                status_code=status_code,
+                headers=headers,
+                media_type=media_type,
+                stat_result=stat_result,
+            )
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+
+        if range_header and status_code == 200:
+            if_range = request_headers.get("if-range")
+            if if_range is None or if_range == response.headers["etag"]:
+                try:
+                    byte_range = parse_range(range_header, stat_result.st_size)
+                except ValueError:
+                    return Response(
+                        status_code=416,
+                        headers={"content-range": f"bytes */{stat_result.st_size}"},
+                    )
+                if byte_range is not None:
+                    return RangeFileResponse(
+                        full_path,
+                        *byte_range,
+                        headers=headers,
+                        media_type=media_type,
+                        stat_result=stat_result,
+                    )
+        return response
+
+
+def precompress_directory(directory: Path) -> None:
+    """
+    Write .gz and, if brotli is installed, .br siblings of the compressible files
+    of a directory which are missing or older than the file.
+
+    Args:
+        directory: The static files directory
+    """
+    for path in directory.rglob("*"):
+        if not path.is_file() or path.suffix in (".gz", ".br"):
+            continue
+        if not is_compressible(guess_type(path.name)[0] or ""):
+            continue
+        stat_result = path.stat()
+        if stat_result.st_size < settings.COMPRESSION_MIN_SIZE:
+            continue
+
+        data = None
+        for encoding, suffix in PRECOMPRESSED:
+            if encoding == "br" and brotli is None:
+                continue
+            sibling = path.with_name(path.name + suffix)
+            if sibling.exists() and sibling.stat().st_mtime >= stat_result.st_mtime:
+                continue
+            data = data if data is not None else path.read_bytes()
+            if encoding == "br":
+                sibling.write_bytes(brotli.compress(data, quality=11))
+            else:
+                sibling.write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+            logger.info(f"Precompressed {sibling}")
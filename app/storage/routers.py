@@ -0,0 +1,54 @@
+from fastapi import APIRouter
+from fastapi import Header
+from fastapi import HTTPException
+from fastapi import Request
+from fastapi import Response
+from fastapi import status
+
+from app.config import settings
+from app.storage.services import LocalObjectStore
+from app.storage.services import object_store
+
+storage_router = APIRouter(prefix="/api/storage", tags=["storage"])
+
+
+@storage_router.put("/{key:path}")
+async def upload_object(
+    key: str,
+    request: Request,
+    expires: int,
+    signature: str,
+    content_type: str = Header(),
+    content_length: int | None = Header(default=None),
+):
+    """
+    upload an object to the local object store with a presigned URL, like a
+    presigned PUT to S3
+
+    Args:
+        key: The key of the object
+        request: The request, whose body is the object
+        expires: The expiry of the URL, a unix timestamp
+        signature: The signature of the URL
+        content_type: The content type the URL was signed for
+        content_length: The size of the object
+
+    Returns:
+        An empty response
+    """
+    if not isinstance(object_store, LocalObjectStore):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if not object_store.verify(key, content_type, expires, signature):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Invalid signature"
+        )
+    too_large = HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Object too large"
+    )
+    if content_length is not None and content_length > settings.AVATAR_MAX_SIZE:
+        raise too_large
+    try:
+        await object_store.write(key, request.stream(), settings.AVATAR_MAX_SIZE)
+    except ValueError:
+        raise too_large
+    return Response(status_code=status.HTTP_200_OK)
@@ -0,0 +1,331 @@
+"""
+Object stores of the avatars.
+
+Clients upload an avatar straight to the store with a presigned PUT URL and
+download it with the URL of its key, the app only records the key on
+Author.image. "local" keeps the objects in a directory served by the web
+server at STORAGE_LOCAL_URL, "s3" in a bucket of S3 or of an S3 compatible
+store like MinIO, with Signature V4 presigned URLs.
+
+Keys are fanned out over two levels of subdirectories by a hash of the file
+name, e.g. avatars/3f/a0/42-<uuid4>.png for author 42, so no directory grows
+with the number of authors.
+"""
+import asyncio
+import hashlib
+import hmac
+import re
+import time
+import uuid
+from collections.abc import AsyncIterator
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import quote
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+
+import anyio
+import httpx
+from loguru import logger
+
+from app.config import project_dir
+from app.config import settings
+
+DEFAULT_IMAGE = "static/no_image.png"
+# the accepted avatar types and the extensions of their keys
+AVATAR_TYPES = {"image/jpeg": "jpg", "image/png": "png", "image/gif": "gif"}
+AVATAR_TYPE_PATTERN = "^image/(jpeg|png|gif)$"
+AVATAR_KEY = re.compile(
+    r"^avatars/([0-9a-f]{2})/([0-9a-f]{2})/((\d+)-[0-9a-f]{8}-[0-9a-f]{4}-"
+    r"[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.(jpg|png|gif))$"
+)
+# values of Author.image from before the object store, paths of static/
+LEGACY_PREFIX = "static/"
+
+
+def avatar_key(author_id: int, content_type: str) -> str:
+    """
+    Build a new key for an avatar of an author.
+
+    Args:
+        author_id: The id of the author
+        content_type: One of AVATAR_TYPES
+
+    Returns:
+        The key
+    """
+    name = f"{author_id}-{uuid.uuid4()}.{AVATAR_TYPES[content_type]}"
+    digest = hashlib.sha256(name.encode()).hexdigest()
+    return f"avatars/{digest[:2]}/{digest[2:4]}/{name}"
+
+
+def is_avatar_key(key: str, author_id: int) -> bool:
+    """
+    Check that a key was built by `avatar_key` for the author.
+    """
+    match = AVATAR_KEY.match(key)
+    if match is None or int(match[4]) != author_id:
+        return False
+    digest = hashlib.sha256(match[3].encode()).hexdigest()
+    return match[1] == digest[:2] and match[2] == digest[2:4]
+
+
+def sign(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+
+class LocalObjectStore:
+    """
+    Objects in a local directory. Uploads go to the signed PUT route of
+    app.storage.routers, the stand-in for direct uploads in development,
+    downloads to the web server of the directory at `base_url`.
+    """
+
+    def __init__(self, root: Path, base_url: str):
+        self.root = root.resolve()
+        self.base_url = base_url.rstrip("/")
+
+    def path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root not in path.parents:
+            raise ValueError(f"Key outside of the store: {key}")
+        return path
+
+    def signature(self, key: str, content_type: str, expires: int) -> str:
+        message = f"PUT\n{key}\n{content_type}\n{expires}"
+        return hmac.new(
+            settings.SECRET.encode(), message.encode(), hashlib.sha256
+        ).hexdigest()
+
+    def presign_put(self, key: str, content_type: str) -> str:
+        expires = int(time.time()) + settings.STORAGE_UPLOAD_EXPIRES
+        query = urlencode(
+            {
+                "expires": expires,
+                "signature": self.signature(key, content_type, expires),
+            }
+        )
+        return f"/api/storage/{quote(key)}?{query}"
+
+    def verify(self, key: str, content_type: str, expires: int, signature: str) -> bool:
+        return expires >= time.time() and hmac.compare_digest(
+            signature, self.signature(key, content_type, expires)
+        )
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{quote(key)}"
+
+    async def write(self, key: str, chunks: AsyncIterator[bytes], max_size: int) -> int:
+        """
+        Write an uploaded object, replacing it atomically.
+
+        Args:
+            key: The key of the object
+            chunks: The body of the upload
+            max_size: The maximum size in bytes
+
+        Returns:
+            The size of the object
+
+        Raises:
+            ValueError: If the object is larger than `max_size`
+        """
+        path = self.path(key)
+        await anyio.Path(path.parent).mkdir(parents=True, exist_ok=True)
+        part = path.with_name(f"{path.name}.part")
+        size = 0
+        try:
+            async with await anyio.open_file(part, "wb") as file:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > max_size:
+                        raise ValueError("Object too large")
+                    await file.write(chunk)
+            await anyio.Path(part).rename(path)
+        except BaseException:
+            await anyio.Path(part).unlink(missing_ok=True)
+            raise
+        return size
+
+    async def size(self, key: str) -> int | None:
+        try:
+            return (await anyio.Path(self.path(key)).stat()).st_size
+        except (FileNotFoundError, ValueError):
+            return None
+
+    async def delete(self, key: str) -> None:
+        await anyio.Path(self.path(key)).unlink(missing_ok=True)
+
+
+class S3ObjectStore:
+    """
+    Objects in a bucket of an S3 compatible store, addressed path style as
+    `endpoint`/`bucket`/key, which MinIO and AWS both accept.
+
+    Presigned GET URLs are signed at the start of a window of half of
+    STORAGE_DOWNLOAD_EXPIRES, so the URL of an avatar stays the same, and
+    cached by browsers, for the window and is valid for at least half of the
+    expiry. With `public_url`, e.g. a CDN or a public bucket, plain URLs are
+    used instead.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        bucket: str,
+        region: str,
+        access_key: str,
+        secret_key: str,
+        public_url: str | None = None,
+    ):
+        self.endpoint = endpoint.rstrip("/")
+        self.host = urlsplit(self.endpoint).netloc
+        self.bucket = bucket
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.public_url = public_url.rstrip("/") if public_url else None
+        self.client = httpx.AsyncClient(timeout=10)
+
+    def presign(
+        self,
+        method: str,
+        key: str,
+        expires: int,
+        headers: dict[str, str] | None = None,
+        moment: datetime | None = None,
+    ) -> str:
+        """
+        Presign a request with AWS Signature Version 4 query parameters.
+
+        Args:
+            method: The HTTP method
+            key: The key of the object
+            expires: The validity of the URL in seconds
+            headers: Headers which the request must send with these values
+            moment: The signing time, now by default
+
+        Returns:
+            The presigned URL
+        """
+        moment = moment or datetime.utcnow()
+        timestamp = moment.strftime("%Y%m%dT%H%M%SZ")
+        date = moment.strftime("%Y%m%d")
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        path = f"/{self.bucket}/{quote(key, safe='/~')}"
+        headers = {
+            "host": self.host,
+            **{name.lower(): value.strip() for name, value in (headers or {}).items()},
+        }
+        signed_headers = ";".join(sorted(headers))
+        parameters = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key}/{scope}",
+            "X-Amz-Date": timestamp,
+            "X-Amz-Expires": str(expires),
+            "X-Amz-SignedHeaders": signed_headers,
+        }
+        query = "&".join(
+            f"{quote(name, safe='~')}={quote(value, safe='~')}"
+            for name, value in sorted(parameters.items())
+        )
+        canonical_request = "\n".join(
+            [
+                method,
+                path,
+                query,
+                "".join(f"{name}:{headers[name]}\n" for name in sorted(headers)),
+                signed_headers,
+                "UNSIGNED-PAYLOAD",
+            ]
+        )
+        string_to_sign = "\n".join(
+            [
+                "AWS4-HMAC-SHA256",
+                timestamp,
+                scope,
+                hashlib.sha256(canonical_request.encode()).hexdigest(),
+            ]
+        )
+        signing_key = f"AWS4{self.secret_key}".encode()
+        for part in (date, self.region, "s3", "aws4_request"):
+            signing_key = sign(signing_key, part)
+        signature = hmac.new(
+            signing_key, string_to_sign.encode(), hashlib.sha256
+        ).hexdigest()
+        return f"{self.endpoint}{path}?{query}&X-Amz-Signature={signature}"
+
+    def presign_put(self, key: str, content_type: str) -> str:
+        return self.presign(
+            "PUT",
+            key,
+            settings.STORAGE_UPLOAD_EXPIRES,
+            headers={"Content-Type": content_type},
+        )
+
+    def url(self, key: str) -> str:
+        if self.public_url:
+            return f"{self.public_url}/{quote(key)}"
+        expires = settings.STORAGE_DOWNLOAD_EXPIRES
+        now = int(time.time())
+        window_start = now - now % max(expires // 2, 1)
+        return self.presign(
+            "GET", key, expires, moment=datetime.utcfromtimestamp(window_start)
+        )
+
+    async def size(self, key: str) -> int | None:
+        response = await self.client.head(self.presign("HEAD", key, 60))
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return int(response.headers["content-length"])
+
+    async def delete(self, key: str) -> None:
+        response = await self.client.delete(self.presign("DELETE", key, 60))
+        if response.status_code != 404:
+            response.raise_for_status()
+
+
+def create_object_store() -> LocalObjectStore | S3ObjectStore:
+    if settings.STORAGE_BACKEND == "local":
+        return LocalObjectStore(settings.STORAGE_LOCAL_PATH, settings.STORAGE_LOCAL_URL)
+    if settings.STORAGE_BACKEND == "s3":
+        return S3ObjectStore(
+            settings.STORAGE_S3_ENDPOINT,
+            settings.STORAGE_S3_BUCKET,
+            settings.STORAGE_S3_REGION,
+            settings.STORAGE_S3_ACCESS_KEY,
+            settings.STORAGE_S3_SECRET_KEY,
+            settings.STORAGE_PUBLIC_URL,
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND {settings.STORAGE_BACKEND}")
+
+
+def image_url(image: str | None) -> str | None:
+    """
+    Get the URL of the value of Author.image, a key of the object store or a
+    path of static/ from before it.
+    """
+    if image is None or image.startswith(LEGACY_PREFIX):
+        return image
+    return object_store.url(image)
+
+
+async def delete_image(image: str | None) -> None:
+    """
+    Delete the avatar of the value of Author.image, if it is not the default
+    image. Failures are only logged, the object is left behind.
+    """
+    if image is None or image == DEFAULT_IMAGE:
+        return
+    try:
+        if image.startswith(LEGACY_PREFIX):
+            path = project_dir.parent / image
+            await asyncio.to_thread(path.unlink, missing_ok=True)
+        else:
+            await object_store.delete(image)
+    except Exception as exc:
+        logger.warning(f"Deleting the image {image} failed: {exc}")
+
+
+object_store = create_object_store()
@@ -0,0 +1,35 @@
+from fastapi import Depends
+from fastapi import Query
+from fastapi.routing import APIRouter
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.conection import get_async_session
+from app.tag.schemas import TagSuggestion
+from app.tag.services import suggest_tags_from_db
+from app.tag.services import tag_index
+
+tag_router = APIRouter(prefix="/api/tag", tags=["tags"])
+
+
+@tag_router.get("/suggest", response_model=list[TagSuggestion])
+async def suggest_tags(
+    prefix: str = Query(min_length=1, max_length=50),
+    limit: int = Query(10, ge=1, le=50),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Suggest tag names starting with the given prefix, most used first
+
+    Args:
+        prefix: The prefix of the tag names
+        limit: The maximum number of suggestions
+        session: The database session
+
+    Returns:
+        A list of tag names with their number of posts
+    """
+    if tag_index.enabled:
+        suggestions = tag_index.suggest(prefix, limit)
+    else:
+        suggestions = await suggest_tags_from_db(session, prefix, limit)
+    return [TagSuggestion(name=name, posts=posts) for name, posts in suggestions]
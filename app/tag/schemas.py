@@ -0,0 +1,6 @@
+from pydantic import BaseModel
+
+
+class TagSuggestion(BaseModel):
+    name: str
+    posts: int
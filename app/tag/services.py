@@ -0,0 +1,223 @@
+import asyncio
+import bisect
+import heapq
+from collections.abc import Iterable
+
+from loguru import logger
+from sqlalchemy import desc
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.db.conection import async_session_maker
+from app.db.invalidation import ALL
+from app.db.invalidation import invalidation_bus
+from app.db.models import post_tags
+from app.db.models.tag import Tag
+
+
+class TagIndex:
+    """
+    In-memory prefix index of tag names ordered by popularity.
+
+    Names are kept in a sorted list, so the names with a given prefix are a
+    contiguous slice found with two binary searches. Top suggestions of slices
+    larger than TAG_INDEX_SCAN_LIMIT are memoized until the next change.
+    The index is disabled when there are more than TAG_INDEX_MAX_SIZE tags,
+    suggestions are then served by the database.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.names: list[str] = []
+        self.counts: dict[str, int] = {}
+        self._memo: dict[tuple[str, int], list[tuple[str, int]]] = {}
+
+    def load(self, counts: dict[str, int]) -> None:
+        self.counts = counts
+        self.names = sorted(counts)
+        self._memo = {}
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+        self.names = []
+        self.counts = {}
+        self._memo = {}
+
+    def update(self, added: Iterable[str] = (), removed: Iterable[str] = ()) -> None:
+        """
+        Apply the tag changes of a committed post write.
+
+        Args:
+            added: The tag names added to a post
+            removed: The tag names removed from a post
+        """
+        if not self.enabled:
+            return
+        for name in added:
+            if name not in self.counts:
+                if len(self.counts) >= settings.TAG_INDEX_MAX_SIZE:
+                    self.disable()
+                    return
+                bisect.insort(self.names, name)
+                self.counts[name] = 0
+            self.counts[name] += 1
+        for name in removed:
+            if name in self.counts:
+                self.counts[name] = max(self.counts[name] - 1, 0)
+        self._memo = {}
+
+    def refresh(self, counts: dict[str, int]) -> None:
+        """
+        Set the post counts of tags as read from the database.
+
+        Args:
+            counts: The number of posts of every refreshed tag
+        """
+        if not self.enabled:
+            return
+        for name, count in counts.items():
+            if name not in self.counts:
+                if len(self.counts) >= settings.TAG_INDEX_MAX_SIZE:
+                    self.disable()
+                    return
+                bisect.insort(self.names, name)
+            self.counts[name] = count
+        self._memo = {}
+
+    def suggest(self, prefix: str, limit: int) -> list[tuple[str, int]]:
+        """
+        Get the most popular tag names starting with the given prefix.
+
+        Args:
+            prefix: The prefix of the tag names
+            limit: The maximum number of suggestions
+
+        Returns:
+            A list of (name, number of posts) pairs
+        """
+        start = bisect.bisect_left(self.names, prefix)
+        end = bisect.bisect_left(self.names, prefix + "\U0010ffff", lo=start)
+        if end - start <= settings.TAG_INDEX_SCAN_LIMIT:
+            return self._top(start, end, limit)
+
+        key = (prefix, limit)
+        if key not in self._memo:
+            self._memo[key] = self._top(start, end, limit)
+        return self._memo[key]
+
+    def _top(self, start: int, end: int, limit: int) -> list[tuple[str, int]]:
+        names = self.names[start:end]
+        best = heapq.nsmallest(limit, names, key=lambda name: -self.counts[name])
+        return [(name, self.counts[name]) for name in best]
+
+
+def tag_popularity_query():
+    return (
+        select(Tag.name, func.count(post_tags.c.post_id))
+        .outerjoin(post_tags, post_tags.c.tag_id == Tag.id)
+        .group_by(Tag.id)
+    )
+
+
+async def load_tag_index(session: AsyncSession) -> None:
+    """
+    Rebuild the tag index from the database, or disable it if there are too many tags.
+
+    Args:
+        session: The database session
+    """
+    total = await session.scalar(select(func.count(Tag.id)))
+    if total > settings.TAG_INDEX_MAX_SIZE:
+        tag_index.disable()
+        return
+    result = await session.execute(tag_popularity_query())
+    tag_index.load(dict(result.all()))
+
+
+class TagIndexRefresher:
+    """
+    Applies the tag invalidations of the other workers: the counts of the
+    invalidated tags are read again in the background, one query per burst of
+    invalidations, and ALL reloads the whole index.
+    """
+
+    def __init__(self):
+        self.names: set[str] = set()
+        self.full = False
+        self.task: asyncio.Task | None = None
+
+    def invalidate(self, name: str) -> None:
+        if name == ALL:
+            self.full = True
+        elif tag_index.enabled:
+            self.names.add(name)
+        else:
+            return
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        try:
+            while self.full or self.names:
+                full, names = self.full, self.names
+                self.full, self.names = False, set()
+                try:
+                    async with async_session_maker() as session:
+                        if full:
+                            await load_tag_index(session)
+                        else:
+                            result = await session.execute(
+                                tag_popularity_query().filter(Tag.name.in_(names))
+                            )
+                            tag_index.refresh(dict(result.all()))
+                except Exception as exc:
+                    logger.warning(f"Tag index refresh failed: {exc}")
+        finally:
+            self.task = None
+
+
+async def suggest_tags_from_db(
+    session: AsyncSession, prefix: str, limit: int
+) -> list[tuple[str, int]]:
+    """
+    Get the most popular tag names starting with the given prefix from the database,
+    using the text_pattern_ops index on tags.name.
+
+    Args:
+        session: The database session
+        prefix: The prefix of the tag names
+        limit: The maximum number of suggestions
+
+    Returns:
+        A list of (name, number of posts) pairs
+    """
+    query = (
+        tag_popularity_query()
+        .filter(Tag.name.startswith(prefix, autoescape=True))
+        .order_by(desc(func.count(post_tags.c.post_id)), Tag.name)
+        .limit(limit)
+    )
+    result = await session.execute(query)
+    return [tuple(row) for row in result.all()]
+
+
+async def refresh_tag_index_periodically() -> None:
+    """
+    Background task which rebuilds the tag index every TAG_INDEX_REFRESH seconds,
+    repairing it if an invalidation of another worker was missed.
+    """
+    while True:
+        try:
+            async with async_session_maker() as session:
+                await load_tag_index(session)
+        except Exception as exc:
+            logger.warning(f"Tag index refresh failed: {exc}")
+        await asyncio.sleep(settings.TAG_INDEX_REFRESH)
+
+
+tag_index = TagIndex()
+tag_index_refresher = TagIndexRefresher()
+invalidation_bus.register("tag", tag_index_refresher.invalidate)
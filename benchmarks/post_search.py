@@ -0,0 +1,105 @@
+"""
+Benchmark of post searches served by the in-memory search index against the
+SQL path of search_posts, on the posts in the configured database.
+
+Usage:
+    python -m benchmarks.post_search [queries]
+"""
+import asyncio
+import random
+import sys
+import time
+
+from sqlalchemy import asc
+from sqlalchemy import desc
+from sqlalchemy.future import select
+
+from app.db.conection import async_session_maker
+from app.db.models.post import Post
+from app.post.search import load_search_index
+from app.post.search import search_index
+from app.post.services import post_filters
+
+PAGE_SIZE = 20
+
+
+def random_query(rng: random.Random) -> dict:
+    category_names = sorted(search_index.categories)
+    tag_names = sorted(search_index.tags)
+    return {
+        "category_names": rng.sample(
+            category_names, min(len(category_names), rng.randint(0, 2))
+        ),
+        "tag_names": rng.sample(tag_names, min(len(tag_names), rng.randint(1, 3))),
+        "match": rng.choice(("any", "all")),
+        "exclude_category_names": [],
+        "exclude_tag_names": rng.sample(
+            tag_names, min(len(tag_names), rng.randint(0, 1))
+        ),
+        "descending": rng.random() < 0.5,
+    }
+
+
+async def sql_page(session, query: dict) -> list[int]:
+    order = desc if query["descending"] else asc
+    stmt = (
+        select(Post.id)
+        .filter(
+            *post_filters(
+                query["category_names"],
+                query["tag_names"],
+                query["match"],
+                query["exclude_category_names"],
+                query["exclude_tag_names"],
+            )
+        )
+        .order_by(order(Post.updated_at), order(Post.id))
+        .limit(PAGE_SIZE)
+    )
+    return list((await session.execute(stmt)).scalars())
+
+
+def index_page(query: dict) -> list[int]:
+    post_ids = search_index.search(
+        query["category_names"],
+        query["tag_names"],
+        query["match"],
+        query["exclude_category_names"],
+        query["exclude_tag_names"],
+    )
+    return search_index.page(post_ids, query["descending"], 0, PAGE_SIZE)
+
+
+async def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    async with async_session_maker() as session:
+        started = time.perf_counter()
+        await load_search_index(session)
+        print(
+            f"index of {len(search_index.posts)} posts, {len(search_index.categories)} "
+            f"categories, {len(search_index.tags)} tags built in "
+            f"{time.perf_counter() - started:.2f}s"
+        )
+        if not search_index.tags:
+            print("no tagged posts to search")
+            return
+
+        rng = random.Random(0)
+        queries = [random_query(rng) for _ in range(count)]
+
+        started = time.perf_counter()
+        sql_pages = [await sql_page(session, query) for query in queries]
+        sql_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        index_pages = [index_page(query) for query in queries]
+        index_elapsed = time.perf_counter() - started
+
+    mismatches = sum(a != b for a, b in zip(sql_pages, index_pages))
+    print(f"{'sql':<8} {sql_elapsed / count * 1e6:>12,.0f} us/query")
+    print(f"{'index':<8} {index_elapsed / count * 1e6:>12,.0f} us/query")
+    print(f"{mismatches} of {count} pages differ")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())